@@ -0,0 +1,239 @@
+import functools
+
+from PIL import Image, ImageFilter
+
+# NumPy is optional, only needed for kernels larger than PIL supports (5x5)
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Lookup table leaving values unchanged
+IDENTITY = tuple(range(256))
+
+
+def _clamp(value: float) -> int:
+    return min(max(int(value + 0.5), 0), 255)
+
+
+# Point operations are described by 256 entry lookup tables (the output value for each input
+# value), built once for each set of parameters. Parameters are whole numbers, factors being
+# given as percentages, so they can be entered in dialogs and batch recipes alike.
+
+@functools.lru_cache(maxsize=256)
+def brightness_lut(percent: int) -> tuple:
+    """
+    Scales every value (100% leaves the image unchanged).
+    :param percent: (int) Brightness as a percentage of the original.
+    :return: (tuple) The lookup table.
+    """
+    return tuple(_clamp(value * percent / 100) for value in range(256))
+
+
+@functools.lru_cache(maxsize=256)
+def contrast_lut(percent: int) -> tuple:
+    """
+    Scales the difference of every value from mid grey (100% leaves the image unchanged).
+    :param percent: (int) Contrast as a percentage of the original.
+    :return: (tuple) The lookup table.
+    """
+    return tuple(_clamp(128 + (value - 128) * percent / 100) for value in range(256))
+
+
+@functools.lru_cache(maxsize=256)
+def gamma_lut(percent: int) -> tuple:
+    """
+    Applies gamma correction, values above 100% brightening the mid tones.
+    :param percent: (int) Gamma as a percentage (100% being a gamma of 1).
+    :return: (tuple) The lookup table.
+    """
+    exponent = 100 / max(percent, 1)
+
+    return tuple(_clamp(255 * (value / 255) ** exponent) for value in range(256))
+
+
+@functools.lru_cache(maxsize=256)
+def levels_lut(black: int, white: int) -> tuple:
+    """
+    Stretches the values between the black and white points over the full range.
+    :param black: (int) Value mapped to black (and below which everything is black).
+    :param white: (int) Value mapped to white (and above which everything is white).
+    :return: (tuple) The lookup table.
+    """
+    if white <= black:
+        raise ValueError('The white point must be above the black point')
+
+    return tuple(_clamp((value - black) * 255 / (white - black)) for value in range(256))
+
+
+@functools.lru_cache(maxsize=256)
+def curves_lut(*points: int) -> tuple:
+    """
+    Maps values along a curve through the given points, interpolating linearly between them
+    (values outside the first and last points take their output).
+    :param points: (int) input, output of each point of the curve.
+    :return: (tuple) The lookup table.
+    """
+    if len(points) < 4 or len(points) % 2:
+        raise ValueError('A curve needs at least two input, output points')
+
+    curve = sorted(zip(points[::2], points[1::2]))
+    lut = []
+
+    for value in range(256):
+        if value <= curve[0][0]:
+            lut.append(_clamp(curve[0][1]))
+        elif value >= curve[-1][0]:
+            lut.append(_clamp(curve[-1][1]))
+        else:
+            (x, y), (x2, y2) = next((start, end) for start, end in zip(curve, curve[1:]) if value <= end[0])
+            lut.append(_clamp(y + (y2 - y) * (value - x) / (x2 - x)))
+
+    return tuple(lut)
+
+
+# Lookup table builders of the point operations, by operation name
+LUTS = {
+    'brightness': brightness_lut,
+    'contrast': contrast_lut,
+    'gamma': gamma_lut,
+    'levels': levels_lut,
+    'curves': curves_lut,
+}
+
+
+@functools.lru_cache(maxsize=256)
+def compose(first: tuple, second: tuple) -> tuple:
+    """
+    Combines two lookup tables into one, so a chain of point operations is applied to the
+    pixels in a single pass.
+    :param first: (tuple) The lookup table applied first.
+    :param second: (tuple) The lookup table applied to its output.
+    :return: (tuple) The combined lookup table.
+    """
+    return tuple(second[value] for value in first)
+
+
+def apply_lut(image: Image, lut: tuple) -> Image:
+    """
+    Maps the colour values of an image through a lookup table (alpha is left unchanged).
+    :param image: (PIL.Image) The image to be adjusted.
+    :param lut: (tuple) The lookup table.
+    :return: (PIL.Image) The adjusted image.
+    """
+    if image.mode not in ('L', 'LA', 'RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+
+    bands = image.getbands()
+
+    return image.point([entry for band in bands for entry in (IDENTITY if band == 'A' else lut)])
+
+
+def gaussian_blur(image: Image, radius: int) -> Image:
+    """
+    Blurs an image with a Gaussian of the given radius, as horizontal then vertical passes
+    (a separable convolution) so the cost grows with the radius rather than its square.
+    :param image: (PIL.Image) The image to be blurred.
+    :param radius: (int) Standard deviation of the Gaussian in pixels.
+    :return: (PIL.Image) The blurred image.
+    """
+    if image.mode in ('P', '1'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+
+    return image.filter(ImageFilter.GaussianBlur(radius))
+
+
+def convolve(image: Image, size: int, *weights: int) -> Image:
+    """
+    Convolves an image with a square kernel, the result being divided by the sum of the
+    weights (or 1 if they sum to 0, as for edge detection). 3x3 and 5x5 kernels are applied
+    by PIL, larger kernels need NumPy (and are applied as two 1-D passes when separable).
+    :param image: (PIL.Image) The image to be filtered.
+    :param size: (int) Width and height of the kernel (odd).
+    :param weights: (int) Weights of the kernel, row by row.
+    :return: (PIL.Image) The filtered image.
+    """
+    if size % 2 == 0 or len(weights) != size * size:
+        raise ValueError(f'A {size}x{size} kernel needs an odd size and {size * size} weights')
+
+    if image.mode in ('P', '1'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+
+    # Rounded, as the weights of a resampled kernel (see scale_kernel) are fractions
+    scale = round(sum(weights), 6) or 1
+
+    if size in (3, 5):
+        return image.filter(ImageFilter.Kernel((size, size), weights, scale))
+
+    if numpy is None:
+        raise ValueError('Kernels larger than 5x5 need NumPy to be installed')
+
+    return _convolve_numpy(image, numpy.array(weights, dtype=numpy.float32).reshape(size, size) / scale)
+
+
+def scale_kernel(scale: float, size: int, *weights: float) -> tuple:
+    """
+    Resamples a kernel for an image reduced by the given scale (such as the preview), so it
+    covers the same part of the picture as it does at full resolution. The weights are averaged
+    by area and keep their sum. A kernel whose weights don't sum to 0 that would be reduced
+    below 3x3 leaves the reduced image as it is.
+    :param scale: (float) Size of the image relative to full resolution.
+    :param size: (int) Width and height of the kernel.
+    :param weights: (float) Weights of the kernel, row by row.
+    :return: (tuple) Size and weights of the resampled kernel (as taken by convolve), None if it
+    would leave the image unchanged.
+    """
+    reduced = round(size * scale)
+    reduced += 1 - reduced % 2
+
+    if reduced < 3:
+        if sum(weights):
+            return None
+        reduced = 3
+
+    if reduced >= size:
+        return (size,) + tuple(weights)
+
+    kernel = Image.new('F', (size, size))
+    kernel.putdata(weights)
+    factor = (size / reduced) ** 2
+
+    return (reduced,) + tuple(value * factor for value in kernel.resize((reduced, reduced), Image.BOX).getdata())
+
+
+def _convolve_numpy(image: Image, kernel) -> Image:
+    """
+    Convolves an image with a kernel using NumPy, edges being extended outwards. A kernel that
+    is the product of a column and a row (such as a box or Gaussian) is applied as two 1-D
+    passes.
+    :param image: (PIL.Image) The image to be filtered.
+    :param kernel: (numpy.ndarray) The normalised kernel.
+    :return: (PIL.Image) The filtered image.
+    """
+    pixels = numpy.asarray(image, dtype=numpy.float32)
+    if pixels.ndim == 2:
+        pixels = pixels[:, :, numpy.newaxis]
+
+    # Correlation, as PIL applies kernels, so the kernel is not flipped
+    columns, values, rows = numpy.linalg.svd(kernel)
+    if values[1:].sum() <= values[0] * 1e-6:
+        passes = [(columns[:, 0] * values[0] ** 0.5)[:, numpy.newaxis],
+                  (rows[0] * values[0] ** 0.5)[numpy.newaxis, :]]
+    else:
+        passes = [kernel]
+
+    for weights in passes:
+        half_y, half_x = weights.shape[0] // 2, weights.shape[1] // 2
+        padded = numpy.pad(pixels, ((half_y, half_y), (half_x, half_x), (0, 0)), mode='edge')
+        result = numpy.zeros_like(pixels)
+        height, width = pixels.shape[:2]
+
+        for (y, x), weight in numpy.ndenumerate(weights):
+            if weight:
+                result += weight * padded[y:y + height, x:x + width]
+
+        pixels = result
+
+    pixels = numpy.clip(pixels + 0.5, 0, 255).astype(numpy.uint8)
+
+    return Image.fromarray(pixels[:, :, 0] if pixels.shape[2] == 1 else pixels)
@@ -1,9 +1,11 @@
-import threading
-
-
-# Template class for animated (rubber-banded) operations such as cropping or adding shapes
+# Template class for animated (rubber-banded) operations such as cropping or adding shapes.
+# A single preview item is created per gesture and moved with canvas.coords straight from the
+# '<Motion>' handler on the main thread, at most once per display frame.
 class Animation(object):
 
+    # Minimum milliseconds between preview updates (roughly one frame at 60Hz)
+    FRAME_INTERVAL = 16
+
     # Updates the state indicator on the menu bar and the cursor then sets up the binding
     # to allow the animation/rubber-banding to start upon a left mouse click.
     def __init__(self, app, state_label: str):
@@ -11,18 +13,28 @@ class Animation(object):
         app.root.config(cursor='tcross')
         app.menu_bar.entryconfig(self.app.STATE_MENU_ITEM_INDEX, label=state_label)
 
+        # Canvas item showing the operation, the pending frame callback and whether the mouse
+        # has moved since the preview was last updated
+        self.preview = None
+        self.frame = None
+        self.moved = False
+
         app.root.bind('<Button-1>', self.start_animation)
 
-    # Each child class has their own implementation of the draw function
-    # as each displays to the user different visual feedback.
-    def draw_animation(self, init_x: int, init_y: int, event) -> None:
+    # Each child class creates their own preview item (a rectangle, line or oval) as each
+    # displays to the user different visual feedback, returning its canvas id.
+    def create_preview(self, init_x: int, init_y: int) -> int:
         pass
 
     # Resets the state (cursor, bindings and state indicator) saving the coordinates
     # of the second left mouse click. Each child class then has a different method call
     # (crop, create_rectangle...)
     def stop_animation(self, event) -> None:
-        self.app.animation_state.set()  # flag allows the new animation thread to know when to stop
+        if self.frame is not None:
+            self.app.root.after_cancel(self.frame)
+            self.frame = None
+
+        self.app.canvas.delete(self.preview)
 
         self.app.root.unbind('<Motion>')
         self.app.root.unbind('<Button-1>')
@@ -38,13 +50,35 @@ class Animation(object):
     def start_animation(self, event):
         self.app.saved_point["x"] = event.x
         self.app.saved_point["y"] = event.y
+        self.app.mouse["x"], self.app.mouse["y"] = event.x + 1, event.y + 1
+
+        self.preview = self.create_preview(event.x, event.y)
 
         self.app.root.bind('<Button-1>', self.stop_animation)
-        self.app.root.bind('<Motion>', self.app.update_mouse)
-
-        self.app.animation_state = threading.Event()  # Used by the new thread to know when to stop
-        anim = threading.Thread(
-            target=self.draw_animation,
-            args=(event.x, event.y, self.app.animation_state),
-            daemon=True)
-        anim.start()
+        self.app.root.bind('<Motion>', self.track_mouse)
+
+    # Stores the mouse position, moving the preview straight away unless it has already been
+    # moved this frame, in which case it is moved when the frame ends.
+    def track_mouse(self, event) -> None:
+        self.app.update_mouse(event)
+
+        if self.frame is None:
+            self.update_preview()
+        else:
+            self.moved = True
+
+    # Moves the preview to the current mouse position and starts a new frame
+    def update_preview(self) -> None:
+        self.app.canvas.coords(self.preview,
+                               self.app.saved_point["x"], self.app.saved_point["y"],
+                               self.app.mouse["x"], self.app.mouse["y"])
+
+        self.moved = False
+        self.frame = self.app.root.after(self.FRAME_INTERVAL, self.end_frame)
+
+    # Catches up with any movement made during the frame
+    def end_frame(self) -> None:
+        self.frame = None
+
+        if self.moved:
+            self.update_preview()
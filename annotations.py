@@ -0,0 +1,254 @@
+from tkinter import Canvas, Text
+from PIL import ImageDraw, ImageFont, ImageTk
+
+import operations
+import overlays
+
+
+# Items added over the image (shapes, pen strokes, inserted images and footers). Each keeps its
+# position and size in full resolution coordinates so it can be drawn on the canvas at the
+# display scale and rendered into the full resolution image when saving. Geometry operations
+# move them with the image (see transform).
+
+
+# A line, square/rectangle or oval inserted via the Insert menu
+class Shape(object):
+
+    def __init__(self, kind: str, points: (int, int, int, int), colour: str, width: float) -> None:
+        self.kind = kind  # 'line', 'rectangle' or 'oval'
+        self.points = points
+        self.colour = colour
+        self.width = width
+
+    # Adds the shape to the canvas, scaling it to the displayed image
+    def draw(self, canvas: Canvas, scale: float) -> None:
+        points = [value * scale for value in self.points]
+        width = max(1, round(self.width * scale))
+
+        if self.kind == 'line':
+            canvas.create_line(*points, width=width, fill=self.colour)
+        elif self.kind == 'rectangle':
+            canvas.create_rectangle(*points, width=width, outline=self.colour)
+        else:
+            canvas.create_oval(*points, width=width, outline=self.colour)
+
+    # Draws the shape onto the full resolution image
+    def render(self, image) -> None:
+        draw = ImageDraw.Draw(image)
+        x, y, x2, y2 = self.points
+        width = max(1, round(self.width))
+
+        if self.kind == 'line':
+            draw.line((x, y, x2, y2), fill=self.colour, width=width)
+            return
+
+        # PIL requires the top left corner first
+        box = (min(x, x2), min(y, y2), max(x, x2), max(y, y2))
+        if self.kind == 'rectangle':
+            draw.rectangle(box, outline=self.colour, width=width)
+        else:
+            draw.ellipse(box, outline=self.colour, width=width)
+
+    # A copy of the shape moved with a geometry operation (see transform)
+    def transformed(self, point, factor: float, operation=None):
+        x, y, x2, y2 = self.points
+
+        return Shape(self.kind, point(x, y) + point(x2, y2), self.colour, self.width * factor)
+
+
+# A freehand stroke drawn with the pen, kept as a single smoothed polyline
+class Stroke(object):
+
+    def __init__(self, colour: str, radius: float, points: list) -> None:
+        self.colour = colour
+        self.radius = radius
+        self.points = points
+
+    # Adds the stroke to the canvas as a single line item (strokes are normally rasterized
+    # into the stroke layer instead, see stroke.py)
+    def draw(self, canvas: Canvas, scale: float) -> None:
+        points = [value * scale for point in self.points for value in point]
+        width = max(1, round(self.radius * 2 * scale))
+
+        if len(self.points) == 1:
+            points += points
+        canvas.create_line(*points, width=width, fill=self.colour, capstyle='round', joinstyle='round')
+
+    # Draws the stroke onto an image, at the given scale for layers smaller than full resolution
+    def render(self, image, scale: float = 1) -> None:
+        draw = ImageDraw.Draw(image)
+        radius = self.radius * scale
+        points = [(x * scale, y * scale) for x, y in self.points]
+
+        if len(points) > 1:
+            draw.line(points, fill=self.colour, width=max(1, round(radius * 2)), joint='curve')
+
+        # Rounds off the ends (PIL lines have square caps)
+        for x, y in (points[0], points[-1]):
+            draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill=self.colour)
+
+    # A copy of the stroke moved with a geometry operation (see transform)
+    def transformed(self, point, factor: float, operation=None):
+        return Stroke(self.colour, self.radius * factor, [point(x, y) for x, y in self.points])
+
+
+# An additional image inserted over the current one, centred on the point clicked
+class InsertedImage(object):
+
+    def __init__(self, path: str, centre: (int, int), size: (int, int), image=None) -> None:
+        self.path = path
+        self.centre = centre
+        self.size = size
+        # Pixels of the inserted image at its size when kept (such as in a project file),
+        # otherwise read from its file when needed
+        self.image = image
+        # Photo image shown on the canvas, kept for as long as it is displayed
+        self.photo = None
+
+    # The photo image is only for display, so isn't copied (such as to a process rendering frames)
+    def __getstate__(self) -> dict:
+        return dict(self.__dict__, photo=None)
+
+    # The inserted image at the given size (its own by default), decoded and resampled once
+    # however many times it is drawn or rendered (see overlays.OverlayCache)
+    def overlay(self, size: (int, int) = None):
+        source = self.path if self.image is None else self.image
+
+        return overlays.cache.get(source, size or self.size)
+
+    def draw(self, canvas: Canvas, scale: float) -> None:
+        width = max(1, round(self.size[0] * scale))
+        height = max(1, round(self.size[1] * scale))
+
+        # Drawn as an image item (composited by its alpha channel over the picture)
+        self.photo = ImageTk.PhotoImage(self.overlay((width, height)))
+        canvas.create_image((self.centre[0] * scale, self.centre[1] * scale), image=self.photo)
+
+    def render(self, image) -> None:
+        x = self.centre[0] - self.size[0] // 2
+        y = self.centre[1] - self.size[1] // 2
+
+        overlays.stamp(image, self.overlay(), (x, y))
+
+    # A copy of the image moved with a geometry operation (see transform), its pixels rotated
+    # or flipped with the picture. Its first and last pixels are mapped so it lands on the same
+    # pixels of the picture.
+    def transformed(self, point, factor: float, operation=None):
+        x = self.centre[0] - self.size[0] // 2
+        y = self.centre[1] - self.size[1] // 2
+        (x1, y1), (x2, y2) = point(x, y), point(x + self.size[0] - 1, y + self.size[1] - 1)
+
+        size = (max(1, round(abs(x2 - x1)) + 1), max(1, round(abs(y2 - y1)) + 1))
+        centre = (round(min(x1, x2)) + size[0] // 2, round(min(y1, y2)) + size[1] // 2)
+        image = self.image if operation is None else operation(self.overlay())
+
+        return InsertedImage(self.path, centre, size, image)
+
+
+# A footer along the bottom of the image allowing text to be added
+class Footer(object):
+
+    # Sizes used on screen at a scale of 1 (matching the 'Arial 10' text widget)
+    HEIGHT = 60
+    FONT_SIZE = 13
+    PADDING = (10, 5)
+    BORDER = 2
+
+    def __init__(self, scale: float) -> None:
+        self.text = ''
+        # Converts the on-screen sizes above to full resolution coordinates
+        self.factor = 1 / scale
+
+    # Adds an editable text widget to the canvas, returning it so focus can be handled
+    def draw(self, canvas: Canvas, scale: float) -> Text:
+        height = max(1, round(self.HEIGHT * self.factor * scale))
+
+        footer = Text(canvas, font='Arial 10', padx=10, pady=5, border=2, takefocus=0)
+        footer.insert('1.0', self.text)
+        footer.bind('<KeyRelease>', lambda event: self._update_text(footer))
+
+        # The canvas is sized to the displayed image when it is placed in the window
+        placed = canvas.place_info()
+        canvas.create_window((0, int(placed['height']) - height), window=footer,
+                             width=int(placed['width']), height=height, anchor='nw')
+
+        return footer
+
+    def _update_text(self, footer: Text) -> None:
+        self.text = footer.get('1.0', 'end-1c')
+
+    def render(self, image) -> None:
+        draw = ImageDraw.Draw(image)
+        height = round(self.HEIGHT * self.factor)
+        border = max(1, round(self.BORDER * self.factor))
+        top = image.height - height
+        x = round((self.PADDING[0] + self.BORDER) * self.factor)
+        y = top + round((self.PADDING[1] + self.BORDER) * self.factor)
+
+        draw.rectangle((0, top, image.width - 1, image.height - 1), fill='white', outline='gray', width=border)
+        draw.multiline_text((x, y), self.text, fill='black', font=_load_font(round(self.FONT_SIZE * self.factor)))
+
+    # A copy of the footer sized for the image after a geometry operation (it stays along the
+    # bottom whichever way the image is turned)
+    def transformed(self, point, factor: float, operation=None):
+        footer = Footer(1 / (self.factor * factor))
+        footer.text = self.text
+
+        return footer
+
+
+def transform(annotations: list, name: str, args: tuple, size: (int, int)) -> list:
+    """
+    Moves annotations with a geometry operation applied to the image under them. Points are
+    pixel positions, so rotating and flipping map them exactly, cropping moves them by the
+    box's offset and resizing scales them (sizes such as line widths by the mean of the
+    horizontal and vertical scales).
+    :param annotations: (list) The annotations.
+    :param name: (str) Name of the operation (see operations.GEOMETRY_OPERATIONS).
+    :param args: The operation's arguments in full resolution coordinates (a crop box being
+    within the image, see operations.clamp_box).
+    :param size: Tuple(int, int) width and height of the image before the operation.
+    :return: (list) Copies of the annotations in the coordinates of the resulting image.
+    """
+    width, height = size
+    factor = 1
+    operation = None
+
+    if name == 'rotate':
+        operation = operations.rotate
+
+        def point(x, y):
+            return y, width - 1 - x
+    elif name == 'flip_lr':
+        operation = operations.flip_lr
+
+        def point(x, y):
+            return width - 1 - x, y
+    elif name == 'flip_tb':
+        operation = operations.flip_tb
+
+        def point(x, y):
+            return x, height - 1 - y
+    elif name == 'crop':
+        def point(x, y):
+            return x - args[0], y - args[1]
+    else:
+        scale_x, scale_y = args[0] / width, args[1] / height
+        factor = (scale_x + scale_y) / 2
+
+        def point(x, y):
+            return x * scale_x, y * scale_y
+
+    return [annotation.transformed(point, factor, operation) for annotation in annotations]
+
+
+def _load_font(size: int):
+    """
+    Loads Arial at the given size, falling back to PIL's default font where it isn't installed.
+    :param size: (int) The font size in pixels.
+    :return: (PIL.ImageFont) The loaded font.
+    """
+    try:
+        return ImageFont.truetype('arial.ttf', size)
+    except OSError:
+        return ImageFont.load_default(size)
@@ -0,0 +1,304 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from PIL import Image
+
+import cache
+import encoder
+import operations
+import overlays
+import tiles
+from files import find_images
+from pipeline import Pipeline
+
+
+def parse_recipe(recipe: str) -> list:
+    """
+    Parses a recipe of operations such as 'rotate,blur,crop=0:0:400:300,resize=800x600'
+    (operation names are those of operations.OPERATIONS, arguments follow an '=' separated
+    by ':' or 'x').
+    :param recipe: (str) The recipe to parse.
+    :return: (list) (name, args) of each operation in order.
+    """
+    steps = []
+
+    for step in recipe.split(','):
+        name, _, arguments = step.strip().partition('=')
+
+        if name not in operations.OPERATIONS:
+            raise ValueError(f'Unknown operation: {name}')
+
+        args = tuple(int(value) for value in arguments.replace('x', ':').split(':')) if arguments else ()
+        operations.check_arguments(name, *args)
+        steps.append((name, args))
+
+    return steps
+
+
+def _estimate_memory(path: str, tile_size: int = None) -> int:
+    """
+    Estimates the memory needed to process an image from its header (no pixels are decoded).
+    :param path: (str) Path of the image.
+    :param tile_size: (int) Size of the tiles the image is processed in, if processed in tiles.
+    :return: (int) Estimated number of bytes (the decoded image plus one output copy, or a band
+    of tiles when memory-mapped and streamed).
+    """
+    try:
+        with Image.open(path) as image:
+            bands = len(image.getbands())
+
+            if tile_size and path.lower().endswith(tiles.NETPBM_EXTENSIONS):
+                return image.width * tile_size * bands * 2
+
+            return image.width * image.height * bands * 2
+    except Exception:
+        # The file's own processing reports what is wrong with it
+        return 0
+
+
+# Result cache of each directory used by this (worker) process, so a worker only scans the
+# directory once however many files it processes. The disk budget is enforced by run.
+_result_caches = {}
+
+
+def _result_cache(directory: str) -> cache.ResultCache:
+    """
+    Gets this process's cache of results in a directory, keeping them only on disk.
+    :param directory: (str) Directory results are cached in.
+    :return: (cache.ResultCache) The cache.
+    """
+    if directory not in _result_caches:
+        _result_caches[directory] = cache.ResultCache(memory_budget=0, directory=directory, disk_budget=None)
+
+    return _result_caches[directory]
+
+
+def process_file(path: str, output_path: str, steps: list, tile_size: int = None,
+                 cache_dir: str = None, watermark: tuple = None) -> (str, int, int, float, str):
+    """
+    Applies the recipe to a single image and saves the result (run in a worker process).
+    :param path: (str) Path of the image.
+    :param output_path: (str) Path the result is saved to.
+    :param steps: (list) (name, args) of each operation in order.
+    :param tile_size: (int) Processes the image a tile of this size at a time (see tiles.py)
+    rather than all at once, if given.
+    :param cache_dir: (str) Directory results are cached in (see cache.py), so recipes sharing
+    their first operations with an earlier run start from its stored results.
+    :param watermark: (tuple) Arguments of overlays.watermark after the image, stamping the
+    watermark onto the result if given (each worker decoding and resizing it only once).
+    :return: Tuple(str, int, int, float, str) path, pixels processed, output bytes, seconds taken
+    and an error message (None if successful).
+    """
+    start = time.perf_counter()
+
+    try:
+        if tile_size:
+            with Image.open(path) as image:
+                pixels = image.width * image.height
+
+            os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+            tiles.run(path, output_path, steps, tile_size)
+
+            return path, pixels, os.path.getsize(output_path), time.perf_counter() - start, None
+
+        with Image.open(path) as image:
+            image.load()
+            pipeline = Pipeline(image.size)
+            for name, args in steps:
+                pipeline.append(name, *args)
+
+            # Results are only cached on disk, not held in memory by the worker
+            if cache_dir is not None:
+                pipeline.result_cache = _result_cache(cache_dir)
+                pipeline.sources['file'] = cache.file_key(path)
+
+            result = pipeline.render(image, 'file' if cache_dir is not None else None)
+            pixels = image.width * image.height
+
+        if watermark is not None:
+            result = overlays.watermark(result, *watermark)
+
+        _save(result, output_path)
+    except Exception as error:
+        # Whatever goes wrong with one file (such as a decompression bomb) is reported for it,
+        # the rest of the run carrying on
+        return path, 0, 0, time.perf_counter() - start, str(error) or type(error).__name__
+
+    return path, pixels, os.path.getsize(output_path), time.perf_counter() - start, None
+
+
+def _save(image, path: str) -> None:
+    """
+    Saves an image keeping any EXIF data it still has, written atomically and converted to a
+    mode the format supports (see encoder.encode).
+    :param image: (PIL.Image) The image to save.
+    :param path: (str) The file path to save to.
+    """
+    encoder.encode(image, path, exif=image.info.get('exif'))
+
+
+def run(files: list, output: str, steps: list, workers: int = None, max_in_flight: int = None,
+        memory_budget: int = 1024 * 1024 * 1024, extension: str = None, tile_size: int = None,
+        cache_dir: str = None, watermark: tuple = None) -> list:
+    """
+    Processes the files across a pool of worker processes. Files are submitted as others
+    finish so no more than max_in_flight files, and no more than the memory budget (estimated
+    from each file's header), are being processed at any one time.
+    :param files: (list) (path, base directory) of each file.
+    :param output: (str) Directory the results are saved to (relative paths are kept).
+    :param steps: (list) (name, args) of each operation in order.
+    :param workers: (int) Number of worker processes (defaults to the number of CPUs).
+    :param max_in_flight: (int) Maximum files submitted at once (defaults to twice the workers).
+    :param memory_budget: (int) Maximum estimated bytes of images being processed at once.
+    :param extension: (str) Extension (format) of the results, the original's if not given.
+    :param tile_size: (int) Processes images in tiles of this size if given (see tiles.py).
+    :param cache_dir: (str) Directory results are cached in between runs (see cache.py).
+    :param watermark: (tuple) Arguments of overlays.watermark stamping a watermark onto every
+    result (not when processed in tiles).
+    :return: (list) The result of process_file for each file, files whose result would
+    overwrite another's (having the same relative path under different directories) failing.
+    """
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or workers * 2
+    pending = []
+    in_flight = {}
+    in_flight_memory = 0
+    results = []
+    outputs = {}
+
+    for path, base in files:
+        relative = os.path.relpath(path, base)
+        if extension:
+            relative = os.path.splitext(relative)[0] + '.' + extension.lstrip('.')
+
+        output_path = os.path.normcase(os.path.abspath(os.path.join(output, relative)))
+        if output_path in outputs:
+            results.append((path, 0, 0, 0.0, f'its result would overwrite that of {outputs[output_path]}'))
+            continue
+
+        outputs[output_path] = path
+        pending.append((path, os.path.join(output, relative)))
+
+    pending.reverse()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while pending or in_flight:
+            while pending and len(in_flight) < max_in_flight:
+                path, output_path = pending[-1]
+                memory = _estimate_memory(path, tile_size)
+
+                # At least one file is always allowed so oversized images still get processed
+                if in_flight and in_flight_memory + memory > memory_budget:
+                    break
+
+                pending.pop()
+                future = executor.submit(process_file, path, output_path, steps, tile_size, cache_dir, watermark)
+                in_flight[future] = memory
+                in_flight_memory += memory
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                in_flight_memory -= in_flight.pop(future)
+                results.append(future.result())
+
+    # The workers only add to the cache, the oldest results being removed here once over budget
+    if cache_dir is not None:
+        cache.ResultCache(memory_budget=0, directory=cache_dir).trim()
+
+    return results
+
+
+def report(results: list, elapsed: float) -> str:
+    """
+    Builds a table of the throughput of each file followed by the totals.
+    :param results: (list) The result of process_file for each file.
+    :param elapsed: (float) Seconds taken to process every file.
+    :return: (str) The report.
+    """
+    lines = [f"{'File':<50} {'MP':>8} {'Seconds':>8} {'MP/s':>8}"]
+    pixels = failed = 0
+
+    for path, file_pixels, _, seconds, error in sorted(results):
+        if error:
+            failed += 1
+            lines.append(f'{path:<50} failed: {error}')
+            continue
+
+        pixels += file_pixels
+        lines.append(f'{path:<50} {file_pixels / 1e6:>8.2f} {seconds:>8.3f} {file_pixels / 1e6 / seconds:>8.2f}')
+
+    processed = len(results) - failed
+    lines.append(f'\n{processed} file(s) processed, {failed} failed in {elapsed:.2f}s '
+                 f'({processed / elapsed:.2f} files/s, {pixels / 1e6 / elapsed:.2f} MP/s)')
+
+    return '\n'.join(lines)
+
+
+# Applies a recipe of editor operations to many images without opening a window
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description='Apply image editor operations to many images.')
+    parser.add_argument('inputs', nargs='+', help='directories, glob patterns or files to process')
+    parser.add_argument('-r', '--recipe',
+                        help=f"operations to apply in order, e.g. 'rotate,blur,crop=0:0:400:300,resize=800x600' "
+                             f"(available: {', '.join(operations.OPERATIONS)})")
+    parser.add_argument('-o', '--output', required=True, help='directory the results are saved to')
+    parser.add_argument('-f', '--format', help='extension to save the results as (e.g. png)')
+    parser.add_argument('-w', '--workers', type=int, help='number of worker processes')
+    parser.add_argument('--max-in-flight', type=int, help='maximum files being processed at once')
+    parser.add_argument('--memory-limit', type=int, default=1024, help='memory budget in MB for images in flight')
+    parser.add_argument('--recursive', action='store_true', help='search directories recursively')
+    parser.add_argument('--tile-size', type=int,
+                        help='process images in tiles of this size, streaming PGM/PPM/PAM input and PNG/PGM/PPM/PAM '
+                             'output so memory use depends on the tile size rather than the image size')
+    parser.add_argument('--cache-dir', help='directory results are cached in, so later runs whose recipes start '
+                                            'with the same operations on the same images reuse them')
+    parser.add_argument('--watermark', help='image stamped onto every result (composited by its alpha channel)')
+    parser.add_argument('--watermark-width', type=int, default=20,
+                        help='width of the watermark as a percentage of the image width (default 20)')
+    parser.add_argument('--watermark-position', choices=list(overlays.POSITIONS), default='bottom-right',
+                        help='where the watermark is placed (default bottom-right)')
+    parser.add_argument('--watermark-opacity', type=int, default=100,
+                        help='opacity of the watermark as a percentage (default 100)')
+    args = parser.parse_args(argv)
+
+    if not args.recipe and not args.watermark:
+        parser.error('a recipe (-r) or a watermark (--watermark) is required')
+
+    try:
+        steps = parse_recipe(args.recipe) if args.recipe else []
+    except ValueError as error:
+        parser.error(str(error))
+
+    watermark = None
+    if args.watermark:
+        if args.tile_size:
+            parser.error("--watermark can't be used with --tile-size")
+        if not 0 < args.watermark_width <= 100 or not 0 <= args.watermark_opacity <= 100:
+            parser.error('the watermark width must be from 1 to 100 and its opacity from 0 to 100')
+
+        # Checked once here, each worker then decoding it for itself
+        try:
+            overlays.cache.get(args.watermark)
+        except OSError as error:
+            parser.error(f"the watermark can't be opened: {error}")
+
+        watermark = (args.watermark, args.watermark_width, args.watermark_position, args.watermark_opacity)
+
+    files = find_images(args.inputs, args.recursive)
+    if not files:
+        print('No images found.', file=sys.stderr)
+        return 1
+
+    start = time.perf_counter()
+    results = run(files, args.output, steps, args.workers, args.max_in_flight,
+                  args.memory_limit * 1024 * 1024, args.format, args.tile_size, args.cache_dir, watermark)
+    print(report(results, time.perf_counter() - start))
+
+    return 0 if all(error is None for *_, error in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,431 @@
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import PIL
+from PIL import Image
+
+# Peak memory is read from the operating system where it is available (not on Windows)
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Sizes (in megapixels) and modes of the images benchmarked by default
+SIZES = (1, 10, 100)
+MODES = ('RGB', 'RGBA', 'L')
+
+# Size of the window the benchmarked images are fitted to
+WINDOW_SIZE = (1300, 721)
+
+# Benchmarks slower than their baseline by more than this fraction are reported as regressions
+TOLERANCE = 0.10
+
+
+# Answers the dialogs opened by the events, standing in for filedialog, messagebox and
+# simpledialog. Integer prompts are answered in order from the answers given.
+class StubDialogs(object):
+
+    def __init__(self, open_path: str, save_path: str, answers: list = None) -> None:
+        self.open_path = open_path
+        self.save_path = save_path
+        self.answers = list(answers or [])
+
+    def askopenfilename(self, **kwargs) -> str:
+        return self.open_path
+
+    def asksaveasfilename(self, **kwargs) -> str:
+        return self.save_path
+
+    def askokcancel(self, **kwargs) -> bool:
+        return True
+
+    def askinteger(self, **kwargs) -> int:
+        return self.answers.pop(0)
+
+    def askstring(self, **kwargs) -> str:
+        return self.answers.pop(0)
+
+    def showinfo(self, **kwargs) -> None:
+        pass
+
+    # An error shown by an event means the benchmark failed
+    def showerror(self, title: str = None, message: str = None, **kwargs) -> None:
+        raise RuntimeError(message)
+
+
+# Stands in for ImageTk, nothing being displayed. The image is still converted to the RGB(A)
+# data a photo image is built from so some of the cost of displaying it is measured.
+class StubImageTk(object):
+
+    class PhotoImage(object):
+
+        def __init__(self, image, size: (int, int) = None, **kwargs) -> None:
+            if isinstance(image, str):
+                self.size = size
+            else:
+                self.size = image.size
+                self.paste(image)
+
+        def paste(self, image) -> None:
+            image.convert('RGBA' if 'A' in image.getbands() else 'RGB').tobytes()
+
+
+# Any widget (window, canvas or menu), every method doing nothing
+class StubWidget(object):
+
+    def __init__(self, width: int = 0, height: int = 0) -> None:
+        self.width = width
+        self.height = height
+        self.tk = self
+
+    def winfo_width(self) -> int:
+        return self.width
+
+    def winfo_height(self) -> int:
+        return self.height
+
+    def find_all(self) -> tuple:
+        return ()
+
+    def __getattr__(self, name: str):
+        return lambda *args, **kwargs: 1
+
+
+# A Tk variable (such as an option of the Save options menu) holding its value
+class StubVariable(object):
+
+    def __init__(self, value) -> None:
+        self.value = value
+
+    def get(self):
+        return self.value
+
+
+# Runs jobs straight away on the calling thread, so background work is included in the time
+class SyncJobs(object):
+
+    def submit(self, label: str, function, on_done, kind: str = None) -> None:
+        on_done(function(lambda fraction: None))
+
+    def cancel(self, *kinds: str) -> None:
+        pass
+
+
+# The parts of the main window (see window.py) the events use, without a display
+class StubApp(object):
+
+    def __init__(self) -> None:
+        from cache import ResultCache
+        from display import Display
+        from session import Session
+        from stroke import StrokeEngine
+
+        self.opened_file_path = None
+        self.opened_image = None
+        self.document = None
+        self.viewport = None
+        self.result_cache = ResultCache()
+        self.session = Session()
+
+        self.mouse = {"x": 0, "y": 0}
+        self.saved_point = {"x": 0, "y": 0, "x2": 0, "y2": 0}
+        self.drawing_state = False
+        self.drawing_colour = "red"
+        self.line_colour = "black"
+        self.STATE_MENU_ITEM_INDEX = 8
+        self.TAB_BAR_HEIGHT = 26
+        self.current_width, self.current_height = WINDOW_SIZE
+        self.resize_frame = None
+        self.save_options = {}
+        self.parallel_frames = StubVariable(False)
+
+        self.root = StubWidget(*WINDOW_SIZE)
+        self.canvas = StubWidget(*WINDOW_SIZE)
+        self.display = Display(self.canvas)
+        self.menu_bar = StubWidget()
+        self.tabs = StubWidget()
+
+        self.stroke_engine = StrokeEngine(self)
+        self.jobs = SyncJobs()
+
+
+def _crop(app) -> None:
+    import events
+
+    events.crop(app, 10, 10, app.opened_image.width - 10, app.opened_image.height - 10)
+
+
+# Benchmarked operations: the event called and the answers to any prompts it opens (given the
+# image's size). 'open' is timed from the file dialog, the others once the image is open.
+BENCHMARKS = {
+    'open': ('open_picture', lambda size: []),
+    'black_white': ('filter_black_white', lambda size: []),
+    'blur': ('filter_blur', lambda size: []),
+    'emboss': ('filter_emboss', lambda size: []),
+    'sharpen': ('filter_sharpen', lambda size: []),
+    'brightness': ('filter_brightness', lambda size: [120]),
+    'contrast': ('filter_contrast', lambda size: [120]),
+    'gamma': ('filter_gamma', lambda size: [120]),
+    'levels': ('filter_levels', lambda size: [16, 240]),
+    'curves': ('filter_curves', lambda size: ['0:0 64:48 192:208 255:255']),
+    'gaussian_blur': ('filter_gaussian_blur', lambda size: [4]),
+    'kernel': ('filter_kernel', lambda size: ['0, -1, 0; -1, 5, -1; 0, -1, 0']),
+    'rotate': ('rotate', lambda size: []),
+    'flip_lr': ('flip_lr', lambda size: []),
+    'flip_tb': ('flip_tb', lambda size: []),
+    'crop': (_crop, lambda size: []),
+    'resize': ('resize_image', lambda size: [size[0] // 2, size[1] // 2]),
+    'remove_exif': ('remove_exif_data', lambda size: []),
+    'save': ('save_picture_as', lambda size: []),
+}
+
+
+def synthetic_image(megapixels: float, mode: str) -> Image:
+    """
+    Generates a 4:3 image of roughly the given number of pixels, made of gradients and noise
+    so that filters and encoders have detail to work on.
+    :param megapixels: (float) Number of pixels in millions.
+    :param mode: (str) 'RGB', 'RGBA' or 'L'.
+    :return: (PIL.Image) The image.
+    """
+    width = round(math.sqrt(megapixels * 1e6 * 4 / 3))
+    size = (width, round(width * 3 / 4))
+
+    noise = Image.effect_noise(size, 48)
+    gradient = Image.linear_gradient('L').resize(size)
+    luminance = Image.blend(gradient, noise, 0.4)
+
+    if mode == 'L':
+        return luminance
+
+    bands = [luminance, luminance.transpose(Image.FLIP_LEFT_RIGHT), Image.radial_gradient('L').resize(size)]
+    if mode == 'RGBA':
+        bands.append(gradient.transpose(Image.ROTATE_180))
+
+    return Image.merge(mode, bands)
+
+
+def prepare_image(directory: str, megapixels: float, mode: str) -> str:
+    """
+    Writes a synthetic image (with EXIF data) to the directory unless it was written by an
+    earlier run, RGBA images as PNG and the others as JPEG.
+    :param directory: (str) Directory the images are kept in.
+    :param megapixels: (float) Number of pixels in millions.
+    :param mode: (str) 'RGB', 'RGBA' or 'L'.
+    :return: (str) Path of the image.
+    """
+    extension = 'png' if mode == 'RGBA' else 'jpg'
+    path = os.path.join(directory, f'synthetic_{megapixels:g}mp_{mode}.{extension}')
+
+    if not os.path.exists(path):
+        exif = Image.Exif()
+        exif[0x010F] = 'Benchmark'
+        exif[0x0110] = 'Synthetic'
+
+        image = synthetic_image(megapixels, mode)
+        temp_path = path + '.tmp'
+        image.save(temp_path, format='PNG' if mode == 'RGBA' else 'JPEG', exif=exif, compress_level=1, quality=90)
+        os.replace(temp_path, path)
+
+    return path
+
+
+def _peak_memory() -> int:
+    """
+    Gets the peak memory (resident set size) of the current process.
+    :return: (int) Bytes, None where it can't be measured.
+    """
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Reported in bytes on macOS, kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def run_case(name: str, path: str, save_path: str) -> dict:
+    """
+    Runs a single benchmark in the current process (called in a fresh process for each
+    benchmark so its peak memory is its own).
+    :param name: (str) Name of the benchmark (a key of BENCHMARKS).
+    :param path: (str) Path of the image.
+    :param save_path: (str) Path the 'save' benchmark writes to.
+    :return: (dict) Seconds taken and the peak memory of the process in bytes.
+    """
+    import display
+    import events
+
+    event, answers = BENCHMARKS[name]
+    event = getattr(events, event) if isinstance(event, str) else event
+
+    with Image.open(path) as image:
+        size = image.size
+
+    dialogs = StubDialogs(path, save_path, answers(size))
+    events.filedialog = events.messagebox = events.simpledialog = dialogs
+    display.ImageTk = StubImageTk
+
+    app = StubApp()
+    if name != 'open':
+        events.open_picture(app)
+
+    start = time.perf_counter()
+    event(app)
+    seconds = time.perf_counter() - start
+
+    return {'seconds': seconds, 'peak_memory': _peak_memory()}
+
+
+def run(names: list, sizes: list, modes: list, directory: str, repeat: int = 1) -> dict:
+    """
+    Runs each benchmark on each size and mode of image, every run in its own process. The
+    fastest of the repeated runs is kept.
+    :param names: (list) Names of the benchmarks (keys of BENCHMARKS).
+    :param sizes: (list) Sizes of image in megapixels.
+    :param modes: (list) Modes of image.
+    :param directory: (str) Directory the images are kept in.
+    :param repeat: (int) Number of times each benchmark is run.
+    :return: (dict) Result of each benchmark (seconds, peak memory, megapixels and megapixels
+    per second, or an error) keyed by 'name/size/mode'.
+    """
+    results = {}
+
+    for megapixels in sizes:
+        for mode in modes:
+            path = prepare_image(directory, megapixels, mode)
+            save_path = os.path.join(directory, 'saved' + os.path.splitext(path)[1])
+
+            with Image.open(path) as image:
+                pixels = image.width * image.height
+
+            for name in names:
+                key = f'{name}/{megapixels:g}/{mode}'
+                runs = []
+
+                for _ in range(repeat):
+                    command = [sys.executable, os.path.abspath(__file__), '--case', name, path, save_path]
+                    process = subprocess.run(command, capture_output=True, text=True)
+
+                    if process.returncode != 0:
+                        results[key] = {'error': process.stderr.strip().splitlines()[-1]}
+                        break
+
+                    runs.append(json.loads(process.stdout.strip().splitlines()[-1]))
+                else:
+                    best = min(runs, key=lambda result: result['seconds'])
+                    best['megapixels'] = pixels / 1e6
+                    best['throughput'] = pixels / 1e6 / best['seconds']
+                    results[key] = best
+
+                print(report({key: results[key]}, header=False), flush=True)
+
+    return results
+
+
+def report(results: dict, baseline: dict = None, header: bool = True) -> str:
+    """
+    Builds a table of the results, compared with a baseline if given.
+    :param results: (dict) Results keyed by 'name/size/mode' (see run).
+    :param baseline: (dict) Earlier results to compare with.
+    :param header: (bool) Whether the column headings are included.
+    :return: (str) The table.
+    """
+    lines = []
+    if header:
+        columns = f"{'Benchmark':<30} {'Seconds':>9} {'Peak MB':>9} {'MP/s':>9}"
+        lines.append(columns + ('  vs baseline' if baseline else ''))
+
+    for key, result in results.items():
+        if 'error' in result:
+            lines.append(f'{key:<30} failed: {result["error"]}')
+            continue
+
+        peak = f'{result["peak_memory"] / 2 ** 20:.0f}' if result['peak_memory'] else 'n/a'
+        line = f'{key:<30} {result["seconds"]:>9.3f} {peak:>9} {result["throughput"]:>9.1f}'
+
+        previous = (baseline or {}).get(key)
+        if previous and 'seconds' in previous:
+            change = result['seconds'] / previous['seconds'] - 1
+            line += f'  {change:+.0%}' + ('  REGRESSION' if change > TOLERANCE else '')
+
+        lines.append(line)
+
+    return '\n'.join(lines)
+
+
+def regressions(results: dict, baseline: dict, tolerance: float = TOLERANCE) -> list:
+    """
+    Finds the benchmarks slower than their baseline by more than the tolerance.
+    :param results: (dict) Results keyed by 'name/size/mode' (see run).
+    :param baseline: (dict) Earlier results to compare with.
+    :param tolerance: (float) Fraction slower allowed.
+    :return: (list) Keys of the slower benchmarks.
+    """
+    return [key for key, result in results.items()
+            if 'seconds' in result and 'seconds' in baseline.get(key, {})
+            and result['seconds'] > baseline[key]['seconds'] * (1 + tolerance)]
+
+
+# Benchmarks the editor's operations without a display
+def main(argv: list = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+
+    # A single benchmark run in its own process by run()
+    if argv and argv[0] == '--case':
+        print(json.dumps(run_case(*argv[1:4])))
+        return 0
+
+    parser = argparse.ArgumentParser(description='Benchmark the image editor operations on generated images.')
+    parser.add_argument('benchmarks', nargs='*', help=f"benchmarks to run (default all: {', '.join(BENCHMARKS)})")
+    parser.add_argument('--sizes', default=','.join(str(size) for size in SIZES),
+                        help='image sizes in megapixels, separated by commas')
+    parser.add_argument('--modes', default=','.join(MODES), help='image modes, separated by commas')
+    parser.add_argument('--repeat', type=int, default=1, help='runs of each benchmark (the fastest is kept)')
+    parser.add_argument('--work-dir', default=os.path.join(tempfile.gettempdir(), 'image_editor_benchmark'),
+                        help='directory the generated images are kept in between runs')
+    parser.add_argument('--save-baseline', help='file the results are saved to as a baseline')
+    parser.add_argument('--compare', help='baseline file to compare the results with')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help='fraction slower than the baseline reported as a regression')
+    args = parser.parse_args(argv)
+
+    names = args.benchmarks or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"Unknown benchmark: {', '.join(unknown)}")
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    sizes = [float(size) for size in args.sizes.split(',')]
+    modes = args.modes.split(',')
+
+    print(report({}, header=True))
+    results = run(names, sizes, modes, args.work_dir, args.repeat)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)['results']
+
+        print('\n' + report(results, baseline))
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as file:
+            json.dump({'python': platform.python_version(), 'pillow': PIL.__version__,
+                       'platform': platform.platform(), 'results': results}, file, indent=2)
+
+    failed = [key for key, result in results.items() if 'error' in result]
+    slower = regressions(results, baseline, args.tolerance) if baseline else []
+
+    return 1 if failed or slower else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
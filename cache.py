@@ -0,0 +1,283 @@
+import base64
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+# Bytes hashed at a time when hashing a file
+HASH_BUFFER = 1024 * 1024
+
+
+def image_key(image) -> str:
+    """
+    Identifies an image by its contents (pixels, mode and size).
+    :param image: (PIL.Image) The image.
+    :return: (str) The key.
+    """
+    digest = hashlib.blake2b(f'{image.mode} {image.width} {image.height}'.encode(), digest_size=16)
+    digest.update(image.tobytes())
+
+    return digest.hexdigest()
+
+
+def file_key(path: str) -> str:
+    """
+    Identifies an image by the contents of its file, which is much smaller (and quicker to
+    hash) than the decoded pixels and doesn't need decoding first.
+    :param path: (str) Path of the image.
+    :return: (str) The key.
+    """
+    digest = hashlib.blake2b(b'file', digest_size=16)
+
+    with open(path, 'rb') as file:
+        for data in iter(lambda: file.read(HASH_BUFFER), b''):
+            digest.update(data)
+
+    return digest.hexdigest()
+
+
+def chain(parent: str, description: tuple) -> str:
+    """
+    Derives the key of an operation's result from the key of its input and a description of
+    the operation (its name and parameters), so results are identified without hashing them.
+    :param parent: (str) Key of the input.
+    :param description: (tuple) Description of the operation.
+    :return: (str) The key.
+    """
+    return hashlib.blake2b(f'{parent} {description!r}'.encode(), digest_size=16).hexdigest()
+
+
+# Stores the results of operations by content address (see chain), so applying an operation
+# already applied to the same image, such as going back and forth between two filters, returns
+# the stored result instead of computing it again. Results are kept in memory up to a byte
+# budget, least recently used first out, and optionally written to a directory where they
+# persist between runs (also within a byte budget). Shared between threads. The directory may
+# also be shared between processes (such as batch workers), results written by the others
+# being looked for on disk; the disk budget is then left to one of them (disk_budget None in
+# the rest, see trim).
+class ResultCache(object):
+
+    def __init__(self, memory_budget: int = 256 * 1024 * 1024, directory: str = None,
+                 disk_budget: int = 1024 * 1024 * 1024) -> None:
+        self.memory_budget = memory_budget
+        self.directory = directory
+        self.disk_budget = disk_budget
+
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self._lock = threading.Lock()
+
+        # Results found in memory, found on disk and computed (stored), and results evicted
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # Files on disk, oldest first, with their total size
+        self._files = OrderedDict()
+        self._disk_bytes = 0
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            paths = [entry for entry in os.scandir(directory) if entry.name.endswith('.raw')]
+
+            for entry in sorted(paths, key=lambda entry: entry.stat().st_mtime):
+                self._files[entry.name[:-4]] = entry.stat().st_size
+                self._disk_bytes += entry.stat().st_size
+
+    # Hits, disk hits, misses and evictions, with the bytes held in memory and on disk
+    @property
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+                'evictions': self.evictions, 'memory_bytes': self.nbytes, 'disk_bytes': self._disk_bytes}
+
+    # Finds the last of a chain of keys with a stored result, returning its index and the
+    # result (-1 and None if none are stored)
+    def find(self, keys: list) -> (int, object):
+        for index in range(len(keys) - 1, -1, -1):
+            image = self.get(keys[index])
+
+            if image is not None:
+                return index, image
+
+        return -1, None
+
+    # Returns the result stored under the key (None if there isn't one)
+    def get(self, key: str):
+        with self._lock:
+            image = self.entries.get(key)
+
+            if image is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return image
+
+            on_disk = key in self._files
+
+        if not on_disk and self.directory is not None:
+            on_disk = os.path.exists(self._path(key))
+
+        if on_disk:
+            image = self._read(key)
+
+            if image is not None:
+                self.disk_hits += 1
+                self._store(key, image)
+
+        return image
+
+    # Stores a computed result (counted as a miss, the result not having been found)
+    def put(self, key: str, image) -> None:
+        self.misses += 1
+        self._store(key, image)
+
+        # Palette images are only kept in memory (the palette isn't written)
+        if self.directory is not None and key not in self._files and image.mode != 'P':
+            self._write(key, image)
+
+    def _store(self, key: str, image) -> None:
+        size = image_nbytes(image)
+
+        # Results larger than the whole budget are not kept
+        if size > self.memory_budget:
+            return
+
+        with self._lock:
+            if key in self.entries:
+                self.nbytes -= image_nbytes(self.entries.pop(key))
+
+            self.entries[key] = image
+            self.nbytes += size
+
+            while self.nbytes > self.memory_budget:
+                _, evicted = self.entries.popitem(last=False)
+                self.nbytes -= image_nbytes(evicted)
+                self.evictions += 1
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + '.raw')
+
+    # Writes a result to disk (raw pixels after a header line and the image's info, such as its
+    # EXIF data) then removes the oldest files while over the disk budget (if this cache
+    # enforces it)
+    def _write(self, key: str, image) -> None:
+        handle, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        info = _dump_info(image.info)
+
+        try:
+            with os.fdopen(handle, 'wb') as file:
+                file.write(f'{image.mode} {image.width} {image.height} {len(info)}\n'.encode())
+                file.write(info)
+                file.write(image.tobytes())
+
+            os.replace(temp_path, self._path(key))
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+
+        with self._lock:
+            size = os.path.getsize(self._path(key))
+            self._files[key] = size
+            self._disk_bytes += size
+
+        if self.disk_budget is not None:
+            self.trim()
+
+    # Removes the files used least recently while over the disk budget
+    def trim(self) -> None:
+        with self._lock:
+            removed = []
+            while self._disk_bytes > self.disk_budget and len(self._files) > 1:
+                old_key, old_size = self._files.popitem(last=False)
+                self._disk_bytes -= old_size
+                removed.append(old_key)
+
+        for old_key in removed:
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                pass
+
+    # Reads a result from disk, None if it can't be read (such as when removed meanwhile, or
+    # written without its info by an earlier version)
+    def _read(self, key: str):
+        try:
+            with open(self._path(key), 'rb') as file:
+                mode, width, height, info_length = file.readline().decode().split()
+                info = _load_info(file.read(int(info_length)))
+                image = Image.frombytes(mode, (int(width), int(height)), file.read())
+                image.info.update(info)
+                size = os.fstat(file.fileno()).st_size
+
+            os.utime(self._path(key))
+        except (OSError, ValueError):
+            with self._lock:
+                self._disk_bytes -= self._files.pop(key, 0)
+            return None
+
+        # A file written by another process is counted once found
+        with self._lock:
+            if key in self._files:
+                self._files.move_to_end(key)
+            else:
+                self._files[key] = size
+                self._disk_bytes += size
+
+        return image
+
+    def clear(self) -> None:
+        with self._lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+
+def _dump_info(info: dict) -> bytes:
+    """
+    Converts an image's info to JSON, bytes (such as EXIF data and ICC profiles) encoded as
+    base64 and values JSON can't hold left out.
+    :param info: (dict) The image's info.
+    :return: (bytes) The JSON.
+    """
+    values = {}
+
+    for name, value in info.items():
+        if isinstance(value, bytes):
+            values[name] = ['bytes', base64.b64encode(value).decode()]
+        else:
+            try:
+                values[name] = ['value', json.loads(json.dumps(value))]
+            except (TypeError, ValueError):
+                continue
+
+    return json.dumps(values).encode()
+
+
+def _load_info(data: bytes) -> dict:
+    """
+    Converts info written by _dump_info back, lists being restored as tuples (as PIL gives them).
+    :param data: (bytes) The JSON.
+    :return: (dict) The info.
+    """
+    info = {}
+
+    for name, (kind, value) in json.loads(data).items():
+        if kind == 'bytes':
+            info[name] = base64.b64decode(value)
+        else:
+            info[name] = tuple(value) if isinstance(value, list) else value
+
+    return info
+
+
+def image_nbytes(image) -> int:
+    """
+    Gets the memory held by an image's pixels.
+    :param image: (PIL.Image) The image.
+    :return: (int) The number of bytes.
+    """
+    return image.width * image.height * len(image.getbands())
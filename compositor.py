@@ -0,0 +1,41 @@
+from PIL import Image
+
+
+def composite(document, annotations: list = None, operations_applied: tuple = None) -> Image:
+    """
+    Renders the document at its full resolution with every annotation (shapes, pen strokes,
+    inserted images and footers) drawn on top, entirely in memory.
+    :param document: (Document) The document to be rendered.
+    :param annotations: (list) The annotations drawn, if not the document's own (such as a copy
+    taken before rendering in the background).
+    :param operations_applied: (tuple) The operations rendered, if not those recorded against
+    the document (such as those recorded when a save was asked for).
+    :return: (PIL.Image) The rendered image.
+    """
+    image = document.render(operations_applied=operations_applied)
+
+    return draw_annotations(image, document.annotations if annotations is None else annotations)
+
+
+def draw_annotations(image: Image, annotations: list) -> Image:
+    """
+    Draws annotations over an image at its full resolution (such as the document rendered, or
+    one of its frames).
+    :param image: (PIL.Image) The image, which is left unchanged.
+    :param annotations: (list) The annotations drawn.
+    :return: (PIL.Image) The image with the annotations (the image itself if there are none).
+    """
+    if not annotations:
+        return image
+
+    # Annotations are drawn in colour (and inserted images pasted) onto a copy so the
+    # rendered master is left untouched for further edits.
+    if image.mode in ('RGB', 'RGBA'):
+        image = image.copy()
+    else:
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+    for annotation in annotations:
+        annotation.render(image)
+
+    return image
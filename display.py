@@ -0,0 +1,88 @@
+from PIL import ImageChops, ImageTk
+
+
+# Shows images on a canvas through a single photo image and canvas item, both kept for as long
+# as the canvas (the photo image being resized when the size changes). Showing an image only
+# uploads the region that differs from the image shown before, and nothing at all if it is the
+# same image, so refreshing the display after an edit costs as much as the edit changed.
+class Display(object):
+
+    # Above this fraction of the image the whole image is uploaded rather than the region
+    WHOLE_FRACTION = 0.5
+
+    def __init__(self, canvas) -> None:
+        self.canvas = canvas
+
+        # Image displayed, the photo image it was uploaded to and the canvas item showing it
+        self.image = None
+        self.photo = None
+        self.item = None
+
+        # Pixels uploaded so far, showing how much each refresh costs
+        self.uploaded = 0
+
+    # Displays the image (which must not be changed in place afterwards without calling update)
+    def show(self, image) -> None:
+        if image.mode not in ('1', 'L', 'LA', 'RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+
+        previous, self.image = self.image, image
+
+        if self.photo is None:
+            self.photo = ImageTk.PhotoImage('RGBA', image.size, width=image.width, height=image.height)
+            box = (0, 0) + image.size
+        elif previous is None or previous.size != image.size:
+            self.canvas.tk.call(str(self.photo), 'configure', '-width', image.width, '-height', image.height)
+            box = (0, 0) + image.size
+        elif previous is image:
+            box = None
+        else:
+            box = _difference(previous, image)
+
+        if self.item is None:
+            self.item = self.canvas.create_image(0, 0, image=self.photo, anchor='nw', tags='display')
+
+        if box is not None:
+            self.update(box)
+
+    # Uploads a region of the displayed image (by default all of it), such as after drawing on
+    # it in place
+    def update(self, box: tuple = None) -> None:
+        width, height = self.image.size
+        x, y, x2, y2 = (0, 0, width, height) if box is None else \
+            (max(box[0], 0), max(box[1], 0), min(box[2], width), min(box[3], height))
+
+        if x2 <= x or y2 <= y:
+            return
+
+        if (x2 - x) * (y2 - y) >= self.WHOLE_FRACTION * width * height:
+            self.photo.paste(self.image)
+            self.uploaded += width * height
+            return
+
+        # The region is uploaded to a photo image of its own, then copied into place by Tk
+        region = ImageTk.PhotoImage('RGBA', (x2 - x, y2 - y), width=x2 - x, height=y2 - y)
+        region.paste(self.image.crop((x, y, x2, y2)))
+        self.canvas.tk.call(str(self.photo), 'copy', str(region), '-to', x, y, '-compositingrule', 'set')
+        self.uploaded += (x2 - x) * (y2 - y)
+
+    # Removes the image from the canvas (the photo image is kept for the next image shown)
+    def clear(self) -> None:
+        if self.item is not None:
+            self.canvas.delete(self.item)
+
+        self.item = None
+        self.image = None
+
+
+def _difference(previous, image) -> tuple:
+    """
+    Finds the region in which two images of the same size differ.
+    :param previous: (PIL.Image) The image displayed before.
+    :param image: (PIL.Image) The image to be displayed.
+    :return: (tuple) x, y top-left and x, y bottom-right of the region, None if they are the same.
+    """
+    if previous.mode != image.mode:
+        return (0, 0) + image.size
+
+    return ImageChops.difference(previous, image).getbbox(alpha_only=False)
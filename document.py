@@ -0,0 +1,307 @@
+import threading
+import zlib
+
+from PIL import Image
+
+import annotations
+import cache
+import frames
+import operations
+from files import file_stamp
+from history import History, Step
+from pipeline import Pipeline
+
+
+def is_decoded(image) -> bool:
+    """
+    Whether an image's pixels are held in memory, rather than it only having been opened (an
+    opened file's handle being closed once it is decoded).
+    :param image: (PIL.Image) The image.
+    :return: (bool) True if decoded.
+    """
+    return getattr(image, 'fp', None) is None
+
+
+# Holds the full resolution image opened by the user alongside a smaller display proxy.
+# Operations are recorded in a lazy pipeline and previewed by rendering it onto a copy of the
+# image fitted to the window. They are only replayed on the full resolution master when it is
+# needed (saving), with any run of orientation/geometry changes costing a single resample.
+# The master may be given as an image only opened (not yet decoded), alongside a base copy
+# decoded at a reduced scale, in which case it is decoded the first time it is rendered.
+# An inactive document can be released (see release) down to its base copy and preview.
+class Document(object):
+
+    def __init__(self, image, file_path: str = None, proxy_size: (int, int) = None,
+                 history: History = None, base=None, result_cache: cache.ResultCache = None) -> None:
+        self.file_path = file_path
+        self.pipeline = Pipeline(image.size, result_cache)
+
+        # Mode of the image opened, read without waiting for the master (such as by the profiler)
+        self.mode = image.mode
+
+        # Project file the document was saved to or opened from (see project.py)
+        self.project_path = None
+
+        # File the master was opened from (a project's master being kept in the project file)
+        # and its version, the master only being re-opened from an unchanged file
+        self._master_path = getattr(image, 'filename', None) or file_path
+        self._file_stamp = file_stamp(self._master_path) if self._master_path else None
+
+        # Every frame of an animation or multi-page file (see frames.py), the master being the
+        # first, which is all that is displayed
+        self.frames = frames.FrameSource(self._master_path) if frames.is_multi_frame(image) else None
+
+        # The master, or its pixels compressed while released (see release)
+        self._master = image
+        self._compressed = None
+
+        # Stops the master being decoded by two threads at once (see render)
+        self._master_lock = threading.RLock()
+
+        # Undo/redo stacks (memory budget set by the History given)
+        self.history = History() if history is None else history
+
+        # Items added over the image (see annotations.py), in full resolution coordinates
+        self.annotations = []
+
+        # Copy of the master fitted to the window that operations are previewed on
+        if base is not None:
+            self.base = base
+        elif proxy_size is not None and proxy_size != image.size:
+            self.base = image.resize(proxy_size)
+        else:
+            self.base = image
+
+        # Results rendered from the base are cached by its contents (the master's key is only
+        # found when it is first rendered)
+        if result_cache is not None:
+            self.pipeline.sources['proxy'] = cache.image_key(self.base)
+
+        # Image displayed on the canvas, the preview fitted to the given display size
+        self._display_size = None
+        self._proxy = None
+
+    # Full resolution image, decompressed on first use after being released
+    @property
+    def master(self):
+        with self._master_lock:
+            if self._master is None:
+                mode, size, info, palette, data = self._compressed
+                self._master = Image.frombytes(mode, size, zlib.decompress(data))
+                self._master.info.update(info)
+
+                if palette is not None:
+                    self._master.putpalette(palette)
+
+                self._compressed = None
+
+            return self._master
+
+    # Bytes held in memory by the document's images (the master only once decoded)
+    @property
+    def nbytes(self) -> int:
+        images = [self.base, self._proxy] + self.pipeline.images()
+        if self._master is not None and is_decoded(self._master):
+            images.append(self._master)
+
+        unique = {id(image): image for image in images if image is not None}
+        compressed = len(self._compressed[-1]) if self._compressed is not None else 0
+
+        return sum(cache.image_nbytes(image) for image in unique.values()) + compressed
+
+    # Whether the file the master was opened from is unchanged (not having been replaced since,
+    # such as by saving over it), so the master can be read from it again
+    @property
+    def file_unchanged(self) -> bool:
+        return self._file_stamp is not None and self._file_stamp == file_stamp(self._master_path)
+
+    # Frees the memory held at full resolution, the master and its renders, returning the bytes
+    # freed (used for documents not being displayed). The master is re-opened (not decoded)
+    # from its file when that is unchanged, otherwise compressed, and is restored when next
+    # used. The base copy and preview are kept, so the document is displayed again instantly.
+    def release(self) -> int:
+        before = self.nbytes
+
+        with self._master_lock:
+            self.pipeline.forget('master')
+            master = self._master
+
+            if master is not None and is_decoded(master):
+                if self.file_unchanged:
+                    self._master = Image.open(self._master_path)
+                else:
+                    palette = master.getpalette() if master.mode in ('P', 'PA') else None
+                    self._compressed = (master.mode, master.size, dict(master.info), palette,
+                                        zlib.compress(master.tobytes(), 1))
+                    self._master = None
+
+        return before - self.nbytes
+
+    # Closes the file the frames are read from (once any save reading it has finished), the
+    # document itself having been closed
+    def close(self) -> None:
+        if self.frames is not None:
+            self.frames.close()
+
+    # Size of the document at full resolution once every operation has been applied
+    @property
+    def size(self) -> (int, int):
+        return self.pipeline.size
+
+    # Operations rendered onto the base copy (only the operations added since the last
+    # preview are computed)
+    @property
+    def preview(self):
+        return self.pipeline.render(self.base, 'proxy')
+
+    @property
+    def proxy(self):
+        if self._proxy is None:
+            preview = self.preview
+
+            if self._display_size is not None and self._display_size != preview.size:
+                preview = preview.resize(self._display_size)
+
+            self._proxy = preview
+
+        return self._proxy
+
+    # Size of the displayed image relative to the full resolution document
+    @property
+    def scale(self) -> float:
+        return self.proxy.width / self.size[0]
+
+    # Sets the size the preview is displayed at (used to fit the canvas)
+    def fit(self, width: int, height: int) -> None:
+        self._display_size = (width, height)
+        self._proxy = None
+
+    # Records the operation against the document. Pixel arguments (crop box, resize dimensions)
+    # are given in full resolution coordinates. Geometry changes move the annotations with the
+    # image, the step keeping them as they were so undoing restores them.
+    def apply(self, name: str, *args) -> None:
+        before = self.preview
+        size = self.size
+        previous = []
+
+        self.pipeline.append(name, *args)
+
+        if name in operations.GEOMETRY_OPERATIONS:
+            previous = self.annotations[:]
+            self._transform_annotations(size)
+
+        self._reset_display()
+
+        delta = self.history.delta(before, self.preview)
+        self.history.push(Step('operation', (name, args), previous, delta))
+
+    def add_annotation(self, annotation) -> None:
+        self.annotations.append(annotation)
+        self.history.push(Step('annotation', annotation))
+
+    def clear_annotations(self) -> None:
+        self.history.push(Step('clear', self.annotations[:]))
+        self.annotations.clear()
+
+    # Reverts the last step, returning False if there was nothing to undo. The preview is
+    # restored from the step's tile delta rather than re-rendered.
+    def undo(self) -> bool:
+        step = self.history.undo()
+        if step is None:
+            return False
+
+        if step.kind == 'operation':
+            after = self.preview
+            name, _ = self.pipeline.pop()
+            self.pipeline.seed('proxy', step.delta.undo(after, self.history.spill_file))
+
+            if name in operations.GEOMETRY_OPERATIONS:
+                self.annotations[:] = step.annotations
+        elif step.kind == 'annotation':
+            self.annotations.remove(step.value)
+        else:
+            self.annotations[:] = step.value
+
+        self._reset_display()
+
+        return True
+
+    # Re-applies the last undone step, returning False if there was nothing to redo
+    def redo(self) -> bool:
+        step = self.history.redo()
+        if step is None:
+            return False
+
+        if step.kind == 'operation':
+            before = self.preview
+            name, args = step.value
+            size = self.size
+            self.pipeline.append(name, *args)
+            self.pipeline.seed('proxy', step.delta.redo(before, self.history.spill_file))
+
+            if name in operations.GEOMETRY_OPERATIONS:
+                self._transform_annotations(size)
+        elif step.kind == 'annotation':
+            self.annotations.append(step.value)
+        else:
+            self.annotations.clear()
+
+        self._reset_display()
+
+        return True
+
+    # Moves the annotations with the geometry operation just appended, given the size before it
+    def _transform_annotations(self, size: (int, int)) -> None:
+        name, args = self.pipeline.operations[-1]
+        self.annotations[:] = annotations.transform(self.annotations, name, args, size)
+
+    # The preview is displayed at its own size until fitted again
+    def _reset_display(self) -> None:
+        self._display_size = None
+        self._proxy = None
+
+    # Replays the recorded operations (or those given) on the master, returning the full
+    # resolution result (progress is passed on to the pipeline, see Pipeline.render)
+    def render(self, progress=None, operations_applied: tuple = None):
+        self.load()
+
+        return self.pipeline.render(self.master, 'master', progress, operations_applied)
+
+    # Decodes the master if it has only been opened, identifying it for the result cache by
+    # the contents of its file when it is one (otherwise by its pixels)
+    def load(self) -> None:
+        with self._master_lock:
+            self.master.load()
+
+            if self.pipeline.result_cache is not None and 'master' not in self.pipeline.sources:
+                path = getattr(self.master, 'filename', None)
+                self.pipeline.sources['master'] = cache.file_key(path) if path else cache.image_key(self.master)
+
+    # EXIF data of the document, none once it has been removed
+    @property
+    def exif(self):
+        if self.metadata_stripped:
+            return {}
+
+        return self.master.getexif()
+
+    # Whether the EXIF data has been removed (see operations.strip_exif)
+    @property
+    def metadata_stripped(self) -> bool:
+        return any(name == 'strip_exif' for name, _ in self.pipeline.operations)
+
+    # Whether the pixels are unchanged from the opened file, nothing but metadata having been
+    # removed (so the file can be saved without re-encoding it)
+    @property
+    def metadata_only(self) -> bool:
+        return self.metadata_stripped and not self.annotations and \
+            all(name == 'strip_exif' for name, _ in self.pipeline.operations)
+
+    # Displays a more accurate version of the proxy, such as the full resolution result scaled
+    # down, until the display is next fitted or changed
+    def refine(self, image) -> None:
+        self._proxy = image
+
+    # Converts a point on the canvas to the matching point on the full resolution document
+    def to_master(self, x: int, y: int) -> (int, int):
+        return round(x / self.scale), round(y / self.scale)
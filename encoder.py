@@ -0,0 +1,161 @@
+import contextlib
+import os
+import shutil
+import tempfile
+import time
+import zlib
+
+from PIL import Image
+
+# zlib strategies PNG data can be compressed with (PIL choosing the row filters itself): quicker
+# or smaller depending on the image, 'rle' and 'huffman' being fastest
+PNG_STRATEGIES = {
+    'default': zlib.Z_DEFAULT_STRATEGY,
+    'filtered': zlib.Z_FILTERED,
+    'rle': zlib.Z_RLE,
+    'huffman': zlib.Z_HUFFMAN_ONLY,
+    'fixed': zlib.Z_FIXED,
+}
+
+# Settings of the formats that can be tuned for speed or size, with their defaults (PIL's own)
+OPTIONS = {
+    'PNG': {'compress_level': 6, 'strategy': 'default'},
+    'JPEG': {'quality': 75, 'progressive': False, 'optimize': False},
+    'WEBP': {'lossless': False, 'quality': 80},
+}
+
+# Permissions new files are created with (mkstemp only allowing the owner access)
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+@contextlib.contextmanager
+def atomic_write(path: str, mode: str = 'wb'):
+    """
+    Opens a temporary file alongside the path for writing, which is flushed to disk and then
+    replaces the path once written. The file at the path is therefore always complete (the old
+    version or the new), even if writing fails or the machine crashes. A file replaced keeps its
+    permissions.
+    :param path: (str) Path of the file to be written.
+    :param mode: (str) Binary mode the file is opened in ('w+b' allowing it to be read back).
+    :return: (file) The temporary file.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    handle, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+
+    try:
+        with os.fdopen(handle, mode) as file:
+            yield file
+
+            file.flush()
+            os.fsync(file.fileno())
+
+        if os.path.exists(path):
+            shutil.copymode(path, temp_path)
+        else:
+            os.chmod(temp_path, 0o666 & ~_UMASK)
+
+        os.replace(temp_path, path)
+        _fsync_directory(directory)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def _fsync_directory(directory: str) -> None:
+    """
+    Flushes a directory to disk so a file renamed into it persists (where the platform allows
+    directories to be opened, which Windows doesn't).
+    :param directory: (str) Path of the directory.
+    """
+    try:
+        handle = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+
+    try:
+        os.fsync(handle)
+    except OSError:
+        pass
+    finally:
+        os.close(handle)
+
+
+def format_for(path: str) -> str:
+    """
+    Gets the format an image is saved in from the extension of its path.
+    :param path: (str) Path of the image.
+    :return: (str) The PIL format name.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    image_format = Image.registered_extensions().get(extension)
+
+    if image_format is None or image_format not in Image.SAVE:
+        raise ValueError(f"Images can't be saved as '{extension or os.path.basename(path)}'")
+
+    return image_format
+
+
+def save_arguments(image_format: str, options: dict = None) -> dict:
+    """
+    Converts the settings of a format to the arguments PIL saves it with.
+    :param image_format: (str) The PIL format name.
+    :param options: (dict) Settings differing from the defaults (see OPTIONS).
+    :return: (dict) Keyword arguments of PIL's Image.save.
+    """
+    settings = dict(OPTIONS.get(image_format, {}), **(options or {}))
+
+    if image_format == 'PNG':
+        return {'compress_level': settings['compress_level'], 'compress_type': PNG_STRATEGIES[settings['strategy']]}
+
+    if image_format == 'JPEG':
+        return {'quality': settings['quality'], 'progressive': settings['progressive'],
+                'optimize': settings['optimize']}
+
+    if image_format == 'WEBP':
+        return {'lossless': settings['lossless'], 'quality': settings['quality']}
+
+    return settings
+
+
+def encode(image: Image, path: str, image_format: str = None, options: dict = None,
+           exif: bytes = None) -> (float, int):
+    """
+    Saves an image with the given settings, written atomically (see atomic_write). Images are
+    converted to a mode the format supports (JPEG has no alpha channel, other formats being
+    written in RGB, or RGBA with transparency, when they can't hold the image's mode).
+    :param image: (PIL.Image) The image to be saved.
+    :param path: (str) The file path to save to.
+    :param image_format: (str) The PIL format name (found from the path if not given).
+    :param options: (dict) Settings differing from the defaults (see OPTIONS).
+    :param exif: (bytes) EXIF data written with the image (formats without EXIF ignoring it).
+    :return: Tuple(float, int) Seconds taken to encode and write the image, and its size in bytes.
+    """
+    image_format = image_format or format_for(path)
+    start = time.perf_counter()
+    arguments = save_arguments(image_format, options)
+
+    if exif:
+        arguments['exif'] = exif
+
+    if image_format == 'JPEG' and image.mode not in ('RGB', 'L', 'CMYK'):
+        image = image.convert('RGB')
+    elif image_format == 'WEBP' and image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+
+    with atomic_write(path) as file:
+        try:
+            image.save(file, image_format, **arguments)
+        except (OSError, ValueError):
+            # PIL refuses modes the format can't hold (such as LA as BMP or CMYK as PNG)
+            if image.mode in ('RGB', 'RGBA'):
+                raise
+
+            file.seek(0)
+            file.truncate()
+            image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+            image.save(file, image_format, **arguments)
+
+    return time.perf_counter() - start, os.path.getsize(path)
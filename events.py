@@ -1,5 +1,43 @@
-from tkinter import filedialog, messagebox, colorchooser, Canvas, Event, Text, simpledialog
-from PIL import Image, ImageOps, ImageFilter, ImageGrab, ExifTags, ImageTk
+import os
+import time
+from tkinter import filedialog, messagebox, colorchooser, Event, Text, simpledialog
+from PIL import Image
+from annotations import Shape, Stroke, InsertedImage, Footer
+from files import find_images
+from document import Document
+from viewport import Pyramid, Viewport
+import adjustments
+import compositor
+import encoder
+import exif_index
+import frames
+import library
+import metadata
+import overlays
+import project
+import thumbnails
+
+# Minimum milliseconds between moving the canvas while the window is resized (roughly one
+# frame at 60Hz)
+RESIZE_INTERVAL = 16
+
+# Operations rendered at full resolution in the background after their preview is shown,
+# with the description displayed alongside the job's progress
+BACKGROUND_OPERATIONS = {
+    'grayscale': 'Black & white',
+    'blur': 'Blur',
+    'emboss': 'Emboss',
+    'sharpen': 'Sharpen',
+    'rotate': 'Rotate',
+    'resize': 'Resize',
+    'brightness': 'Brightness',
+    'contrast': 'Contrast',
+    'gamma': 'Gamma',
+    'levels': 'Levels',
+    'curves': 'Curves',
+    'gaussian_blur': 'Gaussian blur',
+    'convolve': 'Custom kernel',
+}
 
 
 def set_image(app, image: Image) -> None:
@@ -11,75 +49,430 @@ def set_image(app, image: Image) -> None:
     """
     app.opened_image = image
 
+    _place_canvas(app, image.size)
+
+    # Clears anything drawn over the previous image, only the pixels of the image that differ
+    # from it being uploaded
+    _clear_canvas(app)
+    app.display.show(image)
+
+    # Re-draws anything added over the image at the current display scale, pen strokes
+    # being rasterized into a single layer
+    app.stroke_engine.create_layer(image.size)
+
+    if app.document is not None:
+        for annotation in app.document.annotations:
+            _draw_annotation(app, annotation)
+
+    app.stroke_engine.refresh()
+
+
+def _place_canvas(app, size: (int, int)) -> None:
+    """
+    Sizes the canvas to the image it is to display, centering it in the window below the tabs.
+    :param app: (Window) main window class providing access to application variables.
+    :param size: Tuple(int, int) The width, height of the image.
+    """
     # x, y of top left corner of canvas to allow it to be centered
-    x = (app.root.winfo_width() // 2) - (image.width // 2)
-    y = (app.root.winfo_height() // 2) - (image.height // 2)
+    x = (app.root.winfo_width() // 2) - (size[0] // 2)
+    y = app.TAB_BAR_HEIGHT + ((app.root.winfo_height() - app.TAB_BAR_HEIGHT) // 2) - (size[1] // 2)
+
+    app.canvas.place_configure(x=x, y=y, width=size[0], height=size[1])
 
-    app.canvas.place_configure(x=x, y=y, width=image.width, height=image.height)
 
-    image_p = ImageTk.PhotoImage(image)
-    app.canvas.image = image_p
-    app.canvas.create_image(0, 0, image=image_p, anchor='nw')
+def _clear_canvas(app) -> None:
+    """
+    Removes everything drawn over the image from the canvas, the items displaying the image and
+    the pen stroke layer being kept (see display.py).
+    :param app: (Window) main window class providing access to application variables.
+    """
+    app.canvas.delete(*[item for item in app.canvas.find_all() if 'display' not in app.canvas.gettags(item)])
 
 
 def _calculate_scale(app, image: Image) -> (int, int):
     """
     Calculates the required width, height for the currently being loaded image to fit in
-    the canvas at its current size. Incrementally reducing the current height and width
-    by 1% to maintain aspect ratio.
+    the canvas at its current size, scaling both by the same factor to maintain aspect ratio
+    (images that already fit are left at their size).
     :param app: (Window) main window class providing access to application variables.
-    :param image: (PIL.Image) Image to be loaded onto the canvas requiring scaling.
+    :param image: (PIL.Image) Image to be loaded onto the canvas requiring scaling (only its
+    size is needed, so it may be opened but not yet decoded).
     :return: Tuple(int, int) the calculated width and height for the scaled image.
     """
     width, height = image.width, image.height
-    width_max, height_max = app.root.winfo_width(), app.root.winfo_height()
+    width_max, height_max = app.root.winfo_width(), app.root.winfo_height() - app.TAB_BAR_HEIGHT
+
+    factor = min(width_max / width, height_max / height, 1)
+
+    return max(int(width * factor), 1), max(int(height * factor), 1)
+
+
+def _decode_draft(path: str):
+    """
+    Quickly decodes a JPEG at the smallest scale its codec supports (an eighth of its width and
+    height, decoding only a fraction of the data), as a placeholder while the image is opened.
+    :param path: (str) Path of the image.
+    :return: (PIL.Image) The reduced image, None if the file is not a JPEG.
+    """
+    draft = Image.open(path)
+
+    if draft.format != 'JPEG':
+        draft.close()
+        return None
 
-    # Calculates 1% of the width and height
-    increment_width, increment_height = width / 100, height / 100
+    draft.draft(None, (1, 1))
+    draft.load()
 
-    # Inefficient but sufficient for this application as no other processes run simultaneously.
-    while width > width_max or height > height_max:
-        width -= increment_width
-        height -= increment_height
+    return draft
 
-    return int(width), int(height)
 
+def _decode_base(master: Image, path: str, size: (int, int), draft: Image) -> Image:
+    """
+    Decodes the copy of an image fitted to the window that edits are previewed on. JPEGs are
+    decoded at the smallest scale no smaller than the fitted size, only other formats being
+    decoded in full (the master then being ready for rendering).
+    :param master: (PIL.Image) The image opened at full resolution.
+    :param path: (str) Path of the image.
+    :param size: Tuple(int, int) The fitted size.
+    :param draft: (PIL.Image) The placeholder decoded by _decode_draft (None if not a JPEG).
+    :return: (PIL.Image) The image decoded and resized to the fitted size.
+    """
+    if draft is not None and draft.width < size[0]:
+        draft = Image.open(path)
+        draft.draft(None, size)
+
+    source = master if draft is None else draft
+
+    return source.resize(size, reducing_gap=3.0) if source.size != size else source.copy()
+
+
+def _show_placeholder(app, image: Image) -> None:
+    """
+    Displays a stand-in for an image still being opened, centred as set_image would. Nothing
+    can be edited until the image itself is set.
+    :param app: (Window) main window class providing access to application variables.
+    :param image: (PIL.Image) The placeholder, already fitted to the window.
+    """
+    app.opened_image = None
+
+    _place_canvas(app, image.size)
+    _clear_canvas(app)
+    app.display.show(image)
+    app.stroke_engine.create_layer(image.size)
 
-def _get_image_coordinates(app) -> (int, int, int, int):
+
+def _apply_operation(app, name: str, *args) -> None:
+    """
+    Records the named operation against the open document, displaying the updated preview
+    (fitted to the window when the operation has made it too large).
+    :param app: (Window) main window class providing access to application variables.
+    :param name: (str) Name of the operation to apply (see operations.OPERATIONS).
+    :param args: The operation's arguments, pixel values given in full resolution coordinates.
+    """
+    app.document.apply(name, *args)
+    _show_document(app)
+
+    if name in BACKGROUND_OPERATIONS:
+        _refine_document(app, BACKGROUND_OPERATIONS[name])
+
+
+def _refine_document(app, label: str) -> None:
     """
-    Gets the x,y of the top left and bottom right corners of the canvas for
-    cropping and saving.
+    Renders the open document at full resolution in the background, then swaps the result
+    (scaled to the display size) in for the quicker proxy preview, provided nothing has
+    changed since. Any earlier render still running is cancelled as it has been superseded.
     :param app: (Window) main window class providing access to application variables.
-    :return: Tuple(int, int, int, int) x top-left, y top-left, x bottom-right, y bottom-right
+    :param label: (str) Description of the job shown alongside its progress.
     """
-    x = app.canvas.winfo_rootx()
-    y = app.canvas.winfo_rooty()
-    x2 = x + app.opened_image.width
-    y2 = y + app.opened_image.height
+    document = app.document
+    operations_applied = tuple(document.pipeline.operations)
+    size = document.proxy.size
+
+    def render(progress) -> Image:
+        image = document.render(progress)
+        progress(1.0)
+        return image.resize(size, reducing_gap=3.0)
+
+    def swap(image: Image) -> None:
+        if app.document is document and tuple(document.pipeline.operations) == operations_applied \
+                and document.proxy.size == image.size:
+            document.refine(image)
+            set_image(app, document.proxy)
+
+        # The full resolution render is now held by the document
+        app.session.enforce_budget()
 
-    return x, y, x2, y2
+    app.jobs.submit(label, render, swap, kind='render')
+
+
+def _show_document(app) -> None:
+    """
+    Displays the open document's preview, fitted to the window when it is too large.
+    :param app: (Window) main window class providing access to application variables.
+    """
+    document = app.document
+
+    width, height = _calculate_scale(app, document.preview)
+    document.fit(width, height)
+    set_image(app, document.proxy)
+
+    # Operations add to the memory held, which may leave less for the other documents
+    app.session.enforce_budget()
+
+
+def _draw_annotation(app, annotation) -> Text:
+    """
+    Draws an annotation (shape, stroke, inserted image or footer) over the image on the canvas.
+    :param app: (Window) main window class providing access to application variables.
+    :param annotation: The annotation to be drawn (see annotations.py).
+    :return: (Tkinter.Text) The text widget of a footer, otherwise None.
+    """
+    if isinstance(annotation, Stroke):
+        app.stroke_engine.rasterize(annotation, app.document.scale)
+        return None
+
+    widget = annotation.draw(app.canvas, app.document.scale)
+
+    # Binding to allow the removal of focus on the footer.
+    if isinstance(annotation, Footer):
+        widget.bind('<FocusIn>', lambda event: _prepare_footer_focus_removal(event, app))
+
+    return widget
+
+
+def _add_annotation(app, annotation) -> Text:
+    """
+    Adds an annotation to the open document, drawing it over the image on the canvas.
+    :param app: (Window) main window class providing access to application variables.
+    :param annotation: The annotation to be added (see annotations.py).
+    :return: (Tkinter.Text) The text widget of a footer, otherwise None.
+    """
+    app.document.add_annotation(annotation)
+
+    return _draw_annotation(app, annotation)
+
+
+def _save_document(app, path: str) -> None:
+    """
+    Writes the open document, with everything added over it, to the given path at full
+    resolution (rendered in memory rather than captured from the screen). Rendering and
+    encoding run in the background with the settings chosen for the format (see Save options),
+    the file being replaced atomically once written, and the time taken and size of the file
+    are shown afterwards. Every frame of an animation or multi-page file is saved (one frame at
+    a time) when the format can hold them.
+    :param app: (Window) main window class providing access to application variables.
+    :param path: (str) The file path to save to.
+    """
+    document = app.document
+
+    try:
+        image_format = encoder.format_for(path)
+    except ValueError as error:
+        messagebox.showerror(title='Error', message=str(error))
+        return
+
+    options = {name: variable.get() for name, variable in app.save_options.get(image_format, {}).items()}
+    annotations = document.annotations[:]
+    operations_applied = tuple(document.pipeline.operations)
+    all_frames = document.frames is not None and image_format in frames.FORMATS
+    workers = (os.cpu_count() or 1) if app.parallel_frames.get() else 0
+
+    # When only the EXIF data has been removed the file is copied without it rather than
+    # re-encoded, provided it is saved in the same format
+    metadata_only = document.metadata_only and metadata.format_of(document.file_path) == image_format
+
+    def save(progress) -> (float, int):
+        if metadata_only:
+            # The master is decoded first as its file may be the one replaced
+            start = time.perf_counter()
+            document.load()
+            metadata.strip(document.file_path, path)
+            return time.perf_counter() - start, os.path.getsize(path)
+
+        if all_frames:
+            return frames.save(document.frames, operations_applied, annotations, path, image_format, options,
+                               workers, progress)
+
+        # Edits made while earlier saves finish are left out
+        image = compositor.composite(document, annotations, operations_applied)
+        progress(0.5)
+
+        return encoder.encode(image, path, image_format, options)
+
+    def report(result: (float, int)) -> None:
+        seconds, size = result
+        app.menu_bar.entryconfig(app.STATE_MENU_ITEM_INDEX, label=f'State: Saved {os.path.basename(path)} '
+                                                                  f'({size / 1024 / 1024:.1f} MB in {seconds:.2f} s)')
+
+    app.jobs.submit('Saving', save, report, kind='save')
 
 
 def open_picture(app) -> None:
     """
-    Opens the desired image, displaying it on the canvas.
+    Opens the desired image in a new tab, displaying it on the canvas (switching to its tab
+    if it is already open).
     :param app: (Window) main window class providing access to application variables.
     """
     filepath = filedialog.askopenfilename()
 
-    if not filepath:
+    if filepath:
+        open_file(app, filepath)
+
+
+def browse_folder(app) -> None:
+    """
+    Opens a window showing thumbnails of the images in a folder (replacing any already open),
+    clicking one opening it. Thumbnails are generated in the background the first time and kept
+    on disk for later.
+    :param app: (Window) main window class providing access to application variables.
+    """
+    folder = filedialog.askdirectory(title='Select folder to browse')
+
+    if not folder:
+        return
+
+    if app.thumbnail_cache is None:
+        app.thumbnail_cache = thumbnails.ThumbnailCache()
+
+    if app.browser is not None:
+        app.browser.close()
+
+    paths = [path for path, _ in find_images([folder])]
+    app.browser = thumbnails.ThumbnailBrowser(app, paths, app.thumbnail_cache, title=os.path.basename(folder),
+                                              on_open=lambda path: open_file(app, path))
+
+
+def open_file(app, filepath: str) -> None:
+    """
+    Opens an image or project file in a new tab (switching to its tab if it is already open).
+    :param app: (Window) main window class providing access to application variables.
+    :param filepath: (str) Path of the file.
+    """
+    document = app.session.find(filepath)
+    if document is not None:
+        switch_document(app, document)
+        return
+
+    if filepath.lower().endswith(project.PROJECT_EXTENSION):
+        _add_document(app, project.load(filepath, app.result_cache))
         return
 
+    # A recently closed file is re-opened from the images it was decoded into, with nothing
+    # decoded when the window is the same size
+    image, base = app.session.take(filepath)
+    if image is None:
+        image = Image.open(filepath)
+
+    size = _calculate_scale(app, image)
+
+    if base is not None and base.size == size:
+        _add_document(app, Document(image, filepath, size, base=base, result_cache=app.result_cache))
+        return
+
+    # Only the header is read here, the pixels being decoded off the main thread (the master
+    # itself not until it is first rendered) with a reduced placeholder shown in the meantime.
+    # Work on the document shown until now is no longer needed.
+    app.jobs.cancel('render', 'zoom')
+    app.stroke_engine.finish()
     app.opened_file_path = filepath
-    image = Image.open(filepath)
+    app.document = None
+
+    draft = _decode_draft(filepath)
+    _show_placeholder(app, draft.resize(size) if draft is not None else Image.new('RGB', size, 'grey'))
+
+    def decode(progress) -> Image:
+        return _decode_base(image, filepath, size, draft)
+
+    def show(base: Image) -> None:
+        if app.opened_file_path != filepath or app.document is not None:
+            return
+
+        _add_document(app, Document(image, filepath, size, base=base, result_cache=app.result_cache))
+
+    app.jobs.submit('Opening', decode, show, kind='open')
+
+
+def _add_document(app, document: Document) -> None:
+    """
+    Adds a document to the session as a new tab and displays it.
+    :param app: (Window) main window class providing access to application variables.
+    :param document: (Document) The document opened.
+    """
+    app.session.add(document)
+    _display_document(app, document)
+
+
+def _display_document(app, document: Document) -> None:
+    """
+    Makes a document of the session the open one, fitting its preview to the window (anything
+    being drawn on the previous one being finished first).
+    :param app: (Window) main window class providing access to application variables.
+    :param document: (Document) The document to display, None to leave the canvas empty.
+    """
+    app.stroke_engine.finish()
+    app.document = document
+
+    if document is None:
+        app.opened_file_path = None
+        app.opened_image = None
+        _clear_canvas(app)
+        app.display.clear()
+        app.stroke_engine.display.clear()
+    else:
+        app.opened_file_path = document.file_path
+        app.session.activate(document)
+        _show_document(app)
+
+    app.tabs.update()
+
+
+def switch_document(app, document: Document) -> None:
+    """
+    Displays another open document (called by selecting its tab), cancelling the current one's
+    background render (and any image still being opened).
+    :param app: (Window) main window class providing access to application variables.
+    :param document: (Document) The document to display.
+    """
+    if document is app.document:
+        return
+
+    app.jobs.cancel('render', 'zoom', 'open')
+    _display_document(app, document)
+
+
+def next_document(app) -> None:
+    """
+    Displays the document of the next tab (the first after the last).
+    :param app: (Window) main window class providing access to application variables.
+    """
+    documents = app.session.documents
+    if len(documents) < 2:
+        return
 
-    width, height = _calculate_scale(app, image)
-    set_image(app, image.resize((width, height)))
+    index = documents.index(app.document) + 1 if app.document in documents else 0
+    switch_document(app, documents[index % len(documents)])
+
+
+def close_picture(app) -> None:
+    """
+    Closes the open document's tab (if confirmed when it has changes), displaying the most
+    recently used of the others.
+    :param app: (Window) main window class providing access to application variables.
+    """
+    document = app.document
+
+    if (document.pipeline.operations or document.annotations) and not messagebox.askokcancel(
+            title='Confirm',
+            message='Close the image? Any changes not saved will be lost.'):
+        return
+
+    app.jobs.cancel('render', 'zoom', 'open')
+    _display_document(app, app.session.close(document))
 
 
 def save_picture(app) -> None:
     """
-    Re-writes the opened image (file path) with the current image on the canvas
+    Re-writes the opened image (file path) with the current image at full resolution
     (If confirmation is given).
     :param app: (Window) main window class providing access to application variables.
     """
@@ -88,11 +481,7 @@ def save_picture(app) -> None:
             message='Are you sure you wish to overwrite the file?'):
         return
 
-    x, y, x2, y2 = _get_image_coordinates(app)
-
-    saved_image = ImageGrab.grab().crop((x, y, x2, y2))
-    saved_image.save(app.opened_file_path)
-    set_image(app, saved_image)
+    _save_document(app, app.opened_file_path)
 
 
 def save_picture_as(app) -> None:
@@ -100,22 +489,48 @@ def save_picture_as(app) -> None:
     Allows the user to save the current canvas as an image with a user specified filename.
     :param app: (Window) main window class providing access to application variables.
     """
-    new_path = filedialog.asksaveasfile(defaultextension='.png',
-                                        filetypes=[('Image', '.png'), ('All files', '.*')])
+    # Only the name is asked for, the file being left untouched until the image is written
+    new_path = filedialog.asksaveasfilename(defaultextension='.png',
+                                            filetypes=[('PNG', '.png'), ('JPEG', ('.jpg', '.jpeg')),
+                                                       ('WebP', '.webp'), ('GIF', '.gif'),
+                                                       ('TIFF', ('.tif', '.tiff')), ('All files', '.*')])
     if not new_path:
         return
 
-    x, y, x2, y2 = _get_image_coordinates(app)
+    _save_document(app, new_path)
 
-    saved_image = ImageGrab.grab().crop((x, y, x2, y2))
-    saved_image.save(new_path.name)
-    set_image(app, saved_image)
+
+def save_project(app) -> None:
+    """
+    Saves the open document as a project, keeping everything added over the image and the edit
+    history so it can be re-opened as it was (written in the background).
+    :param app: (Window) main window class providing access to application variables.
+    """
+    document = app.document
+    initial = os.path.basename(document.project_path or os.path.splitext(document.file_path)[0] +
+                               project.PROJECT_EXTENSION)
+
+    path = filedialog.asksaveasfilename(defaultextension=project.PROJECT_EXTENSION, initialfile=initial,
+                                        filetypes=[('Project', project.PROJECT_EXTENSION), ('All files', '.*')])
+    if not path:
+        return
+
+    app.stroke_engine.finish()
+
+    # Edits made while the project is written are left out
+    state = project.snapshot(document)
+
+    def write(progress) -> None:
+        project.save(document, path, progress, state)
+
+    app.jobs.submit('Saving project', write, lambda result: app.tabs.update(), kind='save')
 
 
 def window_resize(event: Event, app) -> None:
     """
-    Positions the canvas at the center of the window upon resizing/maximising. (Removes drawing
-    or inserted items that haven't been saved).
+    Positions the canvas at the center of the window upon resizing/maximising. Dragging the
+    window's edge sends many events a frame, so the canvas is moved once a frame at most
+    (nothing being redrawn, the image is the same size).
     :param event: (Tkinter.Event) accessor to triggered event variables.
     :param app: (Window) main window class providing access to application variables.
     """
@@ -125,7 +540,20 @@ def window_resize(event: Event, app) -> None:
 
     app.current_width = app.root.winfo_width()
     app.current_height = app.root.winfo_height()
-    set_image(app, app.opened_image)
+
+    if app.resize_frame is None:
+        app.resize_frame = app.root.after(RESIZE_INTERVAL, lambda: _center_canvas(app))
+
+
+def _center_canvas(app) -> None:
+    """
+    Moves the canvas to the center of the window at its current size (see window_resize).
+    :param app: (Window) main window class providing access to application variables.
+    """
+    app.resize_frame = None
+
+    if app.opened_image is not None:
+        _place_canvas(app, app.opened_image.size)
 
 
 def filter_black_white(app) -> None:
@@ -133,8 +561,7 @@ def filter_black_white(app) -> None:
     Applies the grayscale PIL filter to the currently opened image.
     :param app: (Window) main window class providing access to application variables.
     """
-    image = ImageOps.grayscale(app.opened_image)
-    set_image(app, image)
+    _apply_operation(app, 'grayscale')
 
 
 def filter_blur(app) -> None:
@@ -142,8 +569,7 @@ def filter_blur(app) -> None:
     Applies the blur PIL filter to the currently opened image.
     :param app: (Window) main window class providing access to application variables.
     """
-    image = app.opened_image.filter(ImageFilter.BLUR)
-    set_image(app, image)
+    _apply_operation(app, 'blur')
 
 
 def filter_emboss(app) -> None:
@@ -151,8 +577,7 @@ def filter_emboss(app) -> None:
     Applies the emboss PIL filter to the currently opened image.
     :param app: (Window) main window class providing access to application variables.
     """
-    image = app.opened_image.filter(ImageFilter.EMBOSS)
-    set_image(app, image)
+    _apply_operation(app, 'emboss')
 
 
 def filter_sharpen(app) -> None:
@@ -160,8 +585,136 @@ def filter_sharpen(app) -> None:
     Applies the sharpen PIL filter to the currently opened image.
     :param app: (Window) main window class providing access to application variables.
     """
-    image = app.opened_image.filter(ImageFilter.SHARPEN)
-    set_image(app, image)
+    _apply_operation(app, 'sharpen')
+
+
+def _ask_percentage(title: str, prompt: str) -> int:
+    """
+    Prompts the user for a percentage (between 1 and 500).
+    :param title: (str) Title of the prompt.
+    :param prompt: (str) Text of the prompt.
+    :return: (int) The percentage entered, None if cancelled.
+    """
+    return simpledialog.askinteger(title=title, prompt=prompt, initialvalue=100, minvalue=1, maxvalue=500)
+
+
+def filter_brightness(app) -> None:
+    """
+    Brightens or darkens the currently opened image by the percentage entered.
+    :param app: (Window) main window class providing access to application variables.
+    """
+    percent = _ask_percentage('Brightness', 'Enter the brightness as a percentage\n(100 leaves the image unchanged).')
+
+    if percent is not None:
+        _apply_operation(app, 'brightness', percent)
+
+
+def filter_contrast(app) -> None:
+    """
+    Increases or reduces the contrast of the currently opened image by the percentage entered.
+    :param app: (Window) main window class providing access to application variables.
+    """
+    percent = _ask_percentage('Contrast', 'Enter the contrast as a percentage\n(100 leaves the image unchanged).')
+
+    if percent is not None:
+        _apply_operation(app, 'contrast', percent)
+
+
+def filter_gamma(app) -> None:
+    """
+    Applies gamma correction to the currently opened image (entered as a percentage).
+    :param app: (Window) main window class providing access to application variables.
+    """
+    percent = _ask_percentage('Gamma', 'Enter the gamma as a percentage\n(above 100 brightens the mid tones).')
+
+    if percent is not None:
+        _apply_operation(app, 'gamma', percent)
+
+
+def filter_levels(app) -> None:
+    """
+    Stretches the values of the currently opened image between the black and white points
+    entered (via prompts).
+    :param app: (Window) main window class providing access to application variables.
+    """
+    black = simpledialog.askinteger(title='Levels', prompt='Enter the black point (0-254).',
+                                    initialvalue=0, minvalue=0, maxvalue=254)
+    if black is None:
+        return
+
+    white = simpledialog.askinteger(title='Levels', prompt=f'Enter the white point ({black + 1}-255).',
+                                    initialvalue=255, minvalue=black + 1, maxvalue=255)
+    if white is None:
+        return
+
+    _apply_operation(app, 'levels', black, white)
+
+
+def filter_curves(app) -> None:
+    """
+    Maps the values of the currently opened image along a curve through the points entered
+    (as 'input:output' pairs separated by spaces).
+    :param app: (Window) main window class providing access to application variables.
+    """
+    text = simpledialog.askstring(
+        title='Curves',
+        prompt='Enter the points of the curve as input:output pairs (0-255)\nseparated by spaces.',
+        initialvalue='0:0 64:48 192:208 255:255')
+
+    if not text:
+        return
+
+    try:
+        points = [int(value) for pair in text.split() for value in pair.split(':')]
+        adjustments.curves_lut(*points)
+    except ValueError:
+        messagebox.showerror(title='Error', message='Points must be pairs of whole numbers, such as 0:0 255:255.')
+        return
+
+    _apply_operation(app, 'curves', *points)
+
+
+def filter_gaussian_blur(app) -> None:
+    """
+    Applies a Gaussian blur of the radius entered to the currently opened image.
+    :param app: (Window) main window class providing access to application variables.
+    """
+    radius = simpledialog.askinteger(title='Gaussian blur', prompt='Enter the blur radius in pixels.',
+                                     initialvalue=2, minvalue=1, maxvalue=200)
+
+    if radius is not None:
+        _apply_operation(app, 'gaussian_blur', radius)
+
+
+def filter_kernel(app) -> None:
+    """
+    Applies a kernel entered by the user (rows separated by ';', weights by ',') to the
+    currently opened image.
+    :param app: (Window) main window class providing access to application variables.
+    """
+    text = simpledialog.askstring(
+        title='Custom kernel',
+        prompt='Enter a square kernel with an odd size, rows separated by ;\nand weights by , '
+               '(the result is divided by the sum of the weights).',
+        initialvalue='0, -1, 0; -1, 5, -1; 0, -1, 0')
+
+    if not text:
+        return
+
+    try:
+        rows = [[int(value) for value in row.split(',')] for row in text.split(';')]
+        if any(len(row) != len(rows) for row in rows) or len(rows) % 2 == 0:
+            raise ValueError()
+    except ValueError:
+        messagebox.showerror(title='Error', message='The kernel must be square with an odd size, '
+                                                    'such as 0, -1, 0; -1, 5, -1; 0, -1, 0.')
+        return
+
+    if len(rows) > 5 and adjustments.numpy is None:
+        messagebox.showerror(title='Error', message='Kernels larger than 5x5 need NumPy to be installed.')
+        return
+
+    _apply_operation(app, 'convolve', len(rows), *[value for row in rows for value in row])
 
 
 def crop(app, x, y, x2, y2) -> None:
@@ -181,8 +734,11 @@ def crop(app, x, y, x2, y2) -> None:
     if y2 < y:
         y, y2 = y2, y
 
-    image = app.opened_image.crop((x, y, x2, y2))
-    set_image(app, image)
+    # Canvas coordinates are converted to full resolution and kept within the image
+    x, y = app.document.to_master(max(x, 0), max(y, 0))
+    x2, y2 = app.document.to_master(min(x2, app.opened_image.width), min(y2, app.opened_image.height))
+
+    _apply_operation(app, 'crop', x, y, x2, y2)
 
 
 def resize_image(app) -> None:
@@ -191,7 +747,7 @@ def resize_image(app) -> None:
     canvas image at will.
     :param app: (Window) main window class providing access to application variables.
     """
-    width, height = app.opened_image.width, app.opened_image.height
+    width, height = app.document.size
 
     width = simpledialog.askinteger(
         title='Enter new width',
@@ -201,7 +757,10 @@ def resize_image(app) -> None:
         title='Enter new width',
         prompt=f'Enter the new image height\n(the current height is {height}).')
 
-    set_image(app, app.opened_image.resize((width, height)))
+    if width is None or height is None:
+        return
+
+    _apply_operation(app, 'resize', width, height)
 
 
 def rotate(app) -> None:
@@ -209,9 +768,7 @@ def rotate(app) -> None:
     Rotates the currently opened image 90 degrees.
     :param app: (Window) main window class providing access to application variables.
     """
-    image = app.opened_image.transpose(Image.ROTATE_90)
-    width, height = _calculate_scale(app, image)
-    set_image(app, image.resize((width, height)))
+    _apply_operation(app, 'rotate')
 
 
 def flip_lr(app) -> None:
@@ -219,9 +776,7 @@ def flip_lr(app) -> None:
     Flips the currently opened image around the vertical axis.
     :param app: (Window) main window class providing access to application variables.
     """
-    image = app.opened_image.transpose(Image.FLIP_LEFT_RIGHT)
-    width, height = _calculate_scale(app, image)
-    set_image(app, image.resize((width, height)))
+    _apply_operation(app, 'flip_lr')
 
 
 def flip_tb(app) -> None:
@@ -229,46 +784,162 @@ def flip_tb(app) -> None:
     Flips the currently opened image around the horizontal axis.
     :param app: (Window) main window class providing access to application variables.
     """
-    image = app.opened_image.transpose(Image.FLIP_TOP_BOTTOM)
-    width, height = _calculate_scale(app, image)
-    set_image(app, image.resize((width, height)))
+    _apply_operation(app, 'flip_tb')
 
 
-def see_exif_data(app) -> None:
+def open_viewport(app) -> None:
     """
-    Displays a pop-up with any EXIF data retrieved from the current image.
+    Shows the document (with everything added over it) at full resolution in a zoomable,
+    pannable window. The image pyramid the view is drawn from is built in the background,
+    an open zoom window being updated rather than another opened.
     :param app: (Window) main window class providing access to application variables.
     """
-    data = app.opened_image.getexif()
-    data_list = ""
+    document = app.document
 
-    if not data:
-        data_list = "No data."
-    else:
-        for key, item in data.items():
-            if key in ExifTags.TAGS:
-                data_list += f"{ExifTags.TAGS[key]}:\t{item}\n"
-            else:
-                data_list += f"Ukn. -> {key}: {item}\n"
+    def build(progress) -> Pyramid:
+        image = compositor.composite(document)
+        return Pyramid(image, progress)
 
-    messagebox.showinfo(title='EXIF Data', message=data_list)
+    def show(pyramid: Pyramid) -> None:
+        if app.document is not document:
+            return
 
+        if app.viewport is None:
+            app.viewport = Viewport(app, pyramid)
+        else:
+            app.viewport.show(pyramid)
 
-def remove_exif_data(app) -> None:
+    app.jobs.submit('Zoom view', build, show, kind='zoom')
+
+
+def see_exif_data(app) -> None:
     """
-    Applies a duplicate image, the same as the current one, to the canvas with no EXIF data.
+    Displays a window listing the EXIF data of the current image (including that of its Exif
+    and GPS sub-directories).
     :param app: (Window) main window class providing access to application variables.
     """
-    image = app.opened_image
+    library.show_tags(app.root, 'EXIF Data', exif_index.describe(app.document.exif))
 
-    img_pixel_data = list(image.getdata())
-    new_image = Image.new(image.mode, image.size)
-    new_image.putdata(img_pixel_data)
-    set_image(app, new_image)
+
+def remove_exif_data(app) -> None:
+    """
+    Removes the EXIF data from the current image. Unless anything else is changed the image is
+    saved without being re-encoded, only the data being left out of the file.
+    :param app: (Window) main window class providing access to application variables.
+    """
+    _apply_operation(app, 'strip_exif')
 
     messagebox.showinfo(title='EXIF Data', message='Data removed.')
 
 
+def remove_folder_exif_data(app) -> None:
+    """
+    Removes the EXIF data from every JPEG, PNG and WebP image in a folder (and its sub-folders)
+    in the background, overwriting each file without re-encoding it (if confirmation is given).
+    :param app: (Window) main window class providing access to application variables.
+    """
+    folder = filedialog.askdirectory(title='Select folder')
+
+    if not folder:
+        return
+
+    files = [(path, base) for path, base in find_images([folder], recursive=True)
+             if metadata.format_of(path) is not None]
+
+    if not files:
+        messagebox.showinfo(title='EXIF Data', message='No JPEG, PNG or WebP images found.')
+        return
+
+    if not messagebox.askokcancel(
+            title='Confirm',
+            message=f'Are you sure you wish to remove the EXIF data from {len(files)} file(s)?'):
+        return
+
+    def strip(progress) -> list:
+        return metadata.strip_files(files, progress=progress)
+
+    def report(results: list) -> None:
+        failed = [f'{path}: {error}' for path, _, error in results if error]
+        message = f'Data removed from {len(results) - len(failed)} file(s).'
+
+        if failed:
+            message += '\n\nFailed:\n' + '\n'.join(failed)
+
+        messagebox.showinfo(title='EXIF Data', message=message)
+
+    app.jobs.submit('Removing EXIF', strip, report)
+
+
+def index_folder(app) -> None:
+    """
+    Adds the images in a folder (and its sub-folders) to the photo library index in the
+    background, only files new or changed since it was last indexed being read. The library
+    window is refreshed (or opened) once done.
+    :param app: (Window) main window class providing access to application variables.
+    """
+    folder = filedialog.askdirectory(title='Select folder to index')
+
+    if not folder:
+        return
+
+    def index(progress) -> tuple:
+        return exif_index.index([folder], progress=progress)
+
+    def report(result: tuple) -> None:
+        read, unchanged, removed, failed = result
+        app.menu_bar.entryconfig(app.STATE_MENU_ITEM_INDEX, label=f'State: Indexed {read} file(s) '
+                                 f'({unchanged} unchanged, {removed} removed, {len(failed)} failed)')
+        open_library(app)
+
+    app.jobs.submit('Indexing', index, report)
+
+
+def open_library(app) -> None:
+    """
+    Opens the window searching the photo library index (refreshing it if already open), photos
+    double-clicked being opened in the editor.
+    :param app: (Window) main window class providing access to application variables.
+    """
+    if app.library is not None:
+        app.library.refresh()
+        app.library.window.lift()
+        return
+
+    app.library = library.LibraryViewer(app, on_open=lambda path: open_file(app, path))
+
+
+def undo(app) -> None:
+    """
+    Reverts the last change made to the open document (operations, drawing and insertions).
+    :param app: (Window) main window class providing access to application variables.
+    """
+    if app.document.undo():
+        _show_document(app)
+
+
+def redo(app) -> None:
+    """
+    Re-applies the last change undone on the open document.
+    :param app: (Window) main window class providing access to application variables.
+    """
+    if app.document.redo():
+        _show_document(app)
+
+
+def edit_shortcut(event: Event, app, action) -> None:
+    """
+    Handles the keyboard shortcuts acting on the open document (undo/redo, closing and switching
+    tabs), leaving them to the footer text when typing in it.
+    :param event: (Tkinter.Event) accessor to triggered event variables.
+    :param app: (Window) main window class providing access to application variables.
+    :param action: (function) The event called, such as undo or redo.
+    """
+    if app.document is None or isinstance(event.widget, Text):
+        return
+
+    action(app)
+
+
 def no_image_error() -> None:
     """
     Error message provided when operations are called that require an image
@@ -302,28 +973,65 @@ def initiate_draw(app) -> None:
         app.root.config(cursor='pencil')
         app.drawing_state = True
         app.root.bind('<B1-Motion>', lambda event: draw(event, app))
+        app.root.bind('<ButtonRelease-1>', lambda event: end_stroke(app))
         app.menu_bar.entryconfig(app.STATE_MENU_ITEM_INDEX, label='State: Drawing')
     else:
         app.root.config(cursor='arrow')
         app.drawing_state = False
         app.root.unbind('<B1-Motion>')
+        app.root.unbind('<ButtonRelease-1>')
+        end_stroke(app)
         app.menu_bar.entryconfig(app.STATE_MENU_ITEM_INDEX, label='State: None')
 
 
 def draw(event: Event, app) -> None:
     """
-    Called repetitively via the '<B1-Motion>' binding to add a small circle (size set by
-    pen width in the drawing menu) to the canvas when mouse left-click is held and dragged
-    to simulate drawing.
+    Called repetitively via the '<B1-Motion>' binding while mouse left-click is held and
+    dragged, adding the cursor position to the pen stroke being drawn (colour and width set
+    in the drawing menu).
     :param event: (Tkinter.Event) accessor to triggered event variables.
     :param app: (Window) main window class providing access to application variables.
     """
-    x = event.x - app.pen_width.get()
-    y = event.y - app.pen_width.get()
-    x2 = event.x + app.pen_width.get()
-    y2 = event.y + app.pen_width.get()
+    app.stroke_engine.add_point(event.x, event.y)
+
+
+def end_stroke(app) -> None:
+    """
+    Finishes the current pen stroke (called when the mouse left button is released),
+    adding it to the image so that the next drag starts a new one.
+    :param app: (Window) main window class providing access to application variables.
+    """
+    app.stroke_engine.finish()
+
 
-    app.canvas.create_oval(x, y, x2, y2, fill=app.drawing_colour, outline='')
+def remove_drawing(app) -> None:
+    """
+    Removes everything drawn or inserted over the image (that hasn't been saved).
+    :param app: (Window) main window class providing access to application variables.
+    """
+    app.document.clear_annotations()
+    set_image(app, app.opened_image)
+
+
+def insert_shape(app, kind: str) -> None:
+    """
+    Adds a shape (line, rectangle or oval) between the two saved points to the image
+    using the current line colour and width.
+    :param app: (Window) main window class providing access to application variables.
+    :param kind: (str) The kind of shape, 'line', 'rectangle' or 'oval'.
+    """
+    x, y = app.saved_point["x"], app.saved_point["y"]
+    x2, y2 = app.saved_point["x2"], app.saved_point["y2"]
+
+    # Drawing on nothing is allowed but not recorded
+    if app.document is None:
+        Shape(kind, (x, y, x2, y2), app.line_colour, app.line_width.get()).draw(app.canvas, 1)
+        return
+
+    scale = app.document.scale
+    points = (x / scale, y / scale, x2 / scale, y2 / scale)
+
+    _add_annotation(app, Shape(kind, points, app.line_colour, app.line_width.get() / scale))
 
 
 def start_image_insert(app) -> None:
@@ -348,31 +1056,44 @@ def insert_image(event: Event, app) -> None:
     app.root.config(cursor='arrow')
     app.menu_bar.entryconfig(app.STATE_MENU_ITEM_INDEX, label='State: None')
 
+    # The document may have been closed since the insert was started
+    if app.document is None:
+        no_image_error()
+        return
+
     path = filedialog.askopenfilename(title='Select new image')
 
-    if path is None:
+    if not path:
         return
 
-    # Prompt user for desired image size (currently square only)
-    width = height = simpledialog.askinteger(
-        title='Enter image dimensions',
-        prompt='Enter the width/height for the square image.')
+    # The image is decoded once here, then drawn and rendered from the overlay cache
+    try:
+        source = overlays.cache.get(path)
+    except OSError:
+        messagebox.showerror(title='Error', message=f"{os.path.basename(path)} isn't an image that can be opened.")
+        return
+
+    # Prompt for the size on screen (any size), the height defaulting to keep the aspect ratio
+    scale = app.document.scale
+    width = simpledialog.askinteger(
+        title='Enter image dimensions', prompt='Enter the width of the image.',
+        initialvalue=max(1, round(source.width * scale)), minvalue=1)
 
     if width is None:
         return
 
-    # Limits size of inserted image (currently arbitrary values)
-    if width < 30 or width > 500:
-        messagebox.showerror(title='Error', message='Input must be between 30 and 500.')
-        return
+    height = simpledialog.askinteger(
+        title='Enter image dimensions', prompt='Enter the height of the image.',
+        initialvalue=max(1, round(width * source.height / source.width)), minvalue=1)
 
-    im = ImageTk.PhotoImage(Image.open(path).resize((width, height)))
+    if height is None:
+        return
 
-    window_canvas = Canvas(app.canvas, width=width, height=height, highlightthickness=0)
-    window_canvas.image = im
-    window_canvas.create_image(0, 0, image=im, anchor='nw')
+    # Position and size are kept at full resolution
+    centre = app.document.to_master(event.x, event.y)
+    size = (max(1, round(width / scale)), max(1, round(height / scale)))
 
-    app.canvas.create_window((event.x, event.y), window=window_canvas, width=width, height=height)
+    _add_annotation(app, InsertedImage(path, centre, size))
 
 
 def insert_footer(app) -> None:
@@ -381,13 +1102,7 @@ def insert_footer(app) -> None:
     description or notes to be added (fixed font of 'Arial 10').
     :param app: (Window) main window class providing access to application variables.
     """
-    x, y = 0, app.opened_image.height - 60
-
-    footer = Text(app.canvas, font='Arial 10', padx=10, pady=5, border=2, takefocus=0)
-    app.canvas.create_window((x, y), window=footer, width=app.canvas.winfo_width(), height=60, anchor='nw')
-
-    # Binding to allow the removal of focus on the footer.
-    footer.bind('<FocusIn>', lambda event: _prepare_footer_focus_removal(event, app))
+    footer = _add_annotation(app, Footer(app.document.scale))
     footer.focus_force()
 
 
@@ -0,0 +1,484 @@
+import argparse
+import json
+import os
+import re
+import shlex
+import sqlite3
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ExifTags
+
+from files import find_images
+
+# Database the editor indexes photo libraries into
+DEFAULT_DATABASE = os.path.join(os.path.expanduser('~'), '.image_editor', 'exif_index.sqlite')
+
+# Rows written per transaction while indexing (so an interrupted run keeps what it indexed)
+BATCH_SIZE = 500
+
+# Columns of the photos table, in order
+COLUMNS = ('path', 'mtime', 'size', 'width', 'height', 'make', 'model', 'lens', 'taken', 'exposure',
+           'f_number', 'iso', 'focal_length', 'latitude', 'longitude', 'tags', 'error')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS photos (
+    path TEXT PRIMARY KEY,
+    mtime INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    make TEXT,
+    model TEXT,
+    lens TEXT,
+    taken TEXT,
+    exposure REAL,
+    f_number REAL,
+    iso INTEGER,
+    focal_length REAL,
+    latitude REAL,
+    longitude REAL,
+    tags TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS photos_taken ON photos (taken);
+CREATE INDEX IF NOT EXISTS photos_camera ON photos (make, model);
+CREATE INDEX IF NOT EXISTS photos_iso ON photos (iso);
+CREATE INDEX IF NOT EXISTS photos_exposure ON photos (exposure);
+'''
+
+# Fields that can be searched as 'field:value', with the SQL expression each compares and
+# whether it is numeric, text matched anywhere (case-insensitively) or a date
+FIELDS = {
+    'camera': ("COALESCE(make, '') || ' ' || COALESCE(model, '')", 'text'),
+    'make': ('make', 'text'),
+    'model': ('model', 'text'),
+    'lens': ('lens', 'text'),
+    'path': ('path', 'text'),
+    'date': ('taken', 'date'),
+    'iso': ('iso', 'number'),
+    'exposure': ('exposure', 'number'),
+    'f': ('f_number', 'number'),
+    'focal': ('focal_length', 'number'),
+    'width': ('width', 'number'),
+    'height': ('height', 'number'),
+    'lat': ('latitude', 'number'),
+    'lon': ('longitude', 'number'),
+}
+
+# Columns results can be sorted by
+SORTABLE = ('path', 'taken', 'make', 'model', 'lens', 'exposure', 'f_number', 'iso', 'focal_length', 'width',
+            'latitude')
+
+# Tags whose values are left out of the index (the maker note is large and undocumented)
+SKIPPED_TAGS = (ExifTags.Base.MakerNote, ExifTags.Base.PrintImageMatching)
+
+# Binary values longer than this are summarised rather than stored
+MAX_BINARY = 64
+
+_DATE = re.compile(r'(\d{4})[:-](\d{2})[:-](\d{2})[ T](\d{2}):(\d{2}):(\d{2})')
+_COMPARISON = re.compile(r'(>=|<=|>|<|=)?(.*)')
+
+
+def connect(database: str = DEFAULT_DATABASE) -> sqlite3.Connection:
+    """
+    Opens (creating if needed) an index. Each thread must use a connection of its own; the
+    index can be searched while another connection is writing to it.
+    :param database: (str) Path of the SQLite database.
+    :return: (sqlite3.Connection) The connection, rows being returned as sqlite3.Row.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(database)), exist_ok=True)
+
+    connection = sqlite3.connect(database, timeout=30)
+    connection.row_factory = sqlite3.Row
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.executescript(SCHEMA)
+
+    return connection
+
+
+def read_exif(image: Image) -> Image.Exif:
+    """
+    Gets the EXIF data of an opened image from what PIL read of its header, no pixels being
+    decoded (PIL's PNG reader would decode the image to look for EXIF data after the pixels).
+    :param image: (PIL.Image) The image, opened but not loaded.
+    :return: (PIL.Image.Exif) Its EXIF data.
+    """
+    if image.format != 'PNG':
+        return image.getexif()
+
+    exif = Image.Exif()
+    if image.info.get('exif'):
+        exif.load(image.info['exif'])
+
+    return exif
+
+
+def describe(exif) -> list:
+    """
+    Names every tag of EXIF data, including those of the Exif and GPS sub-directories.
+    :param exif: (PIL.Image.Exif) The EXIF data.
+    :return: (list) [name, value] of each tag, the values as text.
+    """
+    tags = []
+    directories = [(exif, ExifTags.TAGS)]
+
+    if hasattr(exif, 'get_ifd'):
+        directories += [(exif.get_ifd(ExifTags.IFD.Exif), ExifTags.TAGS),
+                        (exif.get_ifd(ExifTags.IFD.GPSInfo), ExifTags.GPSTAGS)]
+
+    for directory, names in directories:
+        for key, value in directory.items():
+            if key in (ExifTags.IFD.Exif, ExifTags.IFD.GPSInfo) and names is ExifTags.TAGS:
+                continue
+
+            name = names.get(key, f'Unknown ({key})')
+            tags.append([name, _format_value(value) if key not in SKIPPED_TAGS else f'<{len(value)} bytes>'])
+
+    return tags
+
+
+def _format_value(value) -> str:
+    """
+    Converts an EXIF value to text.
+    :param value: The value (a number, text, bytes or a tuple of these).
+    :return: (str) The value as text, long binary values summarised.
+    """
+    if isinstance(value, bytes):
+        text = value.rstrip(b'\x00')
+
+        if len(text) > MAX_BINARY or not text.isascii():
+            return f'<{len(value)} bytes>'
+
+        return text.decode('ascii', 'replace')
+
+    if isinstance(value, tuple):
+        return ', '.join(_format_value(item) for item in value)
+
+    if isinstance(value, str):
+        return value.rstrip('\x00').strip()
+
+    return str(value)
+
+
+def _number(value) -> float:
+    try:
+        return float(value[0] if isinstance(value, tuple) else value)
+    except (TypeError, ValueError, ZeroDivisionError, IndexError):
+        return None
+
+
+def _text(value) -> str:
+    text = _format_value(value) if value is not None else ''
+
+    return text or None
+
+
+def _coordinate(value, reference) -> float:
+    """
+    Converts a GPS coordinate to decimal degrees.
+    :param value: (tuple) Degrees, minutes and seconds.
+    :param reference: (str) 'N', 'S', 'E' or 'W'.
+    :return: (float) The coordinate (negative to the south and west), None if invalid.
+    """
+    try:
+        degrees = float(value[0]) + float(value[1]) / 60 + float(value[2]) / 3600
+    except (TypeError, ValueError, ZeroDivisionError, IndexError):
+        return None
+
+    return -degrees if _text(reference) in ('S', 'W') else degrees
+
+
+def read_file(path: str) -> dict:
+    """
+    Reads the metadata of an image file for the index, from its header only. Any error (the
+    file having been deleted, or being a decompression bomb) is recorded against the file
+    rather than stopping the run.
+    :param path: (str) Path of the image.
+    :return: (dict) Values of the index's columns (see COLUMNS), 'error' set if it failed.
+    """
+    row = dict.fromkeys(COLUMNS)
+    row.update({'path': path, 'mtime': 0, 'size': 0})
+
+    try:
+        stat = os.stat(path)
+        row.update({'mtime': stat.st_mtime_ns, 'size': stat.st_size})
+
+        with Image.open(path) as image:
+            row['width'], row['height'] = image.size
+            exif = read_exif(image)
+            details = exif.get_ifd(ExifTags.IFD.Exif)
+            gps = exif.get_ifd(ExifTags.IFD.GPSInfo)
+            tags = describe(exif)
+    except Exception as error:
+        row['error'] = str(error) or type(error).__name__
+        return row
+
+    match = _DATE.match(_text(details.get(ExifTags.Base.DateTimeOriginal) or exif.get(ExifTags.Base.DateTime)) or '')
+
+    row.update({
+        'make': _text(exif.get(ExifTags.Base.Make)),
+        'model': _text(exif.get(ExifTags.Base.Model)),
+        'lens': _text(details.get(ExifTags.Base.LensModel)),
+        'taken': '{}-{}-{} {}:{}:{}'.format(*match.groups()) if match else None,
+        'exposure': _number(details.get(ExifTags.Base.ExposureTime)),
+        'f_number': _number(details.get(ExifTags.Base.FNumber)),
+        'iso': _number(details.get(ExifTags.Base.ISOSpeedRatings)),
+        'focal_length': _number(details.get(ExifTags.Base.FocalLength)),
+        'tags': json.dumps(tags),
+    })
+
+    if ExifTags.GPS.GPSLatitude in gps and ExifTags.GPS.GPSLongitude in gps:
+        row['latitude'] = _coordinate(gps[ExifTags.GPS.GPSLatitude], gps.get(ExifTags.GPS.GPSLatitudeRef))
+        row['longitude'] = _coordinate(gps[ExifTags.GPS.GPSLongitude], gps.get(ExifTags.GPS.GPSLongitudeRef))
+
+    if row['iso'] is not None:
+        row['iso'] = int(row['iso'])
+
+    return row
+
+
+def index(folders: list, database: str = DEFAULT_DATABASE, recursive: bool = True, workers: int = 8,
+          progress=None) -> (int, int, int, list):
+    """
+    Brings the index up to date with the images in folders: files not indexed before, or whose
+    modification time or size has changed, are read across a pool of threads (the work being
+    mostly file access) while rows of files no longer there are removed. Rows are written in
+    batches so an interrupted run only has to read the rest.
+    :param folders: (list) Directories (or glob patterns or files) to index.
+    :param database: (str) Path of the SQLite database.
+    :param recursive: (bool) Whether directories are searched recursively.
+    :param workers: (int) Number of threads.
+    :param progress: (function) Called with the fraction of files read (optional).
+    :return: Tuple(int, int, int, list) Files read, files unchanged, rows removed and
+    (path, error) of each file that couldn't be read.
+    """
+    found = {os.path.abspath(path): path for path, _ in find_images(folders, recursive)}
+    prefixes = tuple(os.path.join(os.path.abspath(folder), '') for folder in folders if os.path.isdir(folder))
+    connection = connect(database)
+
+    try:
+        indexed = {path: (mtime, size) for path, mtime, size in connection.execute(
+            'SELECT path, mtime, size FROM photos')}
+
+        # A file gone since it was found is read (and its error recorded) like a changed one
+        changed = []
+        for path in found:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                changed.append(path)
+                continue
+
+            if indexed.get(path) != (stat.st_mtime_ns, stat.st_size):
+                changed.append(path)
+
+        removed = [path for path in indexed if path.startswith(prefixes) and path not in found]
+        with connection:
+            connection.executemany('DELETE FROM photos WHERE path = ?', [(path,) for path in removed])
+
+        insert = f"INSERT OR REPLACE INTO photos ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})"
+        failed = []
+        rows = []
+        executor = ThreadPoolExecutor(max_workers=workers)
+
+        try:
+            for count, row in enumerate(executor.map(read_file, changed), 1):
+                rows.append(tuple(row[column] for column in COLUMNS))
+
+                if row['error']:
+                    failed.append((found[row['path']], row['error']))
+
+                if len(rows) >= BATCH_SIZE or count == len(changed):
+                    with connection:
+                        connection.executemany(insert, rows)
+                    rows = []
+
+                if progress is not None:
+                    progress(count / len(changed))
+        finally:
+            executor.shutdown(cancel_futures=True)
+    finally:
+        connection.close()
+
+    return len(changed), len(found) - len(changed), len(removed), failed
+
+
+def parse_query(query: str) -> (str, list):
+    """
+    Converts a search such as 'canon date:2021 iso:>800 exposure:<1/250 gps:yes' into an SQL
+    condition. Words on their own match the path, camera or lens; 'field:value' compares a field
+    (see FIELDS), numbers and dates taking a comparison (>, >=, <, <=) or a range ('1..4'), a
+    date matching any time beginning with it. 'gps:yes' or 'gps:no' finds photos with or
+    without a location.
+    :param query: (str) The search.
+    :return: Tuple(str, list) The condition and its parameters.
+    """
+    try:
+        terms = shlex.split(query)
+    except ValueError:
+        terms = query.split()
+
+    conditions = ['error IS NULL']
+    parameters = []
+
+    for term in terms:
+        field, separator, value = term.partition(':')
+
+        if not separator:
+            conditions.append("(path LIKE ? ESCAPE '\\' OR COALESCE(make, '') || ' ' || COALESCE(model, '') "
+                              "LIKE ? ESCAPE '\\' OR lens LIKE ? ESCAPE '\\')")
+            parameters += [f'%{_escape(term)}%'] * 3
+            continue
+
+        field = field.lower()
+
+        if field == 'gps':
+            if value.lower() not in ('yes', 'no'):
+                raise ValueError("gps must be 'yes' or 'no'")
+            conditions.append('latitude IS NOT NULL' if value.lower() == 'yes' else 'latitude IS NULL')
+            continue
+
+        if field not in FIELDS:
+            raise ValueError(f"Unknown field '{field}' (fields: gps, {', '.join(FIELDS)})")
+
+        expression, kind = FIELDS[field]
+
+        if kind == 'text':
+            conditions.append(f"{expression} LIKE ? ESCAPE '\\'")
+            parameters.append(f'%{_escape(value)}%')
+        elif '..' in value:
+            low, high = value.split('..', 1)
+            conditions.append(f'{expression} >= ? AND {expression} <= ?')
+            parameters += [_value(low, kind), _value(high, kind, True)]
+        else:
+            operator, value = _COMPARISON.match(value).groups()
+            operator = operator or '='
+
+            if kind == 'date' and operator == '=':
+                conditions.append(f"{expression} LIKE ? ESCAPE '\\'")
+                parameters.append(f'{_escape(value)}%')
+            else:
+                conditions.append(f'{expression} {operator} ?')
+                parameters.append(_value(value, kind, operator in ('<=', '>')))
+
+    return ' AND '.join(conditions), parameters
+
+
+def _escape(text: str) -> str:
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _value(text: str, kind: str, inclusive_end: bool = False):
+    """
+    Converts a value of a search to what its field is compared with.
+    :param text: (str) The value, numbers being allowed as fractions (such as 1/250).
+    :param kind: (str) 'number' or 'date'.
+    :param inclusive_end: (bool) Whether a date is compared as the end of the period it starts
+    (so '<=2021' includes all of 2021).
+    :return: The value (a float or text).
+    """
+    if kind == 'date':
+        # '~' sorts after every character of a date
+        return text + '~' if inclusive_end else text
+
+    numerator, _, denominator = text.partition('/')
+
+    try:
+        return float(numerator) / float(denominator or 1)
+    except (ValueError, ZeroDivisionError):
+        raise ValueError(f"'{text}' isn't a number")
+
+
+def search(connection: sqlite3.Connection, query: str = '', order: str = 'taken', descending: bool = False,
+           limit: int = 100, offset: int = 0) -> (list, int):
+    """
+    Finds a page of the indexed photos matching a search (see parse_query).
+    :param connection: (sqlite3.Connection) Connection to the index (see connect).
+    :param query: (str) The search, every photo if empty.
+    :param order: (str) Column the photos are sorted by (see SORTABLE).
+    :param descending: (bool) Whether they are sorted in descending order.
+    :param limit: (int) Number of photos in a page.
+    :param offset: (int) Number of photos before the page.
+    :return: Tuple(list, int) The photos of the page (sqlite3.Row) and the number matching.
+    """
+    if order not in SORTABLE:
+        raise ValueError(f"Photos can't be sorted by '{order}'")
+
+    condition, parameters = parse_query(query)
+    direction = 'DESC' if descending else 'ASC'
+
+    total = connection.execute(f'SELECT COUNT(*) FROM photos WHERE {condition}', parameters).fetchone()[0]
+    rows = connection.execute(f'SELECT * FROM photos WHERE {condition} '
+                              f'ORDER BY {order} IS NULL, {order} {direction}, path LIMIT ? OFFSET ?',
+                              parameters + [limit, offset]).fetchall()
+
+    return rows, total
+
+
+def format_exposure(seconds: float) -> str:
+    """
+    Formats an exposure time as photographers write it.
+    :param seconds: (float) The exposure time.
+    :return: (str) Such as '1/250' or '2.5s', empty if not known.
+    """
+    if seconds is None:
+        return ''
+    if 0 < seconds < 1:
+        return f'1/{round(1 / seconds)}'
+
+    return f'{seconds:g}s'
+
+
+# Indexes photo libraries and searches them without opening a window
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description='Index the EXIF data of photo libraries and search it.')
+    parser.add_argument('inputs', nargs='*', help='directories, glob patterns or files to index')
+    parser.add_argument('-d', '--database', default=DEFAULT_DATABASE, help='SQLite database of the index')
+    parser.add_argument('-w', '--workers', type=int, default=8, help='number of threads reading files')
+    parser.add_argument('--no-recursive', action='store_true', help="don't search directories recursively")
+    parser.add_argument('-s', '--search', help="search the index, e.g. 'canon date:2021 iso:>800 gps:yes'")
+    parser.add_argument('--order', default='taken', choices=SORTABLE, help='column results are sorted by')
+    parser.add_argument('--descending', action='store_true', help='sort results in descending order')
+    parser.add_argument('--limit', type=int, default=50, help='results shown per page')
+    parser.add_argument('--page', type=int, default=1, help='page of results shown')
+    args = parser.parse_args(argv)
+
+    if not args.inputs and args.search is None:
+        parser.error('give directories to index and/or a search')
+
+    if args.inputs:
+        start = time.perf_counter()
+        read, unchanged, removed, failed = index(args.inputs, args.database, not args.no_recursive, args.workers)
+
+        for path, error in failed:
+            print(f'{path:<50} failed: {error}')
+
+        print(f'{read} file(s) read, {unchanged} unchanged, {removed} removed, {len(failed)} failed '
+              f'in {time.perf_counter() - start:.2f}s')
+
+    if args.search is not None:
+        connection = connect(args.database)
+
+        try:
+            rows, total = search(connection, args.search, args.order, args.descending, args.limit,
+                                 (args.page - 1) * args.limit)
+        except ValueError as error:
+            parser.error(str(error))
+        finally:
+            connection.close()
+
+        for row in rows:
+            camera = ' '.join(filter(None, (row['make'], row['model'])))
+            print(f"{row['path']:<50} {row['taken'] or '':<19} {camera:<30} {format_exposure(row['exposure']):>8} "
+                  f"{'f/%g' % row['f_number'] if row['f_number'] else '':>6} {row['iso'] or '':>6}")
+
+        pages = max(1, -(-total // args.limit))
+        print(f'\nPage {args.page} of {pages} ({total} photo(s) found)')
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,44 @@
+import glob
+import os
+
+from PIL import Image
+
+
+def find_images(inputs: list, recursive: bool = False) -> list:
+    """
+    Collects the image files given as directories, glob patterns or file paths.
+    :param inputs: (list) Directories, glob patterns or file paths.
+    :param recursive: (bool) Whether directories are searched recursively.
+    :return: (list) (path, base directory) of each file found, the base allowing its relative
+    path to be kept in the output directory.
+    """
+    extensions = Image.registered_extensions()
+    found = []
+
+    for item in inputs:
+        if os.path.isdir(item):
+            pattern = os.path.join(item, '**', '*') if recursive else os.path.join(item, '*')
+            paths, base = glob.glob(pattern, recursive=recursive), item
+        else:
+            paths, base = glob.glob(item, recursive=recursive), None
+
+        for path in sorted(paths):
+            if os.path.isfile(path) and os.path.splitext(path)[1].lower() in extensions:
+                found.append((path, base if base is not None else os.path.dirname(path)))
+
+    return found
+
+
+def file_stamp(path: str) -> tuple:
+    """
+    Identifies the version of a file by its modification time and size, so a file replaced
+    since it was opened (such as by saving over it) is detected without reading it.
+    :param path: (str) Path of the file.
+    :return: (tuple) The modification time and size, None if the file can't be found.
+    """
+    try:
+        status = os.stat(path)
+    except OSError:
+        return None
+
+    return status.st_mtime_ns, status.st_size
@@ -0,0 +1,251 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from PIL import Image
+
+import compositor
+from encoder import atomic_write, save_arguments
+from pipeline import Pipeline
+
+# Formats whose frames (animation frames or pages) are all kept when opened and saved
+FORMATS = ('GIF', 'WEBP', 'TIFF')
+
+# Milliseconds each frame is shown for when the file opened doesn't say (such as a TIFF's pages)
+DEFAULT_DURATION = 100
+
+
+def is_multi_frame(image) -> bool:
+    """
+    Checks whether an opened image has more than one frame kept by the editor.
+    :param image: (PIL.Image) The image, opened but not necessarily loaded.
+    :return: (bool) Whether it is an animation or multi-page file of a supported format.
+    """
+    return image.format in FORMATS and getattr(image, 'is_animated', False)
+
+
+# The file a multi-frame document was opened from, held open so its frames can still be read
+# after the file has been replaced (such as by saving over it). Only one stream reads it at once
+# (holding it with "with"), and once the document is closed the file is closed when the last
+# stream reading it has finished.
+class FrameSource(object):
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.file = open(path, 'rb')
+        self.lock = threading.Lock()
+        self.closing = False
+
+    def __enter__(self):
+        self.lock.acquire()
+
+        return self
+
+    def __exit__(self, *exception) -> None:
+        self.lock.release()
+        self._close_if_unused()
+
+    # Opens the file as an image (to be used while holding the source)
+    def open(self):
+        self.file.seek(0)
+
+        return Image.open(self.file)
+
+    # Closes the file now, or if a stream is reading it once that has finished
+    def close(self) -> None:
+        self.closing = True
+        self._close_if_unused()
+
+    def _close_if_unused(self) -> None:
+        if self.closing and self.lock.acquire(blocking=False):
+            self.file.close()
+            self.lock.release()
+
+
+def render_frame(frame, operations_applied: tuple, annotations: list):
+    """
+    Applies a document's operations and annotations to one of its frames (run in a worker
+    process when frames are rendered in parallel).
+    :param frame: (PIL.Image) The frame.
+    :param operations_applied: (tuple) (name, args) of each operation in order.
+    :param annotations: (list) The annotations drawn over every frame.
+    :return: (PIL.Image) The rendered frame.
+    """
+    pipeline = Pipeline(frame.size)
+    for name, args in operations_applied:
+        pipeline.append(name, *args)
+
+    return compositor.draw_annotations(pipeline.render(frame), annotations)
+
+
+# The frames of a document rendered one at a time as they are asked for, presented as a
+# multi-frame image so PIL's own writers (which seek through the frames of what they save)
+# encode each frame as it is rendered. Frames are decoded in order, and with workers rendered
+# on a pool of processes a few frames ahead, so no more than that many frames are held at once
+# however long the animation (although the GIF writer keeps every frame it has quantized). The
+# duration and disposal of each frame are recorded as it is decoded, for the writers to read.
+class FrameStream(Image.Image):
+
+    def __init__(self, source: FrameSource, operations_applied: tuple, annotations: list, workers: int = 0,
+                 progress=None) -> None:
+        super().__init__()
+
+        self._source = source.open()
+        self._frames = self._source.n_frames
+        self._operations = operations_applied
+        self._annotations = annotations
+        self._progress = progress
+
+        self._pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+        self._window = workers * 2 if self._pool is not None else 1
+
+        # Every frame is rendered in the mode of the first (GIF frames after the first being
+        # decoded in RGB or RGBA)
+        first = self._source
+        self._frame_mode = 'RGBA' if 'A' in first.getbands() or 'transparency' in first.info else 'RGB'
+        self.source_info = dict(first.info)
+        self.source_format = first.format
+
+        # Milliseconds each frame is shown for and how each is disposed of (GIF only)
+        self.durations = []
+        self.disposals = []
+
+        # Frames decoded and being (or already) rendered, in order, with the next to decode
+        self._pending = deque()
+        self._next = 0
+        self._frame = None
+
+        self.seek(0)
+
+    @property
+    def n_frames(self) -> int:
+        return self._frames
+
+    @property
+    def is_animated(self) -> bool:
+        return self._frames > 1
+
+    def tell(self) -> int:
+        return self._frame
+
+    # Makes the given frame the current image, rendering it (and those ahead of it) if needed
+    def seek(self, frame: int) -> None:
+        if not 0 <= frame < self._frames:
+            raise EOFError('No more frames')
+
+        if frame == self._frame:
+            return
+
+        # Frames are decoded in order, any other frame (such as the first again once saved)
+        # starting the stream again from it
+        if not self._pending or self._pending[0][0] != frame:
+            self._cancel()
+            self._next = frame
+
+        ahead = self._window if self._frame is None or frame == self._frame + 1 else 1
+        while self._next < self._frames and len(self._pending) < ahead:
+            self._pending.append((self._next, self._render(self._decode(self._next))))
+            self._next += 1
+
+        _, rendered = self._pending.popleft()
+        image = rendered.result() if isinstance(rendered, Future) else rendered
+
+        self.im = image.im
+        self._mode = image.mode
+        self._size = image.size
+        self.info = {'duration': self.durations[frame]}
+        self._frame = frame
+
+        if self._progress is not None:
+            self._progress((frame + 1) / self._frames)
+
+    # Decodes a frame of the source, recording its duration and disposal the first time (once
+    # decoded, as WebP frames only have a duration then)
+    def _decode(self, frame: int):
+        self._source.seek(frame)
+
+        if self._source.mode == self._frame_mode:
+            image = self._source.copy()
+        else:
+            image = self._source.convert(self._frame_mode)
+
+        if frame == len(self.durations):
+            self.durations.append(self._source.info.get('duration') or DEFAULT_DURATION)
+
+            disposal = getattr(self._source, 'disposal_method', None)
+            if disposal is not None:
+                self.disposals.append(disposal)
+
+        return image
+
+    def _render(self, frame):
+        if self._pool is None:
+            return render_frame(frame, self._operations, self._annotations)
+
+        return self._pool.submit(render_frame, frame, self._operations, self._annotations)
+
+    def _cancel(self) -> None:
+        for _, rendered in self._pending:
+            if isinstance(rendered, Future):
+                rendered.cancel()
+
+        self._pending.clear()
+
+    # Stops any frames being rendered and lets go of the source image (not closed, as that
+    # would close the file it was read from)
+    def finish(self) -> None:
+        self._cancel()
+
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+
+        self._source = None
+
+
+def save(source: FrameSource, operations_applied: tuple, annotations: list, path: str, image_format: str,
+         options: dict = None, workers: int = 0, progress=None) -> (float, int):
+    """
+    Saves every frame of a document with its operations and annotations applied, each frame
+    being decoded, rendered and encoded in turn (see FrameStream). Frame durations, GIF disposal
+    and the number of loops are kept. The file is written atomically (see encoder.atomic_write).
+    :param source: (FrameSource) The file the document was opened from.
+    :param operations_applied: (tuple) (name, args) of each operation in order.
+    :param annotations: (list) The annotations drawn over every frame.
+    :param path: (str) The file path to save to.
+    :param image_format: (str) The PIL format name (one of FORMATS).
+    :param options: (dict) Settings differing from the defaults (see encoder.OPTIONS).
+    :param workers: (int) Number of processes frames are rendered on (in the calling thread if
+    fewer than two).
+    :param progress: (function) Called with the fraction of frames saved (optional).
+    :return: Tuple(float, int) Seconds taken and the size of the file in bytes.
+    """
+    start = time.perf_counter()
+
+    with source:
+        stream = FrameStream(source, operations_applied, annotations, workers, progress)
+
+        try:
+            arguments = dict(save_arguments(image_format, options), save_all=True)
+
+            # The lists are filled in as the writer seeks through the frames
+            if image_format in ('GIF', 'WEBP'):
+                arguments['duration'] = stream.durations
+
+                if 'loop' in stream.source_info:
+                    arguments['loop'] = stream.source_info['loop']
+                elif image_format == 'WEBP':
+                    # A GIF without a loop count plays once (WebP animations loop forever by default)
+                    arguments['loop'] = 1
+
+            if image_format == 'GIF' and stream.source_format == 'GIF':
+                arguments['disposal'] = stream.disposals
+
+            # The TIFF writer reads back what it has written to link the pages
+            with atomic_write(path, 'w+b') as file:
+                stream.save(file, image_format, **arguments)
+        finally:
+            stream.finish()
+
+    return time.perf_counter() - start, os.path.getsize(path)
@@ -0,0 +1,412 @@
+import tempfile
+import threading
+import zlib
+from contextlib import ExitStack
+
+from PIL import Image
+
+
+# The pixels changed by a step, stored as the tiles that differ between the image before and
+# after it. The tile data is kept as a single block which can be compressed or moved to disk.
+class TileDelta(object):
+
+    def __init__(self, before, after, tile_size: int) -> None:
+        self.before_size, self.before_mode = before.size, before.mode
+        self.after_size, self.after_mode = after.size, after.mode
+
+        # Boxes and lengths of the stored tiles, the data held in self._data in the same order
+        self.before_tiles = []
+        self.after_tiles = []
+        chunks = []
+
+        if before.size == after.size and before.mode == after.mode:
+            # Only tiles that have changed are kept
+            for box in _tiles(before.size, tile_size):
+                before_bytes = before.crop(box).tobytes()
+                after_bytes = after.crop(box).tobytes()
+
+                if before_bytes != after_bytes:
+                    self.before_tiles.append((box, len(before_bytes)))
+                    self.after_tiles.append((box, len(after_bytes)))
+                    chunks += [before_bytes, after_bytes]
+        else:
+            # A change of size or mode means every tile of both images is needed
+            for image, tiles in ((before, self.before_tiles), (after, self.after_tiles)):
+                for box in _tiles(image.size, tile_size):
+                    data = image.crop(box).tobytes()
+                    tiles.append((box, len(data)))
+                    chunks.append(data)
+
+        self._data = b''.join(chunks)
+        self._interleaved = before.size == after.size and before.mode == after.mode
+
+        # Where the data currently is: 'memory', 'compressed' or 'disk' (with its offset)
+        self.state = 'memory'
+        self._offset = None
+        self._length = len(self._data)
+
+    # Number of bytes held in memory
+    @property
+    def nbytes(self) -> int:
+        return 0 if self.state == 'disk' else len(self._data)
+
+    def compress(self) -> None:
+        if self.state == 'memory':
+            self._data = zlib.compress(self._data, 1)
+            self.state = 'compressed'
+
+    # Bytes of data once compressed (as written to disk)
+    @property
+    def length(self) -> int:
+        self.compress()
+        return self._length if self.state == 'disk' else len(self._data)
+
+    # Offset and length of the data in the spill file (None unless spilled)
+    @property
+    def extent(self) -> (int, int):
+        return (self._offset, self._length) if self.state == 'disk' else None
+
+    # Moves the (compressed) data to the given offset of the spill file (its end if not given)
+    def spill(self, file, offset: int = None) -> None:
+        self.compress()
+        self._offset = file.write(self._data, offset)
+        self._length = len(self._data)
+
+        self._data = b''
+        self.state = 'disk'
+
+    # The tile data compressed (as kept in project files, see project.py)
+    def compressed(self, file=None) -> bytes:
+        if self.state == 'memory':
+            return zlib.compress(self._data, 1)
+
+        if self.state == 'disk':
+            return file.read(self._offset, self._length)
+
+        return self._data
+
+    # Sizes, modes and tile boxes of the delta, everything but its data
+    def describe(self) -> dict:
+        return {'before_size': self.before_size, 'before_mode': self.before_mode,
+                'after_size': self.after_size, 'after_mode': self.after_mode,
+                'before_tiles': self.before_tiles, 'after_tiles': self.after_tiles,
+                'interleaved': self._interleaved}
+
+    def _load(self, file) -> bytes:
+        if self.state == 'memory':
+            return self._data
+
+        if self.state == 'disk':
+            return zlib.decompress(file.read(self._offset, self._length))
+
+        return zlib.decompress(self._data)
+
+    # Splits the data back into the before and after tiles
+    def _split(self, file) -> (list, list):
+        data = self._load(file)
+        before, after = [], []
+        position = 0
+
+        if self._interleaved:
+            for (box, before_length), (_, after_length) in zip(self.before_tiles, self.after_tiles):
+                before.append((box, data[position:position + before_length]))
+                position += before_length
+                after.append((box, data[position:position + after_length]))
+                position += after_length
+        else:
+            for tiles, output in ((self.before_tiles, before), (self.after_tiles, after)):
+                for box, length in tiles:
+                    output.append((box, data[position:position + length]))
+                    position += length
+
+        return before, after
+
+    # Returns the image as it was before the step, given the image after it
+    def undo(self, image, file=None):
+        before, _ = self._split(file)
+        return _patch(image, before, self.before_size, self.before_mode, self._interleaved)
+
+    # Returns the image as it was after the step, given the image before it
+    def redo(self, image, file=None):
+        _, after = self._split(file)
+        return _patch(image, after, self.after_size, self.after_mode, self._interleaved)
+
+
+def restore_delta(description: dict, data: bytes) -> TileDelta:
+    """
+    Re-creates a delta from its description and compressed data (see TileDelta.describe).
+    :param description: (dict) Sizes, modes and tile boxes of the delta.
+    :param data: (bytes) The compressed tile data.
+    :return: (TileDelta) The delta, its data left compressed until used.
+    """
+    delta = TileDelta.__new__(TileDelta)
+    delta.before_size, delta.before_mode = tuple(description['before_size']), description['before_mode']
+    delta.after_size, delta.after_mode = tuple(description['after_size']), description['after_mode']
+    delta.before_tiles = [(tuple(box), length) for box, length in description['before_tiles']]
+    delta.after_tiles = [(tuple(box), length) for box, length in description['after_tiles']]
+    delta._interleaved = description['interleaved']
+
+    delta._data = data
+    delta.state = 'compressed'
+    delta._offset = None
+    delta._length = len(data)
+
+    return delta
+
+
+def _tiles(size: (int, int), tile_size: int) -> list:
+    """
+    Splits an image of the given size into tiles.
+    :param size: Tuple(int, int) width and height of the image.
+    :param tile_size: (int) width and height of each tile (smaller at the right and bottom edges).
+    :return: (list) x, y top-left and x, y bottom-right of each tile.
+    """
+    width, height = size
+
+    return [(x, y, min(x + tile_size, width), min(y + tile_size, height))
+            for y in range(0, height, tile_size)
+            for x in range(0, width, tile_size)]
+
+
+def _patch(image, tiles: list, size: (int, int), mode: str, in_place: bool):
+    """
+    Pastes stored tiles into a copy of the image (or a new image when every tile is stored).
+    :param image: (PIL.Image) The image the tiles are pasted into.
+    :param tiles: (list) Box and raw pixel data of each tile.
+    :param size: Tuple(int, int) width and height of the resulting image.
+    :param mode: (str) mode of the resulting image.
+    :param in_place: (bool) True if only changed tiles are stored (the image is the same size).
+    :return: (PIL.Image) The patched image.
+    """
+    image = image.copy() if in_place else Image.new(mode, size)
+
+    for (x, y, x2, y2), data in tiles:
+        image.paste(Image.frombytes(mode, (x2 - x, y2 - y), data), (x, y))
+
+    return image
+
+
+# Temporary file the deltas over the history's memory budget are moved to. Deltas are read
+# from it by other threads (such as when a project is saved in the background) while more are
+# written, so each read or write seeks and transfers under a lock.
+class SpillFile(object):
+
+    def __init__(self) -> None:
+        self._file = tempfile.TemporaryFile(prefix='image_editor_history_')
+        self._lock = threading.Lock()
+
+    def read(self, offset: int, length: int) -> bytes:
+        with self._lock:
+            self._file.seek(offset)
+            return self._file.read(length)
+
+    # Writes the data at the given offset (the end of the file if not given), returning it
+    def write(self, data: bytes, offset: int = None) -> int:
+        with self._lock:
+            if offset is None:
+                offset = self._file.seek(0, 2)
+            else:
+                self._file.seek(offset)
+            self._file.write(data)
+
+        return offset
+
+    @property
+    def size(self) -> int:
+        with self._lock:
+            return self._file.seek(0, 2)
+
+    def truncate(self, size: int) -> None:
+        with self._lock:
+            self._file.truncate(size)
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+# A single undoable change to a document
+class Step(object):
+
+    def __init__(self, kind: str, value, annotations: list = None, delta: TileDelta = None) -> None:
+        # 'operation' (value is the pipeline operation), 'annotation' (value is the annotation
+        # added) or 'clear' (value is the list of annotations removed)
+        self.kind = kind
+        self.value = value
+
+        # Annotations as they were before the step (geometry changes move them), restored when
+        # it is undone
+        self.annotations = annotations or []
+
+        # Pixels of the preview changed by the step
+        self.delta = delta
+
+
+# Undo/redo stacks of document steps. Pixel changes are kept as tile deltas, the oldest of
+# which are compressed and, once the memory budget is exceeded, moved to a temporary file.
+# The space of spilled deltas that are dropped (redo steps cleared by a new one, the oldest
+# steps past max_steps) is reused by later spills, the file being shortened when its end is
+# free.
+class History(object):
+
+    def __init__(self, memory_budget: int = 256 * 1024 * 1024, tile_size: int = 256,
+                 uncompressed_steps: int = 4, max_steps: int = 1000) -> None:
+        self.memory_budget = memory_budget
+        self.tile_size = tile_size
+        self.uncompressed_steps = uncompressed_steps
+        self.max_steps = max_steps
+
+        self.undo_stack = []
+        self.redo_stack = []
+
+        # Created on the first spill, deleted automatically when closed
+        self._spill_file = None
+
+        # Offset and length of the unused parts of the spill file, in order of offset, and
+        # those freed while the file is being read elsewhere (see hold). The lock also keeps
+        # deltas from being compressed or spilled while read by another thread.
+        self._free = []
+        self._released = []
+        self._holds = 0
+        self._lock = threading.Lock()
+
+    # Bytes of tile data held in memory by both stacks
+    @property
+    def nbytes(self) -> int:
+        return sum(step.delta.nbytes for step in self.undo_stack + self.redo_stack if step.delta)
+
+    def delta(self, before, after) -> TileDelta:
+        return TileDelta(before, after, self.tile_size)
+
+    # Records a new step, clearing anything that could have been redone
+    def push(self, step: Step) -> None:
+        dropped = self.redo_stack[:]
+        self.undo_stack.append(step)
+        self.redo_stack.clear()
+
+        if len(self.undo_stack) > self.max_steps:
+            dropped.append(self.undo_stack.pop(0))
+
+        self._release(dropped)
+        self._enforce_budget()
+
+    def undo(self) -> Step:
+        if not self.undo_stack:
+            return None
+
+        step = self.undo_stack.pop()
+        self.redo_stack.append(step)
+
+        return step
+
+    def redo(self) -> Step:
+        if not self.redo_stack:
+            return None
+
+        step = self.redo_stack.pop()
+        self.undo_stack.append(step)
+
+        return step
+
+    # The file deltas are read from when they have been spilled to disk
+    @property
+    def spill_file(self) -> SpillFile:
+        return self._spill_file
+
+    # The compressed data of one of the steps' deltas, read from another thread (such as when
+    # saving a project) without the delta being moved meanwhile
+    def compressed(self, delta: TileDelta) -> bytes:
+        with self._lock:
+            return delta.compressed(self._spill_file)
+
+    # Keeps the space of dropped deltas from being reused while the steps are read in the
+    # background (such as when saving a project), so none are overwritten meanwhile. Held from
+    # when it is called (on the thread editing the document, as the steps are taken) until the
+    # context returned exits (on the thread reading them).
+    def hold(self) -> ExitStack:
+        with self._lock:
+            self._holds += 1
+
+        held = ExitStack()
+        held.callback(self._end_hold)
+
+        return held
+
+    def _end_hold(self) -> None:
+        with self._lock:
+            self._holds -= 1
+            if self._holds == 0:
+                released, self._released = self._released, []
+                self._free_extents(released)
+
+    # Marks the parts of the spill file held by the steps' deltas as free
+    def _release(self, steps: list) -> None:
+        extents = [step.delta.extent for step in steps if step.delta and step.delta.extent]
+
+        with self._lock:
+            if self._holds:
+                self._released += extents
+            else:
+                self._free_extents(extents)
+
+    # Merges freed extents with their neighbours, shortening the file when its end is free
+    # (emptying it once nothing is left on disk). Called holding the lock.
+    def _free_extents(self, extents: list) -> None:
+        if not extents or self._spill_file is None:
+            return
+
+        merged = []
+        for offset, length in sorted(self._free + extents):
+            if merged and merged[-1][0] + merged[-1][1] == offset:
+                merged[-1] = (merged[-1][0], merged[-1][1] + length)
+            else:
+                merged.append((offset, length))
+
+        if merged and merged[-1][0] + merged[-1][1] == self._spill_file.size:
+            self._spill_file.truncate(merged.pop()[0])
+
+        self._free = merged
+
+    # Writes a delta to the first free part of the spill file large enough, or its end. Called
+    # holding the lock.
+    def _spill(self, delta: TileDelta) -> None:
+        if self._spill_file is None:
+            self._spill_file = SpillFile()
+
+        length = delta.length
+        offset = None
+
+        for index, (free_offset, free_length) in enumerate(self._free):
+            if free_length >= length:
+                offset = free_offset
+                if free_length > length:
+                    self._free[index] = (free_offset + length, free_length - length)
+                else:
+                    del self._free[index]
+                break
+
+        delta.spill(self._spill_file, offset)
+
+    # Compresses all but the newest steps then spills the oldest to disk while over budget
+    def _enforce_budget(self) -> None:
+        steps = [step for step in self.undo_stack if step.delta]
+
+        with self._lock:
+            for step in steps[:-self.uncompressed_steps or None]:
+                step.delta.compress()
+
+            total = self.nbytes
+            for step in steps:
+                if total <= self.memory_budget:
+                    break
+
+                if step.delta.state != 'disk':
+                    total -= step.delta.nbytes
+                    self._spill(step.delta)
+
+    def close(self) -> None:
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+            self._free = []
+            self._released = []
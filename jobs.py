@@ -0,0 +1,161 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from tkinter import messagebox
+
+
+# Raised within a job's worker thread when the job has been cancelled
+class JobCancelled(Exception):
+    pass
+
+
+# A unit of work run in the background. The function is given the job's report method to call
+# with its progress (a fraction from 0 to 1); once cancelled the next report raises JobCancelled.
+# The kind groups jobs superseding one another (such as renders of the open document).
+class Job(object):
+
+    def __init__(self, label: str, function, on_done, kind: str = None) -> None:
+        self.label = label
+        self.function = function
+        self.on_done = on_done
+        self.kind = kind
+
+        self.progress = 0.0
+        self.future = None
+        self._cancel_event = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    # Called from the worker thread
+    def report(self, fraction: float) -> None:
+        if self._cancel_event.is_set():
+            raise JobCancelled()
+
+        self.progress = fraction
+
+    def cancel(self) -> None:
+        # Saves are never abandoned part way
+        if self.kind in JobExecutor.UNCANCELLABLE:
+            return
+
+        self._cancel_event.set()
+
+        if self.future is not None:
+            self.future.cancel()
+
+    def run(self):
+        return self.function(self.report)
+
+
+# Runs jobs on a pool of worker threads (PIL releases the GIL while processing pixels) so the Tk
+# event loop is never blocked. Results are handed back to the main thread by polling with
+# after(), with the progress of the latest job shown in the state item of the menu bar.
+# Submitting a job of a kind cancels any of the same kind still running, as its result would be
+# superseded; other jobs are left to finish. Saves run in order on a thread of their own and
+# can't be cancelled, so other work never holds them up or drops them.
+class JobExecutor(object):
+
+    # Milliseconds between checks for finished jobs
+    POLL_INTERVAL = 50
+
+    # Kinds of job run on the save thread, which are never cancelled
+    UNCANCELLABLE = ('save',)
+
+    def __init__(self, app, workers: int = 2) -> None:
+        self.app = app
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image_editor_job')
+        self.save_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='image_editor_save')
+
+        self.jobs = []
+        self.current = None
+
+        # Pending poll callback, the progress label displayed and the state label it replaced
+        self._poll_id = None
+        self._shown_label = None
+        self._previous_label = None
+
+    # Starts a job, on_done being called on the main thread with the function's result
+    def submit(self, label: str, function, on_done, kind: str = None) -> Job:
+        if kind is not None:
+            self.cancel(kind)
+
+        job = Job(label, function, on_done, kind)
+        pool = self.save_pool if kind in self.UNCANCELLABLE else self.pool
+        job.future = pool.submit(job.run)
+        self.jobs.append(job)
+        self.current = job
+
+        if self._poll_id is None:
+            self._poll_id = self.app.root.after(self.POLL_INTERVAL, self._poll)
+
+        return job
+
+    # Cancels the jobs of the given kinds still running (saves excepted)
+    def cancel(self, *kinds: str) -> None:
+        for job in self.jobs:
+            if job.kind in kinds and not job.future.done():
+                job.cancel()
+
+        if self.current is not None and self.current.cancelled:
+            self.current = None
+
+    def _poll(self) -> None:
+        self._poll_id = None
+
+        for job in [job for job in self.jobs if job.future.done()]:
+            self.jobs.remove(job)
+
+            if job is self.current:
+                self.current = None
+
+            if job.kind in self.UNCANCELLABLE and job.future.cancelled():
+                messagebox.showerror(title='Error', message=f"{job.label} didn't finish, nothing was written")
+                continue
+
+            if job.cancelled or job.future.cancelled():
+                continue
+
+            error = job.future.exception()
+            if error is not None:
+                if not isinstance(error, JobCancelled):
+                    messagebox.showerror(title='Error', message=f'{job.label} failed: {error}')
+                continue
+
+            job.on_done(job.future.result())
+
+        self._show_progress()
+
+        if self.jobs:
+            self._poll_id = self.app.root.after(self.POLL_INTERVAL, self._poll)
+
+    # Displays the progress of the latest job, restoring the state shown before once finished
+    # (or whatever state was set while it ran).
+    def _show_progress(self) -> None:
+        index = self.app.STATE_MENU_ITEM_INDEX
+        label = self.app.menu_bar.entrycget(index, 'label')
+
+        # Once the latest job is done the progress of any other still running is shown
+        if self.current is None or self.current.future.done():
+            running = [job for job in self.jobs if not job.future.done() and not job.cancelled]
+            self.current = running[-1] if running else None
+
+        if self.current is not None and not self.current.future.done():
+            if label != self._shown_label:
+                self._previous_label = label
+
+            self._shown_label = f'State: {self.current.label} {int(self.current.progress * 100)}%'
+            self.app.menu_bar.entryconfig(index, label=self._shown_label)
+
+        elif self._shown_label is not None:
+            if label == self._shown_label:
+                self.app.menu_bar.entryconfig(index, label=self._previous_label)
+            self._shown_label = None
+
+    # Cancels everything but saves, which are finished before returning
+    def shutdown(self) -> None:
+        for job in self.jobs:
+            job.cancel()
+
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.save_pool.shutdown(wait=True)
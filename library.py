@@ -0,0 +1,229 @@
+import json
+import os
+from tkinter import Toplevel, Frame, Label, Button, Entry, StringVar, PanedWindow
+from tkinter import ttk
+
+import exif_index
+
+
+# Table of EXIF tags by name, scrolled so images with hundreds of tags stay readable
+class TagList(object):
+
+    def __init__(self, parent) -> None:
+        self.frame = Frame(parent)
+
+        self.tree = ttk.Treeview(self.frame, columns=('value',), selectmode='browse')
+        self.tree.heading('#0', text='Tag', anchor='w')
+        self.tree.heading('value', text='Value', anchor='w')
+        self.tree.column('#0', width=180, stretch=False)
+        self.tree.column('value', width=320)
+
+        scrollbar = ttk.Scrollbar(self.frame, orient='vertical', command=self.tree.yview)
+        self.tree.configure(yscrollcommand=scrollbar.set)
+
+        scrollbar.pack(side='right', fill='y')
+        self.tree.pack(side='left', fill='both', expand=True)
+
+    # Replaces the tags listed with the given [name, value] pairs
+    def show(self, tags: list) -> None:
+        self.tree.delete(*self.tree.get_children())
+
+        for name, value in tags:
+            self.tree.insert('', 'end', text=name, values=(value,))
+
+
+def show_tags(root, title: str, tags: list) -> None:
+    """
+    Opens a window listing EXIF tags.
+    :param root: (Tk) The main window.
+    :param title: (str) Title of the window.
+    :param tags: (list) [name, value] of each tag (see exif_index.describe).
+    """
+    window = Toplevel(root)
+    window.title(title)
+    window.geometry('520x420')
+
+    tag_list = TagList(window)
+    tag_list.frame.pack(fill='both', expand=True)
+    tag_list.show(tags or [['No data.', '']])
+
+    Button(window, text='Close', command=window.destroy).pack(pady=5)
+
+
+# Window searching the photo library index (see exif_index.py) a page at a time, so only the
+# rows of one page are ever fetched or placed in the table however many photos match. Clicking
+# a heading sorts by that column (again to reverse it), selecting a photo lists all its tags and
+# double-clicking one opens it in the editor.
+class LibraryViewer(object):
+
+    # Photos listed per page
+    PAGE_SIZE = 100
+
+    # Columns of the table: the index column, heading and width of each
+    COLUMNS = (
+        ('path', 'File', 260),
+        ('taken', 'Taken', 130),
+        ('make', 'Camera', 150),
+        ('lens', 'Lens', 140),
+        ('exposure', 'Exposure', 70),
+        ('f_number', 'Aperture', 65),
+        ('iso', 'ISO', 55),
+        ('focal_length', 'Focal length', 80),
+        ('width', 'Size', 90),
+        ('latitude', 'Location', 140),
+    )
+
+    def __init__(self, app, database: str = exif_index.DEFAULT_DATABASE, on_open=None) -> None:
+        self.app = app
+        self.connection = exif_index.connect(database)
+        self.on_open = on_open
+
+        # Search and sorting shown, the page (from 0) and the number of photos found
+        self.query = ''
+        self.order = 'taken'
+        self.descending = False
+        self.page = 0
+        self.total = 0
+
+        # Photos listed by their item in the table
+        self.rows = {}
+
+        self.window = Toplevel(app.root)
+        self.window.title('Photo library')
+        self.window.geometry('1100x650')
+
+        search_bar = Frame(self.window)
+        search_bar.pack(side='top', fill='x', padx=5, pady=5)
+
+        self.search_text = StringVar()
+        entry = Entry(search_bar, textvariable=self.search_text)
+        entry.pack(side='left', fill='x', expand=True)
+        entry.bind('<Return>', lambda event: self.search())
+        entry.focus_set()
+        Button(search_bar, text='Search', command=self.search).pack(side='left', padx=5)
+
+        Label(self.window, anchor='w', fg='grey30',
+              text="Search words in the path, camera or lens, or fields such as camera:canon date:2021-06 "
+                   "iso:>800 exposure:<1/250 f:1.4..2.8 focal:50 gps:yes").pack(side='top', fill='x', padx=5)
+
+        navigation = Frame(self.window)
+        navigation.pack(side='bottom', fill='x', padx=5, pady=5)
+
+        self.previous_button = Button(navigation, text='< Previous', command=lambda: self.turn(-1))
+        self.previous_button.pack(side='left')
+        self.next_button = Button(navigation, text='Next >', command=lambda: self.turn(1))
+        self.next_button.pack(side='left', padx=5)
+        self.status = Label(navigation, anchor='w')
+        self.status.pack(side='left', fill='x', expand=True)
+
+        panes = PanedWindow(self.window, orient='horizontal', sashwidth=4)
+        panes.pack(fill='both', expand=True, padx=5)
+
+        table = Frame(panes)
+        self.tree = ttk.Treeview(table, columns=[column for column, _, _ in self.COLUMNS], show='headings',
+                                 selectmode='browse')
+
+        for column, heading, width in self.COLUMNS:
+            self.tree.heading(column, text=heading, anchor='w', command=lambda column=column: self.sort(column))
+            self.tree.column(column, width=width, stretch=column == 'path')
+
+        scrollbar = ttk.Scrollbar(table, orient='vertical', command=self.tree.yview)
+        self.tree.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side='right', fill='y')
+        self.tree.pack(side='left', fill='both', expand=True)
+
+        self.tree.bind('<<TreeviewSelect>>', lambda event: self.show_selected())
+        self.tree.bind('<Double-Button-1>', lambda event: self.open_selected())
+
+        self.tags = TagList(panes)
+        panes.add(table, stretch='always')
+        panes.add(self.tags.frame, width=320)
+
+        self.window.protocol('WM_DELETE_WINDOW', self.close)
+
+        self.refresh()
+
+    # Runs the search typed, from the first page
+    def search(self) -> None:
+        self.query = self.search_text.get()
+        self.page = 0
+        self.refresh()
+
+    # Sorts by a column, reversing the order if already sorted by it
+    def sort(self, column: str) -> None:
+        self.descending = not self.descending if column == self.order else False
+        self.order = column
+        self.page = 0
+        self.refresh()
+
+    # Moves forwards (or backwards) a number of pages
+    def turn(self, pages: int) -> None:
+        self.page = min(max(self.page + pages, 0), max(0, self.pages - 1))
+        self.refresh()
+
+    @property
+    def pages(self) -> int:
+        return max(1, -(-self.total // self.PAGE_SIZE))
+
+    # Fetches and lists the current page (such as after the index has been updated)
+    def refresh(self) -> None:
+        try:
+            rows, self.total = exif_index.search(self.connection, self.query, self.order, self.descending,
+                                                 self.PAGE_SIZE, self.page * self.PAGE_SIZE)
+        except ValueError as error:
+            self.status.config(text=str(error))
+            return
+
+        self.tree.delete(*self.tree.get_children())
+        self.tags.show([])
+        self.rows = {}
+
+        for row in rows:
+            self.rows[self.tree.insert('', 'end', values=_format_row(row))] = row
+
+        self.previous_button.config(state='normal' if self.page > 0 else 'disabled')
+        self.next_button.config(state='normal' if self.page < self.pages - 1 else 'disabled')
+        self.status.config(text=f'Page {self.page + 1} of {self.pages} ({self.total} photo(s) found)')
+
+    def show_selected(self) -> None:
+        selection = self.tree.selection()
+
+        if selection:
+            self.tags.show(json.loads(self.rows[selection[0]]['tags'] or '[]'))
+
+    def open_selected(self) -> None:
+        selection = self.tree.selection()
+
+        if selection and self.on_open is not None:
+            self.on_open(self.rows[selection[0]]['path'])
+
+    def close(self) -> None:
+        self.connection.close()
+        self.window.destroy()
+
+        if getattr(self.app, 'library', None) is self:
+            self.app.library = None
+
+
+def _format_row(row) -> tuple:
+    """
+    Formats a photo of the index for the library's table.
+    :param row: (sqlite3.Row) The photo.
+    :return: (tuple) The text of each column of LibraryViewer.COLUMNS.
+    """
+    location = ''
+    if row['latitude'] is not None and row['longitude'] is not None:
+        location = f"{row['latitude']:.5f}, {row['longitude']:.5f}"
+
+    return (
+        os.path.basename(row['path']) + f'  ({os.path.dirname(row["path"])})',
+        row['taken'] or '',
+        ' '.join(filter(None, (row['make'], row['model']))),
+        row['lens'] or '',
+        exif_index.format_exposure(row['exposure']),
+        f"f/{row['f_number']:g}" if row['f_number'] else '',
+        row['iso'] or '',
+        f"{row['focal_length']:g} mm" if row['focal_length'] else '',
+        f"{row['width']} x {row['height']}" if row['width'] else '',
+        location,
+    )
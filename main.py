@@ -1,10 +1,45 @@
+import argparse
+import os
+
+import server
+from profiler import Profiler
 from window import Window
 
 
 # Start application
 def main():
+    parser = argparse.ArgumentParser(description='Image editor.')
+    parser.add_argument('--profile', metavar='TRACE', default=os.environ.get('IMAGE_EDITOR_PROFILE'),
+                        help='time every command and event, writing a Chrome trace to the given file on exit '
+                             '(also enabled by the IMAGE_EDITOR_PROFILE environment variable)')
+    parser.add_argument('--serve', metavar='[HOST:]PORT',
+                        help='serve the editing operations over HTTP (on 127.0.0.1 unless a host is given) instead '
+                             'of opening a window')
+    parser.add_argument('--workers', type=int, help='number of processes images are rendered on when serving')
+    parser.add_argument('--queue-size', type=int,
+                        help='renders waiting for a worker when serving before others are turned away')
+    args = parser.parse_args()
+
+    if args.serve:
+        server.serve(args.serve, args.workers, args.queue_size)
+        return
+
+    # Instrumentation is installed before the window so its menus and bindings are wrapped
+    profiler = None
+    if args.profile:
+        profiler = Profiler(args.profile)
+        profiler.install()
+
     app = Window()
-    app.root.mainloop()
+
+    try:
+        if profiler is not None:
+            profiler.attach(app)
+
+        app.root.mainloop()
+    finally:
+        if profiler is not None:
+            profiler.finish()
 
 
 if __name__ == "__main__":
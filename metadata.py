@@ -0,0 +1,301 @@
+import argparse
+import os
+import shutil
+import struct
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from encoder import atomic_write
+from files import find_images
+
+# Bytes copied at a time when streaming image data from one file to another
+COPY_BUFFER = 1024 * 1024
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# Identifying prefixes of the JPEG application segments holding metadata
+JPEG_EXIF = b'Exif\x00'
+JPEG_XMP = (b'http://ns.adobe.com/xap/1.0/\x00', b'http://ns.adobe.com/xmp/extension/\x00')
+JPEG_ICC = b'ICC_PROFILE\x00'
+
+# PNG chunks holding text (the EXIF data of some tools included), the keyword of XMP packets
+PNG_TEXT_CHUNKS = (b'tEXt', b'zTXt', b'iTXt')
+PNG_XMP_KEYWORD = b'XML:com.adobe.xmp\x00'
+
+# VP8X header flags of the optional WebP chunks
+WEBP_FLAGS = {b'ICCP': 0x20, b'EXIF': 0x08, b'XMP ': 0x04}
+
+
+def _copy(source, target, length: int) -> None:
+    """
+    Copies a number of bytes from one file to another without holding them all in memory.
+    :param source: (file) File read from.
+    :param target: (file) File written to.
+    :param length: (int) Number of bytes to copy.
+    """
+    while length > 0:
+        data = source.read(min(length, COPY_BUFFER))
+        if not data:
+            raise ValueError('Unexpected end of file')
+
+        target.write(data)
+        length -= len(data)
+
+
+def _read(source, length: int) -> bytes:
+    """
+    Reads a number of bytes, a file ending before them being corrupt.
+    :param source: (file) File read from.
+    :param length: (int) Number of bytes to read.
+    :return: (bytes) The bytes read.
+    """
+    data = source.read(length)
+    if len(data) < length:
+        raise ValueError('Unexpected end of file')
+
+    return data
+
+
+def _strip_jpeg(source, target, xmp: bool, icc: bool) -> None:
+    """
+    Copies a JPEG leaving out its EXIF (and optionally XMP and ICC profile) segments. Only the
+    segments before the image data are examined, the compressed data being copied unchanged.
+    :param source: (file) The JPEG, positioned after its start of image marker.
+    :param target: (file) File written to (the start of image marker already written).
+    :param xmp: (bool) Whether XMP segments are removed.
+    :param icc: (bool) Whether ICC profile segments are removed.
+    """
+    while True:
+        marker = _read(source, 2)
+        if marker[0] != 0xFF:
+            raise ValueError('Corrupt JPEG marker')
+
+        # Markers may be preceded by any number of fill bytes
+        while marker[1] == 0xFF:
+            marker = b'\xff' + _read(source, 1)
+
+        kind = marker[1]
+
+        # Start of scan (or end of image), everything after is copied as is
+        if kind in (0xDA, 0xD9):
+            target.write(marker)
+            shutil.copyfileobj(source, target, COPY_BUFFER)
+            return
+
+        # Markers without a length
+        if kind == 0x01 or 0xD0 <= kind <= 0xD7:
+            target.write(marker)
+            continue
+
+        length = _read(source, 2)
+        if struct.unpack('>H', length)[0] < 2:
+            raise ValueError('Corrupt JPEG segment length')
+
+        data = _read(source, struct.unpack('>H', length)[0] - 2)
+
+        if kind == 0xE1 and (data.startswith(JPEG_EXIF) or (xmp and data.startswith(JPEG_XMP))):
+            continue
+        if kind == 0xE2 and icc and data.startswith(JPEG_ICC):
+            continue
+
+        target.write(marker + length + data)
+
+
+def _strip_png(source, target, xmp: bool, icc: bool) -> None:
+    """
+    Copies a PNG leaving out its eXIf and text chunks (the XMP packet and ICC profile only if
+    asked), copying every other chunk unchanged.
+    :param source: (file) The PNG, positioned after its signature.
+    :param target: (file) File written to (the signature already written).
+    :param xmp: (bool) Whether the XMP packet (an iTXt chunk) is removed.
+    :param icc: (bool) Whether the iCCP chunk is removed.
+    """
+    while True:
+        header = source.read(8)
+        if len(header) < 8:
+            raise ValueError('Truncated PNG')
+
+        length, kind = struct.unpack('>I4s', header)
+        remove = kind == b'eXIf' or (icc and kind == b'iCCP')
+
+        if kind in PNG_TEXT_CHUNKS:
+            keyword = source.read(min(length, len(PNG_XMP_KEYWORD)))
+            source.seek(-len(keyword), os.SEEK_CUR)
+            remove = xmp or keyword != PNG_XMP_KEYWORD
+
+        # The chunk's data is followed by its CRC
+        if remove:
+            source.seek(length + 4, os.SEEK_CUR)
+            continue
+
+        target.write(header)
+        _copy(source, target, length + 4)
+
+        if kind == b'IEND':
+            return
+
+
+def _strip_webp(source, target, xmp: bool, icc: bool) -> None:
+    """
+    Copies a WebP leaving out its EXIF (and optionally XMP and ICC profile) chunks, updating the
+    container size and the VP8X flags to match.
+    :param source: (file) The WebP, positioned after its 12 byte RIFF header.
+    :param target: (file) File written to (nothing written yet).
+    :param xmp: (bool) Whether the XMP chunk is removed.
+    :param icc: (bool) Whether the ICCP chunk is removed.
+    """
+    removed = {b'EXIF'} | ({b'XMP '} if xmp else set()) | ({b'ICCP'} if icc else set())
+
+    # The chunk headers are read first as the container size is written before them
+    chunks = []
+    while True:
+        header = source.read(8)
+        if len(header) < 8:
+            break
+
+        kind, length = struct.unpack('<4sI', header)
+        padded = length + (length & 1)
+        chunks.append((kind, source.tell(), length, padded))
+        source.seek(padded, os.SEEK_CUR)
+
+    kept = [chunk for chunk in chunks if chunk[0] not in removed]
+    target.write(b'RIFF' + struct.pack('<I', 4 + sum(8 + padded for *_, padded in kept)) + b'WEBP')
+
+    for kind, offset, length, padded in kept:
+        source.seek(offset)
+        target.write(struct.pack('<4sI', kind, length))
+
+        if kind == b'VP8X':
+            data = bytearray(_read(source, padded))
+            for flagged, flag in WEBP_FLAGS.items():
+                if flagged in removed:
+                    data[0] &= ~flag & 0xFF
+            target.write(data)
+        else:
+            _copy(source, target, padded)
+
+
+def format_of(path: str) -> str:
+    """
+    Identifies the container of an image file from its first bytes.
+    :param path: (str) Path of the image.
+    :return: (str) 'JPEG', 'PNG' or 'WEBP', None if the format is not supported.
+    """
+    with open(path, 'rb') as file:
+        header = file.read(12)
+
+    if header.startswith(b'\xff\xd8'):
+        return 'JPEG'
+    if header.startswith(PNG_SIGNATURE):
+        return 'PNG'
+    if header.startswith(b'RIFF') and header[8:12] == b'WEBP':
+        return 'WEBP'
+
+    return None
+
+
+def strip(path: str, output_path: str = None, xmp: bool = False, icc: bool = False) -> int:
+    """
+    Removes the EXIF data from a JPEG, PNG or WebP by rewriting its container, streaming from
+    one file to the other without decoding (or re-encoding) any pixels. The result is written
+    atomically (see encoder.atomic_write), so a file can be stripped in place safely.
+    :param path: (str) Path of the image.
+    :param output_path: (str) Path the result is written to (the image itself if not given).
+    :param xmp: (bool) Whether XMP metadata is also removed.
+    :param icc: (bool) Whether the ICC colour profile is also removed.
+    :return: (int) Number of bytes removed.
+    """
+    output_path = output_path or path
+    kind = format_of(path)
+
+    if kind is None:
+        raise ValueError(f'Unsupported format: {os.path.basename(path)}')
+
+    size = os.path.getsize(path)
+
+    # The source is closed before it is replaced (required on Windows when stripping in place)
+    with atomic_write(output_path) as target, open(path, 'rb') as source:
+        if kind == 'JPEG':
+            target.write(source.read(2))
+            _strip_jpeg(source, target, xmp, icc)
+        elif kind == 'PNG':
+            target.write(source.read(len(PNG_SIGNATURE)))
+            _strip_png(source, target, xmp, icc)
+        else:
+            source.seek(12)
+            _strip_webp(source, target, xmp, icc)
+
+    removed = size - os.path.getsize(output_path)
+
+    return removed
+
+
+def strip_files(files: list, output: str = None, xmp: bool = False, icc: bool = False,
+                workers: int = 4, progress=None) -> list:
+    """
+    Strips many files across a pool of threads (the work is almost entirely file access).
+    :param files: (list) (path, base directory) of each file (see files.find_images).
+    :param output: (str) Directory the results are saved to keeping relative paths, the files
+    being stripped in place if not given.
+    :param xmp: (bool) Whether XMP metadata is also removed.
+    :param icc: (bool) Whether the ICC colour profile is also removed.
+    :param workers: (int) Number of threads.
+    :param progress: (function) Called with the fraction of files done after each file.
+    :return: (list) path, bytes removed and an error message (None if successful) of each file.
+    """
+    def strip_file(path: str, base: str) -> (str, int, str):
+        output_path = os.path.join(output, os.path.relpath(path, base)) if output else path
+
+        # Whatever goes wrong with one file is reported for it, the rest carrying on
+        try:
+            return path, strip(path, output_path, xmp, icc), None
+        except Exception as error:
+            return path, 0, str(error) or type(error).__name__
+
+    results = []
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(lambda file: strip_file(*file), files):
+            results.append(result)
+
+            if progress is not None:
+                progress(len(results) / len(files))
+
+    return results
+
+
+# Removes the metadata of many images without decoding them
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description='Remove EXIF data from JPEG, PNG and WebP images losslessly.')
+    parser.add_argument('inputs', nargs='+', help='directories, glob patterns or files to strip')
+    parser.add_argument('-o', '--output', help='directory the results are saved to (in place if not given)')
+    parser.add_argument('--xmp', action='store_true', help='also remove XMP metadata')
+    parser.add_argument('--icc', action='store_true', help='also remove ICC colour profiles')
+    parser.add_argument('-w', '--workers', type=int, default=4, help='number of threads')
+    parser.add_argument('--recursive', action='store_true', help='search directories recursively')
+    args = parser.parse_args(argv)
+
+    files = find_images(args.inputs, args.recursive)
+    if not files:
+        print('No images found.', file=sys.stderr)
+        return 1
+
+    start = time.perf_counter()
+    results = strip_files(files, args.output, args.xmp, args.icc, args.workers)
+    failed = 0
+
+    for path, removed, error in sorted(results):
+        if error:
+            failed += 1
+            print(f'{path:<50} failed: {error}')
+        else:
+            print(f'{path:<50} {removed:>10} bytes removed')
+
+    print(f'\n{len(results) - failed} file(s) stripped, {failed} failed in {time.perf_counter() - start:.2f}s')
+
+    return 0 if failed == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,268 @@
+import inspect
+
+from PIL import Image, ImageOps, ImageFilter
+
+import adjustments
+
+
+def grayscale(image: Image) -> Image:
+    """
+    Applies the grayscale PIL filter to the given image.
+    :param image: (PIL.Image) The image to be filtered.
+    :return: (PIL.Image) The filtered image.
+    """
+    return ImageOps.grayscale(image)
+
+
+def blur(image: Image) -> Image:
+    """
+    Applies the blur PIL filter to the given image.
+    :param image: (PIL.Image) The image to be filtered.
+    :return: (PIL.Image) The filtered image.
+    """
+    return image.filter(ImageFilter.BLUR)
+
+
+def emboss(image: Image) -> Image:
+    """
+    Applies the emboss PIL filter to the given image.
+    :param image: (PIL.Image) The image to be filtered.
+    :return: (PIL.Image) The filtered image.
+    """
+    return image.filter(ImageFilter.EMBOSS)
+
+
+def sharpen(image: Image) -> Image:
+    """
+    Applies the sharpen PIL filter to the given image.
+    :param image: (PIL.Image) The image to be filtered.
+    :return: (PIL.Image) The filtered image.
+    """
+    return image.filter(ImageFilter.SHARPEN)
+
+
+def brightness(image: Image, percent: int) -> Image:
+    """
+    Brightens or darkens the given image.
+    :param image: (PIL.Image) The image to be adjusted.
+    :param percent: (int) Brightness as a percentage of the original.
+    :return: (PIL.Image) The adjusted image.
+    """
+    return adjustments.apply_lut(image, adjustments.brightness_lut(percent))
+
+
+def contrast(image: Image, percent: int) -> Image:
+    """
+    Increases or reduces the contrast of the given image.
+    :param image: (PIL.Image) The image to be adjusted.
+    :param percent: (int) Contrast as a percentage of the original.
+    :return: (PIL.Image) The adjusted image.
+    """
+    return adjustments.apply_lut(image, adjustments.contrast_lut(percent))
+
+
+def gamma(image: Image, percent: int) -> Image:
+    """
+    Applies gamma correction to the given image.
+    :param image: (PIL.Image) The image to be adjusted.
+    :param percent: (int) Gamma as a percentage (100% leaving the image unchanged).
+    :return: (PIL.Image) The adjusted image.
+    """
+    return adjustments.apply_lut(image, adjustments.gamma_lut(percent))
+
+
+def levels(image: Image, black: int, white: int) -> Image:
+    """
+    Stretches the values of the given image between a black and white point.
+    :param image: (PIL.Image) The image to be adjusted.
+    :param black: (int) Value mapped to black.
+    :param white: (int) Value mapped to white.
+    :return: (PIL.Image) The adjusted image.
+    """
+    return adjustments.apply_lut(image, adjustments.levels_lut(black, white))
+
+
+def curves(image: Image, *points: int) -> Image:
+    """
+    Maps the values of the given image along a curve.
+    :param image: (PIL.Image) The image to be adjusted.
+    :param points: (int) input, output of each point of the curve.
+    :return: (PIL.Image) The adjusted image.
+    """
+    return adjustments.apply_lut(image, adjustments.curves_lut(*points))
+
+
+def gaussian_blur(image: Image, radius: int) -> Image:
+    """
+    Applies a Gaussian blur of the given radius to the given image.
+    :param image: (PIL.Image) The image to be filtered.
+    :param radius: (int) Radius of the blur in pixels.
+    :return: (PIL.Image) The filtered image.
+    """
+    return adjustments.gaussian_blur(image, radius)
+
+
+def convolve(image: Image, size: int, *weights: int) -> Image:
+    """
+    Applies a user defined kernel to the given image.
+    :param image: (PIL.Image) The image to be filtered.
+    :param size: (int) Width and height of the kernel.
+    :param weights: (int) Weights of the kernel, row by row.
+    :return: (PIL.Image) The filtered image.
+    """
+    return adjustments.convolve(image, size, *weights)
+
+
+def rotate(image: Image) -> Image:
+    """
+    Rotates the given image 90 degrees.
+    :param image: (PIL.Image) The image to be rotated.
+    :return: (PIL.Image) The rotated image.
+    """
+    return image.transpose(Image.ROTATE_90)
+
+
+def flip_lr(image: Image) -> Image:
+    """
+    Flips the given image around the vertical axis.
+    :param image: (PIL.Image) The image to be flipped.
+    :return: (PIL.Image) The flipped image.
+    """
+    return image.transpose(Image.FLIP_LEFT_RIGHT)
+
+
+def flip_tb(image: Image) -> Image:
+    """
+    Flips the given image around the horizontal axis.
+    :param image: (PIL.Image) The image to be flipped.
+    :return: (PIL.Image) The flipped image.
+    """
+    return image.transpose(Image.FLIP_TOP_BOTTOM)
+
+
+def crop(image: Image, x: int, y: int, x2: int, y2: int) -> Image:
+    """
+    Crops the given image to the box described by its top left and bottom right corners.
+    :param image: (PIL.Image) The image to be cropped.
+    :param x: (int) x coordinate of the top left corner of the box.
+    :param y: (int) y coordinate of the top left corner of the box.
+    :param x2: (int) x coordinate of the bottom right corner of the box.
+    :param y2: (int) y coordinate of the bottom right corner of the box.
+    :return: (PIL.Image) The cropped image.
+    """
+    return image.crop((x, y, x2, y2))
+
+
+def clamp_box(size: (int, int), x: int, y: int, x2: int, y2: int) -> (int, int, int, int):
+    """
+    Keeps a crop box within an image, so the size of the crop is that of the part of the image
+    it covers.
+    :param size: Tuple(int, int) width and height of the image.
+    :param x: (int) x coordinate of the top left corner of the box.
+    :param y: (int) y coordinate of the top left corner of the box.
+    :param x2: (int) x coordinate of the bottom right corner of the box.
+    :param y2: (int) y coordinate of the bottom right corner of the box.
+    :return: Tuple(int, int, int, int) the box within the image.
+    """
+    box = (max(x, 0), max(y, 0), min(x2, size[0]), min(y2, size[1]))
+
+    if box[2] <= box[0] or box[3] <= box[1]:
+        raise ValueError(f'The crop box {x}:{y}:{x2}:{y2} is outside the {size[0]}x{size[1]} image')
+
+    return box
+
+
+def resize(image: Image, width: int, height: int) -> Image:
+    """
+    Resizes the given image to the given dimensions.
+    :param image: (PIL.Image) The image to be resized.
+    :param width: (int) The new width of the image.
+    :param height: (int) The new height of the image.
+    :return: (PIL.Image) The resized image.
+    """
+    return image.resize((width, height))
+
+
+def strip_exif(image: Image) -> Image:
+    """
+    Creates a duplicate of the given image containing no EXIF (or XMP) data. The pixels are
+    copied as a block, only the metadata carried alongside them being left out.
+    :param image: (PIL.Image) The image to be stripped of EXIF data.
+    :return: (PIL.Image) The duplicate image.
+    """
+    new_image = image.copy()
+
+    for key in ('exif', 'xmp', 'XML:com.adobe.xmp'):
+        new_image.info.pop(key, None)
+
+    return new_image
+
+
+# Operations that can be recorded against a document, by name
+OPERATIONS = {
+    'grayscale': grayscale,
+    'blur': blur,
+    'emboss': emboss,
+    'sharpen': sharpen,
+    'rotate': rotate,
+    'flip_lr': flip_lr,
+    'flip_tb': flip_tb,
+    'crop': crop,
+    'resize': resize,
+    'strip_exif': strip_exif,
+    'brightness': brightness,
+    'contrast': contrast,
+    'gamma': gamma,
+    'levels': levels,
+    'curves': curves,
+    'gaussian_blur': gaussian_blur,
+    'convolve': convolve,
+}
+
+# Operations that move pixels rather than changing their values
+GEOMETRY_OPERATIONS = ('rotate', 'flip_lr', 'flip_tb', 'crop', 'resize')
+
+# Operations mapping each value through a lookup table (see adjustments.LUTS)
+POINT_OPERATIONS = ('brightness', 'contrast', 'gamma', 'levels', 'curves')
+
+
+def check_arguments(name: str, *args) -> None:
+    """
+    Checks the named operation is given the arguments it takes, so a recipe can be rejected
+    before any image is processed.
+    :param name: (str) Name of the operation (a key of OPERATIONS).
+    :param args: The arguments the operation is to be applied with.
+    :raises ValueError: If the number of arguments is wrong (or a curve or kernel is invalid).
+    """
+    signature = inspect.signature(OPERATIONS[name])
+
+    try:
+        signature.bind(None, *args)
+    except TypeError:
+        expected = ':'.join(parameter if signature.parameters[parameter].kind != inspect.Parameter.VAR_POSITIONAL
+                            else f'{parameter}...' for parameter in list(signature.parameters)[1:])
+        raise ValueError(f'{name} takes {expected or "no arguments"}, not {len(args)} argument(s)') from None
+
+    if name == 'curves':
+        adjustments.curves_lut(*args)
+    elif name == 'convolve' and (args[0] % 2 == 0 or len(args) - 1 != args[0] * args[0]):
+        raise ValueError(f'A {args[0]}x{args[0]} kernel needs an odd size and {args[0] * args[0]} weights')
+
+
+def output_size(name: str, size: (int, int), *args) -> (int, int):
+    """
+    Calculates the size of an image after the named operation without touching any pixels.
+    :param name: (str) Name of the operation (a key of OPERATIONS).
+    :param size: Tuple(int, int) width and height of the image before the operation.
+    :param args: The arguments the operation is applied with.
+    :return: Tuple(int, int) width and height of the image after the operation.
+    """
+    if name == 'rotate':
+        return size[1], size[0]
+    if name == 'crop':
+        x, y, x2, y2 = args
+        return x2 - x, y2 - y
+    if name == 'resize':
+        return args[0], args[1]
+
+    return size
@@ -0,0 +1,180 @@
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from cache import image_nbytes
+from files import file_stamp
+
+# Corners (and the centre) a watermark can be placed at, as fractions of the free space
+POSITIONS = {
+    'top-left': (0, 0),
+    'top-right': (1, 0),
+    'bottom-left': (0, 1),
+    'bottom-right': (1, 1),
+    'centre': (0.5, 0.5),
+}
+
+
+# Images laid over others (inserted images and watermarks). Each source is decoded once and
+# every size (and opacity) it is used at is resampled once, both kept within a byte budget,
+# least recently used first out, so stamping the same logo many times costs a single decode.
+# A source is a file path (re-decoded if the file changes) or an image already in memory (such
+# as one kept in a project file). Shared between threads.
+class OverlayCache(object):
+
+    def __init__(self, memory_budget: int = 128 * 1024 * 1024) -> None:
+        self.memory_budget = memory_budget
+
+        # Decoded sources and resampled variants, each entry holding the source image so an
+        # image source isn't freed (and its id reused) while its entries are kept
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self._lock = threading.Lock()
+
+        # Sources decoded and variants resampled, and those found already done
+        self.decodes = 0
+        self.resamples = 0
+        self.hits = 0
+
+    # Returns the source at the given size with its alpha scaled by the opacity (a percentage),
+    # in RGBA if it has transparency and RGB otherwise
+    def get(self, source, size: (int, int) = None, opacity: int = 100):
+        source_key = ('file', source, file_stamp(source)) if isinstance(source, str) else ('image', id(source))
+        original = self._find((source_key, None, 100))
+
+        if original is None:
+            original = _decode(source)
+            self.decodes += 1
+            self._store((source_key, None, 100), source, original)
+
+        size = tuple(size) if size is not None else original.size
+        key = (source_key, size, opacity)
+
+        variant = self._find(key)
+        if variant is not None:
+            return variant
+
+        variant = original if size == original.size else original.resize(size, reducing_gap=3.0)
+
+        if opacity < 100:
+            variant = variant.convert('RGBA')
+            variant.putalpha(variant.getchannel('A').point(lambda value: value * opacity // 100))
+
+        self.resamples += 1
+        self._store(key, source, variant)
+
+        return variant
+
+    def _find(self, key: tuple):
+        with self._lock:
+            entry = self.entries.get(key)
+
+            if entry is None:
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+
+            return entry[1]
+
+    def _store(self, key: tuple, source, image) -> None:
+        size = image_nbytes(image)
+
+        with self._lock:
+            if key in self.entries:
+                self.nbytes -= image_nbytes(self.entries.pop(key)[1])
+
+            self.entries[key] = (source, image)
+            self.nbytes += size
+
+            # The entry just stored is kept even if larger than the budget (it is in use)
+            while self.nbytes > self.memory_budget and len(self.entries) > 1:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.nbytes -= image_nbytes(evicted)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+
+def _decode(source):
+    """
+    Decodes an overlay, in RGBA if it has transparency (so it is composited by its alpha) and
+    RGB otherwise.
+    :param source: (str) Path of the overlay, or (PIL.Image) the overlay itself.
+    :return: (PIL.Image) The decoded overlay.
+    """
+    image = Image.open(source) if isinstance(source, str) else source
+    mode = 'RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB'
+
+    if image.mode != mode:
+        image = image.convert(mode)
+
+    image.load()
+
+    return image
+
+
+# Overlays used by this process (the editor, or each batch worker)
+cache = OverlayCache()
+
+
+def stamp(image: Image, overlay: Image, position: (int, int)) -> None:
+    """
+    Composites an overlay onto an image in place by the overlay's alpha channel (an overlay
+    without one covering what is beneath). Only the part within the image is composited.
+    :param image: (PIL.Image) The image stamped onto.
+    :param overlay: (PIL.Image) The overlay (see OverlayCache.get).
+    :param position: Tuple(int, int) x, y of the overlay's top left corner on the image.
+    """
+    x, y = position
+    left, top = max(x, 0), max(y, 0)
+    right, bottom = min(x + overlay.width, image.width), min(y + overlay.height, image.height)
+
+    if right <= left or bottom <= top:
+        return
+
+    if (left, top, right, bottom) != (x, y, x + overlay.width, y + overlay.height):
+        overlay = overlay.crop((left - x, top - y, right - x, bottom - y))
+
+    if overlay.mode != 'RGBA':
+        image.paste(overlay, (left, top))
+    elif image.mode == 'RGBA':
+        image.alpha_composite(overlay, (left, top))
+    else:
+        image.paste(overlay, (left, top), overlay)
+
+
+def watermark(image: Image, path: str, width_percent: int = 20, position: str = 'bottom-right',
+              opacity: int = 100, margin_percent: int = 2) -> Image:
+    """
+    Stamps a watermark onto an image, sized relative to the image's width (keeping the
+    watermark's aspect ratio) and placed in a corner or the centre.
+    :param image: (PIL.Image) The image to be watermarked.
+    :param path: (str) Path of the watermark.
+    :param width_percent: (int) Width of the watermark as a percentage of the image's width.
+    :param position: (str) Where it is placed (see POSITIONS).
+    :param opacity: (int) Opacity of the watermark as a percentage.
+    :param margin_percent: (int) Space left at the edges as a percentage of the image's width.
+    :return: (PIL.Image) The watermarked image (a copy, converted to RGB(A) where needed).
+    """
+    source = cache.get(path)
+    width = max(1, image.width * width_percent // 100)
+    height = max(1, round(source.height * width / source.width))
+    overlay = cache.get(path, (width, height), opacity)
+
+    margin = image.width * margin_percent // 100
+    across, down = POSITIONS[position]
+    x = margin + round((image.width - width - margin * 2) * across)
+    y = margin + round((image.height - height - margin * 2) * down)
+
+    if image.mode in ('RGB', 'RGBA'):
+        image = image.copy()
+    else:
+        image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+
+    stamp(image, overlay, (x, y))
+
+    return image
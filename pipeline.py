@@ -0,0 +1,394 @@
+from PIL import Image
+import adjustments
+import cache
+import operations
+
+
+# The 8 orientations an image can be given by rotating and flipping it, each as the matrix
+# mapping a point (relative to the image centre) to its new position, with the PIL transpose
+# producing it (None meaning the image is left as it is).
+ORIENTATIONS = {
+    ((1, 0), (0, 1)): None,
+    ((-1, 0), (0, 1)): Image.FLIP_LEFT_RIGHT,
+    ((1, 0), (0, -1)): Image.FLIP_TOP_BOTTOM,
+    ((-1, 0), (0, -1)): Image.ROTATE_180,
+    ((0, 1), (-1, 0)): Image.ROTATE_90,
+    ((0, -1), (1, 0)): Image.ROTATE_270,
+    ((0, 1), (1, 0)): Image.TRANSPOSE,
+    ((0, -1), (-1, 0)): Image.TRANSVERSE,
+}
+
+# Matrices of the orientation operations that can be recorded against a document
+TRANSPOSE_OPERATIONS = {
+    'rotate': ((0, 1), (-1, 0)),
+    'flip_lr': ((-1, 0), (0, 1)),
+    'flip_tb': ((1, 0), (0, -1)),
+}
+
+IDENTITY = ((1, 0), (0, 1))
+
+
+def _multiply(a: tuple, b: tuple) -> tuple:
+    """
+    Combines two orientations, the result being the same as applying b then a.
+    :param a: (tuple) Matrix of the orientation applied second.
+    :param b: (tuple) Matrix of the orientation applied first.
+    :return: (tuple) Matrix of the combined orientation.
+    """
+    return tuple(tuple(sum(a[row][k] * b[k][column] for k in range(2)) for column in range(2))
+                 for row in range(2))
+
+
+def _inverse(matrix: tuple) -> tuple:
+    """
+    Gets the orientation undoing the given one (the transpose, as each is a rotation/reflection).
+    :param matrix: (tuple) Matrix of the orientation.
+    :return: (tuple) Matrix of the inverse orientation.
+    """
+    return (matrix[0][0], matrix[1][0]), (matrix[0][1], matrix[1][1])
+
+
+def _swaps_axes(matrix: tuple) -> bool:
+    """
+    Checks if the orientation swaps the width and height of an image (a 90 or 270 degree turn).
+    :param matrix: (tuple) Matrix of the orientation.
+    :return: (bool) True if width and height are swapped.
+    """
+    return matrix[0][0] == 0
+
+
+def _orient_size(matrix: tuple, size: (float, float)) -> (float, float):
+    """
+    Gets the size of an image once the orientation has been applied.
+    :param matrix: (tuple) Matrix of the orientation.
+    :param size: Tuple(float, float) width and height before the orientation.
+    :return: Tuple(float, float) width and height after the orientation.
+    """
+    return (size[1], size[0]) if _swaps_axes(matrix) else size
+
+
+def _orient_box(matrix: tuple, size: (float, float), box: tuple) -> tuple:
+    """
+    Maps a box within an image of the given size to the matching box once the orientation
+    has been applied to that image.
+    :param matrix: (tuple) Matrix of the orientation.
+    :param size: Tuple(float, float) width and height of the image before the orientation.
+    :param box: (tuple) x, y top-left and x, y bottom-right of the box before the orientation.
+    :return: (tuple) x, y top-left and x, y bottom-right of the box after the orientation.
+    """
+    width, height = size
+    new_width, new_height = _orient_size(matrix, size)
+    points = []
+
+    for x, y in ((box[0], box[1]), (box[2], box[3])):
+        # Points are moved relative to the centre of the image then back from the new centre
+        x, y = x - width / 2, y - height / 2
+        points.append((matrix[0][0] * x + matrix[0][1] * y + new_width / 2,
+                       matrix[1][0] * x + matrix[1][1] * y + new_height / 2))
+
+    (x, y), (x2, y2) = points
+
+    return min(x, x2), min(y, y2), max(x, x2), max(y, y2)
+
+
+# Any number of consecutive rotations, flips, crops and resizes folded into a single orientation
+# (lossless) followed by a single box resample (crop and resize together).
+class Geometry(object):
+
+    def __init__(self, size: (int, int)) -> None:
+        # Size of the image the geometry is applied to
+        self.input_size = size
+
+        # Orientation applied first, then the box (within the oriented image) and output size
+        self.orientation = IDENTITY
+        self.box = (0, 0, size[0], size[1])
+        self.size = size
+
+    # Folds another geometry operation into this one
+    def add(self, name: str, *args) -> None:
+        if name in TRANSPOSE_OPERATIONS:
+            matrix = TRANSPOSE_OPERATIONS[name]
+            oriented_size = _orient_size(self.orientation, self.input_size)
+
+            self.box = _orient_box(matrix, oriented_size, self.box)
+            self.orientation = _multiply(matrix, self.orientation)
+            self.size = _orient_size(matrix, self.size)
+
+        elif name == 'crop':
+            x, y, x2, y2 = args
+            scale_x = (self.box[2] - self.box[0]) / self.size[0]
+            scale_y = (self.box[3] - self.box[1]) / self.size[1]
+
+            self.box = (self.box[0] + x * scale_x, self.box[1] + y * scale_y,
+                        self.box[0] + x2 * scale_x, self.box[1] + y2 * scale_y)
+            self.size = (x2 - x, y2 - y)
+
+        elif name == 'resize':
+            self.size = (args[0], args[1])
+
+    # Applies the geometry to an image, which may be a scaled copy (proxy) of the input, giving
+    # an output at the same scale. Only one resample takes place, on the un-oriented image.
+    def render(self, image):
+        scale_x = image.width / self.input_size[0]
+        scale_y = image.height / self.input_size[1]
+
+        # The box is mapped back onto the image before it is oriented
+        inverse = _inverse(self.orientation)
+        box = _orient_box(inverse, _orient_size(self.orientation, self.input_size), self.box)
+        box = (box[0] * scale_x, box[1] * scale_y, box[2] * scale_x, box[3] * scale_y)
+        box = (max(box[0], 0), max(box[1], 0), min(box[2], image.width), min(box[3], image.height))
+
+        width, height = _orient_size(inverse, self.size)
+        size = (max(1, round(width * scale_x)), max(1, round(height * scale_y)))
+
+        integral = all(value == int(value) for value in box)
+        if integral and size == (image.width, image.height) and box == (0, 0, image.width, image.height):
+            pass
+        elif integral and size == (box[2] - box[0], box[3] - box[1]):
+            image = image.crop(tuple(int(value) for value in box))
+        else:
+            image = image.resize(size, box=box)
+
+        transpose = ORIENTATIONS[self.orientation]
+
+        return image if transpose is None else image.transpose(transpose)
+
+    # Identifies the geometry for the result cache
+    @property
+    def description(self) -> tuple:
+        return 'geometry', self.input_size, self.orientation, self.box, self.size
+
+    # PIL transpose applied after resampling (None if the orientation is unchanged)
+    @property
+    def transpose(self):
+        return ORIENTATIONS[self.orientation]
+
+    # Maps a box of the output to the box of the input it is resampled from, returning it with
+    # the size that part of the output has before it is oriented (used to process tiles)
+    def source_region(self, box: tuple) -> (tuple, (int, int)):
+        inverse = _inverse(self.orientation)
+        source = _orient_box(inverse, _orient_size(self.orientation, self.input_size), self.box)
+        width, height = _orient_size(inverse, self.size)
+        x, y, x2, y2 = _orient_box(inverse, self.size, box)
+
+        scale_x = (source[2] - source[0]) / width
+        scale_y = (source[3] - source[1]) / height
+        region = (source[0] + x * scale_x, source[1] + y * scale_y,
+                  source[0] + x2 * scale_x, source[1] + y2 * scale_y)
+
+        return region, (round(x2 - x), round(y2 - y))
+
+
+# Any other operation (filters, EXIF removal) which has to be applied to the pixels. Filters
+# measured in pixels (a Gaussian blur's radius, a kernel) are scaled to a reduced image, so the
+# preview shows the effect they have at full resolution.
+class Filter(object):
+
+    def __init__(self, name: str, *args) -> None:
+        self.name = name
+        self.args = args
+
+    @property
+    def description(self) -> tuple:
+        return 'filter', self.name, self.args
+
+    # Renders onto an image at the given scale relative to full resolution
+    def render(self, image, scale: float = 1.0):
+        args = self.args
+
+        if scale < 1 and self.name == 'gaussian_blur':
+            args = (args[0] * scale,)
+        elif scale < 1 and self.name == 'convolve':
+            args = adjustments.scale_kernel(scale, *args)
+
+            if args is None:
+                return image
+
+        return operations.OPERATIONS[self.name](image, *args)
+
+
+# Any run of point operations (brightness, contrast, gamma, levels, curves), their lookup
+# tables combined into one so the pixels are only mapped once however many are applied
+class Adjustment(object):
+
+    def __init__(self) -> None:
+        self.name = 'adjust'
+        self.lut = adjustments.IDENTITY
+
+    def add(self, name: str, *args) -> None:
+        self.lut = adjustments.compose(self.lut, adjustments.LUTS[name](*args))
+
+    @property
+    def description(self) -> tuple:
+        return 'adjust', self.lut
+
+    def render(self, image):
+        return adjustments.apply_lut(image, self.lut)
+
+
+# Records the operations applied to an image without applying them. Consecutive geometry
+# operations are folded together so however many are applied the pixels are only resampled
+# once (point operations likewise only map them once), and nothing is computed until an image
+# is rendered through the pipeline.
+class Pipeline(object):
+
+    def __init__(self, size: (int, int), result_cache: cache.ResultCache = None) -> None:
+        self.input_size = size
+        self.operations = []
+
+        # Results of each stage stored by content address (see cache.py), shared with other
+        # pipelines, along with the key identifying the input image rendered under each key
+        self.result_cache = result_cache
+        self.sources = {}
+
+        # Compiled stages, each stored with the number of operations it covers up to, along
+        # with the operations they were compiled from
+        self._stages = None
+
+        # Last filter output of each image rendered (by key) and the operations it reflects,
+        # allowing further operations to be rendered on top of it
+        self._memo = {}
+
+        # Last output of each image rendered (by key) and the operations it reflects
+        self._latest = {}
+
+    # Size of the output at full resolution (no pixels are touched)
+    @property
+    def size(self) -> (int, int):
+        size = self.input_size
+        for name, args in self.operations:
+            size = operations.output_size(name, size, *args)
+
+        return size
+
+    # Records an operation, a crop box being kept within the image it crops (raising ValueError
+    # if none of it is), so the size recorded is the size rendered
+    def append(self, name: str, *args) -> None:
+        if name == 'crop':
+            args = operations.clamp_box(self.size, *args)
+
+        self.operations.append((name, args))
+
+    def pop(self) -> (str, tuple):
+        return self.operations.pop()
+
+    # The geometry and filter stages the operations are rendered in
+    def stages(self) -> list:
+        return [stage for _, stage in self._compile(tuple(self.operations))]
+
+    # Groups the operations into stages, folding runs of geometry operations together. The
+    # operations are passed in (rather than read) so a render running in the background is
+    # unaffected by operations recorded meanwhile.
+    def _compile(self, operations_applied: tuple) -> list:
+        compiled = self._stages
+        if compiled is not None and compiled[0] == operations_applied:
+            return compiled[1]
+
+        stages = []
+        size = self.input_size
+
+        for count, (name, args) in enumerate(operations_applied, start=1):
+            if name in operations.GEOMETRY_OPERATIONS:
+                if not stages or not isinstance(stages[-1][1], Geometry):
+                    stages.append((count, Geometry(size)))
+
+                stages[-1][1].add(name, *args)
+                stages[-1] = (count, stages[-1][1])
+            elif name in operations.POINT_OPERATIONS:
+                if not stages or not isinstance(stages[-1][1], Adjustment):
+                    stages.append((count, Adjustment()))
+
+                stages[-1][1].add(name, *args)
+                stages[-1] = (count, stages[-1][1])
+            else:
+                stages.append((count, Filter(name, *args)))
+
+            size = operations.output_size(name, size, *args)
+
+        self._stages = (operations_applied, stages)
+
+        return stages
+
+    # Renders the operations onto the given image (the full resolution input or a scaled copy
+    # of it). When a key is given the result is memoized so repeated renders of the same image
+    # only compute the stages added since. The progress function (if given) is called with the
+    # fraction of stages completed, and may raise an exception to abandon the render. The
+    # operations rendered are those recorded, unless given (such as those recorded when a save
+    # was asked for).
+    def render(self, image, key: str = None, progress=None, operations_applied: tuple = None):
+        operations_applied = tuple(self.operations) if operations_applied is None else operations_applied
+        scale = image.width / self.input_size[0]
+
+        if key in self._latest and self._latest[key][0] == operations_applied:
+            return self._latest[key][1]
+
+        stages = self._compile(operations_applied)
+        first = 0
+
+        if key in self._memo:
+            count, recorded, memo_image = self._memo[key]
+
+            if operations_applied[:count] == recorded:
+                for index, (end, stage) in enumerate(stages):
+                    if end == count:
+                        image, first = memo_image, index + 1
+                        break
+
+        # Stages after the memo are taken from the result cache up to the last one stored
+        keys = self._keys(key, stages)
+        if keys is not None:
+            index, cached = self.result_cache.find(keys[first:])
+
+            if cached is not None:
+                image, first = cached, first + index + 1
+
+        for index, (end, stage) in enumerate(stages[first:], start=first):
+            if progress is not None:
+                progress(index / len(stages))
+
+            image = stage.render(image, scale) if isinstance(stage, Filter) else stage.render(image)
+
+            if keys is not None:
+                self.result_cache.put(keys[index], image)
+
+            # Only filter outputs are memoized, a geometry or adjustment stage may yet be extended
+            if key is not None and isinstance(stage, Filter):
+                self._memo[key] = (end, operations_applied[:end], image)
+
+        if key is not None:
+            self._latest[key] = (operations_applied, image)
+
+        return image
+
+    # Chains the key of the input image rendered under the given key through the stages,
+    # giving the key of each stage's result (None without a result cache or known input)
+    def _keys(self, key: str, stages: list) -> list:
+        if self.result_cache is None or key not in self.sources:
+            return None
+
+        keys = []
+        parent = self.sources[key]
+
+        for _, stage in stages:
+            parent = cache.chain(parent, stage.description)
+            keys.append(parent)
+
+        return keys
+
+    # Stores an image already known to be the output of the current operations for the given
+    # key (such as a preview restored by undo) so it isn't rendered again
+    def seed(self, key: str, image) -> None:
+        operations_applied = tuple(self.operations)
+
+        self._memo[key] = (len(operations_applied), operations_applied, image)
+        self._latest[key] = (operations_applied, image)
+
+    # Drops the images rendered under the given key to free their memory (the next render
+    # starting again from the input, or from the result cache)
+    def forget(self, key: str) -> None:
+        self._memo.pop(key, None)
+        self._latest.pop(key, None)
+
+    # Images held by the memoized renders (the same image may be held by both)
+    def images(self) -> list:
+        return [memo[2] for memo in self._memo.values()] + [latest[1] for latest in self._latest.values()]
@@ -0,0 +1,169 @@
+import json
+import math
+import os
+import threading
+import time
+from functools import wraps
+from tkinter import Menu, Misc
+
+# Milliseconds between heartbeats, a late heartbeat showing the event loop was blocked
+HEARTBEAT_INTERVAL = 50
+
+# Calls recorded at most (the oldest are kept), so a long session can't use unbounded memory
+MAX_RECORDS = 1000000
+
+
+def percentile(values: list, fraction: float) -> float:
+    """
+    Gets a percentile of the values (nearest rank).
+    :param values: (list) The values, sorted.
+    :param fraction: (float) The percentile as a fraction (0.95 for the 95th).
+    :return: (float) The value at that percentile.
+    """
+    index = max(0, min(len(values) - 1, math.ceil(fraction * len(values)) - 1))
+
+    return values[index]
+
+
+# Opt-in instrumentation of the user interface. Once installed, every menu command, event
+# binding and after() callback is timed along with the size and mode of the open image, and a
+# heartbeat measures how late the event loop runs. Results are written as Chrome trace events
+# (viewable in chrome://tracing or Perfetto) with a table of percentiles per operation.
+class Profiler(object):
+
+    def __init__(self, trace_path: str) -> None:
+        self.trace_path = trace_path
+        self.app = None
+
+        # name, start and duration (seconds from the profiler starting), image size and mode
+        self.records = []
+        self.lags = []
+        self.start = time.perf_counter()
+
+        self._originals = {}
+        self._heartbeat_time = None
+
+    # Wraps the callbacks registered from now on (install before the window is created so its
+    # menus are included)
+    def install(self) -> None:
+        profiler = self
+        self._originals = {'add': Menu.add, 'bind': Misc.bind, 'after': Misc.after}
+
+        add, bind, after = Menu.add, Misc.bind, Misc.after
+
+        # add_command etc. pass their options in cnf, so both are looked in
+        def add_item(menu, item_type, cnf={}, **kw):
+            kw = dict(cnf or {}, **kw)
+            if callable(kw.get('command')):
+                kw['command'] = profiler.wrap(f"menu: {kw.get('label', item_type)}", kw['command'])
+            return add(menu, item_type, **kw)
+
+        def bind_event(widget, sequence=None, func=None, add=None):
+            if callable(func):
+                func = profiler.wrap(f'bind: {sequence}', func)
+            return bind(widget, sequence, func, add)
+
+        def after_callback(widget, ms, func=None, *args):
+            if callable(func) and func != profiler.heartbeat:
+                func = profiler.wrap(f"after: {getattr(func, '__qualname__', 'callback')}", func)
+            return after(widget, ms, func, *args)
+
+        Menu.add = add_item
+        Misc.bind = bind_event
+        Misc.after = after_callback
+
+    def uninstall(self) -> None:
+        for name, original in self._originals.items():
+            setattr(Menu if name == 'add' else Misc, name, original)
+
+        self._originals = {}
+
+    # Starts the heartbeat and records the open image along with each call
+    def attach(self, app) -> None:
+        self.app = app
+        self._heartbeat_time = time.perf_counter()
+        app.root.after(HEARTBEAT_INTERVAL, self.heartbeat)
+
+    # Records how much later than due the heartbeat ran, then schedules the next
+    def heartbeat(self) -> None:
+        now = time.perf_counter()
+        lag = max(0.0, now - self._heartbeat_time - HEARTBEAT_INTERVAL / 1000)
+
+        if len(self.lags) < MAX_RECORDS:
+            self.lags.append((now - self.start, lag))
+
+        self._heartbeat_time = now
+        self.app.root.after(HEARTBEAT_INTERVAL, self.heartbeat)
+
+    # Returns the function wrapped so each call is recorded under the given name
+    def wrap(self, name: str, function):
+        profiler = self
+
+        @wraps(function)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+
+            try:
+                return function(*args, **kwargs)
+            finally:
+                profiler.record(name, start, time.perf_counter() - start)
+
+        return timed
+
+    def record(self, name: str, start: float, duration: float) -> None:
+        if len(self.records) >= MAX_RECORDS:
+            return
+
+        size, mode = None, None
+        document = self.app.document if self.app is not None else None
+
+        # The master isn't touched, as it may be locked while decoded in the background
+        if document is not None:
+            size, mode = document.size, document.mode
+
+        self.records.append((name, start - self.start, duration, size, mode))
+
+    # Chrome trace event format: a complete event per call and a counter of the event loop lag
+    def trace(self) -> dict:
+        pid, tid = os.getpid(), threading.main_thread().ident
+        events = []
+
+        for name, start, duration, size, mode in self.records:
+            events.append({'name': name, 'cat': name.split(':')[0], 'ph': 'X', 'pid': pid, 'tid': tid,
+                           'ts': start * 1e6, 'dur': duration * 1e6,
+                           'args': {'size': f'{size[0]}x{size[1]}' if size else None, 'mode': mode}})
+
+        for time_, lag in self.lags:
+            events.append({'name': 'event loop lag', 'ph': 'C', 'pid': pid, 'tid': tid,
+                           'ts': time_ * 1e6, 'args': {'lag (ms)': lag * 1000}})
+
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    # Table of the calls, total time and 50th/95th/99th percentile durations of each operation
+    # and of the event loop lag, the operations taking the most time in total first
+    def summary(self) -> str:
+        durations = {}
+        for name, _, duration, _, _ in self.records:
+            durations.setdefault(name, []).append(duration * 1000)
+
+        if self.lags:
+            durations['event loop lag'] = [lag * 1000 for _, lag in self.lags]
+
+        lines = [f"{'Operation':<45} {'Calls':>7} {'Total ms':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"]
+
+        for name, values in sorted(durations.items(), key=lambda item: -sum(item[1])):
+            values.sort()
+            lines.append(f'{name:<45} {len(values):>7} {sum(values):>10.1f} {percentile(values, 0.5):>9.2f} '
+                         f'{percentile(values, 0.95):>9.2f} {percentile(values, 0.99):>9.2f}')
+
+        return '\n'.join(lines)
+
+    # Writes the trace file and prints the summary
+    def finish(self) -> None:
+        self.uninstall()
+
+        with open(self.trace_path, 'w') as file:
+            json.dump(self.trace(), file)
+
+        print(self.summary())
+        print(f'\nTrace written to {self.trace_path}')
@@ -0,0 +1,369 @@
+import base64
+import json
+import struct
+import zlib
+
+from PIL import Image, ImageFile, ImagePalette
+
+from annotations import Shape, Stroke, InsertedImage, Footer
+from document import Document
+from encoder import atomic_write
+from history import History, Step, restore_delta
+
+# Extension of project files
+PROJECT_EXTENSION = '.iep'
+
+# A project file starts with a header giving where the manifest (JSON describing the document)
+# is, followed by the pixel data in chunks each starting at a multiple of the page size so they
+# can be memory-mapped, the manifest coming last. The master and base images are stored
+# uncompressed (the master only being read when first rendered), the smaller chunks (history
+# deltas, inserted images) lightly compressed.
+MAGIC = b'IEPROJ\r\n'
+VERSION = 1
+HEADER = struct.Struct('<8sIIQQ')
+ALIGNMENT = 4096
+
+# Bytes of the master written at a time, so saving doesn't hold a second copy of it in memory
+BAND_BYTES = 16 * 1024 * 1024
+
+
+def _accept(prefix: bytes) -> bool:
+    return prefix[:len(MAGIC)] == MAGIC
+
+
+# Reads the master image of a project as PIL reads any other format, so it is opened without
+# being decoded and PIL maps the file into memory when it is loaded (for modes laid out in memory
+# as stored, other modes being read into memory).
+class ProjectImageFile(ImageFile.ImageFile):
+
+    format = 'IEP'
+    format_description = 'Image editor project'
+
+    def _open(self) -> None:
+        master = read_manifest(self.fp)['master']
+
+        self._mode = master['mode']
+        self._size = tuple(master['size'])
+        self.info.update({name: base64.b64decode(value) for name, value in master['info'].items()})
+
+        if master.get('palette'):
+            self.palette = ImagePalette.raw('RGB', bytes(master['palette']))
+
+        self.tile = [ImageFile._Tile('raw', (0, 0) + self.size, master['offset'], (self.mode, 0, 1))]
+
+
+Image.register_open(ProjectImageFile.format, ProjectImageFile, _accept)
+
+
+def read_manifest(file) -> dict:
+    """
+    Reads the manifest of a project file.
+    :param file: (file) The project file, opened in binary mode.
+    :return: (dict) The manifest.
+    """
+    file.seek(0)
+    magic, version, _, offset, length = HEADER.unpack(file.read(HEADER.size))
+
+    if magic != MAGIC:
+        raise ValueError('Not an image editor project')
+    if version > VERSION:
+        raise ValueError(f'The project was saved by a newer version (format {version})')
+
+    file.seek(offset)
+
+    return json.loads(file.read(length))
+
+
+def snapshot(document: Document) -> dict:
+    """
+    Takes the parts of a document that change as it is edited (the operations, annotations,
+    history and preview), so a project written in the background is consistent whatever is
+    edited meanwhile. Called on the thread editing the document, the history's spilled deltas
+    being held where they are until the project is saved (see History.hold).
+    :param document: (Document) The document to be saved.
+    :return: (dict) The parts taken, as passed to save.
+    """
+    return {'operations': tuple(document.pipeline.operations), 'annotations': document.annotations[:],
+            'undo': document.history.undo_stack[:], 'redo': document.history.redo_stack[:],
+            'preview': document.preview, 'hold': document.history.hold()}
+
+
+def save(document: Document, path: str, progress=None, state: dict = None) -> None:
+    """
+    Saves a document as a project: its master and base images, the operations applied, the
+    annotations (with the pixels of inserted images) and the undo/redo history. The file is
+    written atomically (see encoder.atomic_write), so an existing project is never left half
+    written.
+    :param document: (Document) The document to be saved.
+    :param path: (str) The file path to save to.
+    :param progress: (function) Called with the fraction of the master written (optional).
+    :param state: (dict) The document as it was when saved (see snapshot), taken here if not
+    given (when saving on the thread editing it).
+    """
+    state = snapshot(document) if state is None else state
+
+    with state['hold'], atomic_write(path) as file:
+        file.write(HEADER.pack(MAGIC, VERSION, ALIGNMENT, 0, 0))
+        manifest = _write_document(file, document, state, progress)
+
+        data = json.dumps(manifest).encode()
+        offset = file.tell()
+        file.write(data)
+
+        file.seek(0)
+        file.write(HEADER.pack(MAGIC, VERSION, ALIGNMENT, offset, len(data)))
+
+    document.project_path = path
+
+
+def load(path: str, result_cache=None) -> Document:
+    """
+    Opens a project, restoring the document as it was saved. Only the manifest, the base image
+    and the other small chunks are read, the master being read when first rendered.
+    :param path: (str) Path of the project.
+    :param result_cache: (ResultCache) Cache shared with the other documents (optional).
+    :return: (Document) The document.
+    """
+    with open(path, 'rb') as file:
+        manifest = read_manifest(file)
+
+        base = _read_image(file, manifest['base'])
+        preview = _read_image(file, manifest['preview'])
+        annotations = [_restore_annotation(file, description) for description in manifest['annotations']]
+        history = History()
+
+        for stack, steps in ((history.undo_stack, manifest['undo']), (history.redo_stack, manifest['redo'])):
+            stack.extend(_restore_step(file, step, annotations) for step in steps)
+
+    document = Document(Image.open(path), manifest['file_path'], base=base, history=history,
+                        result_cache=result_cache)
+    document.project_path = path
+    document.annotations[:] = [annotations[index] for index in manifest['visible']]
+
+    for name, args in manifest['operations']:
+        document.pipeline.append(name, *_tuples(args))
+
+    # The master's key is kept from when it was opened, rather than hashing the project
+    if result_cache is not None and manifest['master'].get('key'):
+        document.pipeline.sources['master'] = manifest['master']['key']
+
+    # The preview was saved, so nothing is rendered to display the project
+    document.pipeline.seed('proxy', preview)
+
+    return document
+
+
+def _write_document(file, document: Document, state: dict, progress) -> dict:
+    """
+    Writes the chunks of a document, returning the manifest describing them.
+    :param file: (file) The project file being written.
+    :param document: (Document) The document being saved.
+    :param state: (dict) The document's operations, annotations, history and preview as they
+    were when saved (see snapshot).
+    :param progress: (function) Called with the fraction of the master written (optional).
+    :return: (dict) The manifest.
+    """
+    document.load()
+    master = _write_image(file, document.master, progress=progress)
+    master['info'] = {name: base64.b64encode(document.master.info[name]).decode()
+                      for name in ('exif', 'icc_profile') if document.master.info.get(name)}
+    master['key'] = document.pipeline.sources.get('master')
+
+    # Every annotation (including those only in the history) is stored once, being referred to
+    # by index so undoing and redoing still act on the same objects
+    table = []
+    history = document.history
+    for annotation in state['annotations'] + [annotation for step in state['undo'] + state['redo']
+                                              for annotation in _step_annotations(step)]:
+        if not any(annotation is stored for stored in table):
+            table.append(annotation)
+
+    return {
+        'file_path': document.file_path,
+        'master': master,
+        'base': _write_image(file, document.base),
+        'preview': _write_image(file, state['preview']),
+        'operations': [[name, list(args)] for name, args in state['operations']],
+        'annotations': [_describe_annotation(file, annotation) for annotation in table],
+        'visible': [_index(table, annotation) for annotation in state['annotations']],
+        'undo': [_describe_step(file, step, table, history) for step in state['undo']],
+        'redo': [_describe_step(file, step, table, history) for step in state['redo']],
+    }
+
+
+def _write_chunk(file, data: bytes, compressed: bool = False) -> dict:
+    """
+    Writes a chunk at the next aligned offset.
+    :param file: (file) The project file being written.
+    :param data: (bytes) The chunk's data.
+    :param compressed: (bool) Whether the data is compressed with zlib.
+    :return: (dict) Offset and length of the chunk and whether it is compressed.
+    """
+    offset = -file.tell() % ALIGNMENT + file.tell()
+    file.seek(offset)
+    file.write(data)
+
+    return {'offset': offset, 'length': len(data), 'compressed': compressed}
+
+
+def _write_image(file, image, compressed: bool = False, progress=None) -> dict:
+    """
+    Writes an image's pixels as a chunk, uncompressed images a band of rows at a time.
+    :param file: (file) The project file being written.
+    :param image: (PIL.Image) The image.
+    :param compressed: (bool) Whether to compress the pixels (lightly).
+    :param progress: (function) Called with the fraction of the rows written (optional).
+    :return: (dict) The chunk, with the image's mode, size and palette.
+    """
+    if compressed:
+        chunk = _write_chunk(file, zlib.compress(image.tobytes(), 1), True)
+    else:
+        chunk = _write_chunk(file, b'')
+        rows = max(1, BAND_BYTES // max(1, len(image.crop((0, 0, image.width, 1)).tobytes())))
+
+        for top in range(0, image.height, rows):
+            file.write(image.crop((0, top, image.width, min(top + rows, image.height))).tobytes())
+
+            if progress is not None:
+                progress(min(top + rows, image.height) / image.height)
+
+        chunk['length'] = file.tell() - chunk['offset']
+
+    chunk.update({'mode': image.mode, 'size': list(image.size)})
+
+    if image.mode in ('P', 'PA'):
+        chunk['palette'] = list(image.getpalette('RGB'))
+
+    return chunk
+
+
+def _read_chunk(file, chunk: dict) -> bytes:
+    file.seek(chunk['offset'])
+    data = file.read(chunk['length'])
+
+    return zlib.decompress(data) if chunk['compressed'] else data
+
+
+def _read_image(file, chunk: dict):
+    image = Image.frombytes(chunk['mode'], tuple(chunk['size']), _read_chunk(file, chunk))
+
+    if chunk.get('palette'):
+        image.putpalette(chunk['palette'])
+
+    return image
+
+
+def _index(table: list, annotation) -> int:
+    return next(index for index, stored in enumerate(table) if stored is annotation)
+
+
+def _step_annotations(step: Step) -> list:
+    """
+    Gets the annotations a history step refers to.
+    :param step: (Step) The step.
+    :return: (list) The annotation added, or those cleared, and any the step moved (as they were).
+    """
+    if step.kind == 'annotation':
+        return [step.value] + step.annotations
+    if step.kind == 'clear':
+        return step.value + step.annotations
+
+    return step.annotations
+
+
+def _describe_step(file, step: Step, table: list, history: History) -> dict:
+    """
+    Describes a history step, writing its pixel delta as a chunk.
+    :param file: (file) The project file being written.
+    :param step: (Step) The step.
+    :param table: (list) Every annotation stored, which the step refers to by index.
+    :param history: (History) The history the step belongs to (holding any spilled deltas).
+    :return: (dict) The description.
+    """
+    if step.kind == 'operation':
+        value = [step.value[0], list(step.value[1])]
+    elif step.kind == 'annotation':
+        value = _index(table, step.value)
+    else:
+        value = [_index(table, annotation) for annotation in step.value]
+
+    delta = None
+    if step.delta is not None:
+        delta = step.delta.describe()
+        delta['data'] = _write_chunk(file, history.compressed(step.delta), True)
+
+    return {'kind': step.kind, 'value': value, 'annotations': [_index(table, annotation)
+                                                                for annotation in step.annotations],
+            'delta': delta}
+
+
+def _restore_step(file, description: dict, annotations: list) -> Step:
+    kind, value = description['kind'], description['value']
+
+    if kind == 'operation':
+        value = (value[0], _tuples(value[1]))
+    elif kind == 'annotation':
+        value = annotations[value]
+    else:
+        value = [annotations[index] for index in value]
+
+    delta = description['delta']
+    if delta is not None:
+        file.seek(delta['data']['offset'])
+        delta = restore_delta(delta, file.read(delta['data']['length']))
+
+    return Step(kind, value, [annotations[index] for index in description['annotations']], delta)
+
+
+def _describe_annotation(file, annotation) -> dict:
+    """
+    Describes an annotation, writing the pixels of an inserted image as a chunk.
+    :param file: (file) The project file being written.
+    :param annotation: The annotation (see annotations.py).
+    :return: (dict) The description.
+    """
+    if isinstance(annotation, Shape):
+        return {'type': 'shape', 'kind': annotation.kind, 'points': list(annotation.points),
+                'colour': annotation.colour, 'width': annotation.width}
+
+    if isinstance(annotation, Stroke):
+        return {'type': 'stroke', 'colour': annotation.colour, 'radius': annotation.radius,
+                'points': [list(point) for point in annotation.points]}
+
+    if isinstance(annotation, InsertedImage):
+        return {'type': 'image', 'path': annotation.path, 'centre': list(annotation.centre),
+                'size': list(annotation.size), 'image': _write_image(file, annotation.overlay(), True)}
+
+    return {'type': 'footer', 'text': annotation.text, 'factor': annotation.factor}
+
+
+def _restore_annotation(file, description: dict):
+    kind = description['type']
+
+    if kind == 'shape':
+        return Shape(description['kind'], tuple(description['points']), description['colour'], description['width'])
+
+    if kind == 'stroke':
+        return Stroke(description['colour'], description['radius'], [tuple(point) for point in description['points']])
+
+    if kind == 'image':
+        return InsertedImage(description['path'], tuple(description['centre']), tuple(description['size']),
+                             _read_image(file, description['image']))
+
+    footer = Footer(1 / description['factor'])
+    footer.text = description['text']
+
+    return footer
+
+
+def _tuples(value):
+    """
+    Converts the lists of a value read from JSON back into tuples (as operation arguments are
+    given), recursively.
+    :param value: The value.
+    :return: The value with tuples in place of lists.
+    """
+    if isinstance(value, list):
+        return tuple(_tuples(item) for item in value)
+
+    return value
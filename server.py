@@ -0,0 +1,413 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+from PIL import Image
+
+import encoder
+import operations
+from batch import parse_recipe
+from pipeline import Pipeline
+from profiler import percentile
+
+# Bytes read from (or written to) a connection at a time
+CHUNK_SIZE = 64 * 1024
+
+# Largest image accepted, in bytes
+MAX_BODY = 256 * 1024 * 1024
+
+# Latest latencies kept per endpoint for the percentiles in /metrics
+LATENCY_SAMPLES = 10000
+
+# Seconds a connection may stay idle (such as a client that stops sending its image) before it is dropped
+CONNECTION_TIMEOUT = 30
+
+# Seconds an image may take to be received in full, so slow uploads can't tie up the service
+UPLOAD_TIMEOUT = 120
+
+
+# A request that can't be served, answered with the given status
+class RequestError(Exception):
+
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+def render_file(input_path: str, output_path: str, steps: list, image_format: str = None) -> (str, int, int):
+    """
+    Applies operations to an image file and saves the result the way the editor does (run in a
+    worker process).
+    :param input_path: (str) Path of the image.
+    :param output_path: (str) Path the result is saved to.
+    :param steps: (list) (name, args) of each operation in order.
+    :param image_format: (str) PIL format name of the result, the image's own if not given.
+    :return: Tuple(str, int, int) format, width and height of the result.
+    """
+    with Image.open(input_path) as image:
+        image.load()
+        image_format = image_format or image.format
+
+        pipeline = Pipeline(image.size)
+        for name, args in steps:
+            pipeline.append(name, *args)
+
+        result = pipeline.render(image)
+
+    encoder.encode(result, output_path, image_format)
+
+    return image_format, result.width, result.height
+
+
+# Requests served and the latency of each endpoint, along with the requests turned away
+# because the service was saturated. Shared between the request threads.
+class Metrics(object):
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.rejected = 0
+        self.endpoints = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, status: int, seconds: float, received: int = 0, sent: int = 0) -> None:
+        with self._lock:
+            entry = self.endpoints.get(endpoint)
+            if entry is None:
+                entry = self.endpoints[endpoint] = {'statuses': {}, 'bytes_in': 0, 'bytes_out': 0,
+                                                    'latencies': deque(maxlen=LATENCY_SAMPLES)}
+
+            entry['statuses'][status] = entry['statuses'].get(status, 0) + 1
+            entry['bytes_in'] += received
+            entry['bytes_out'] += sent
+            entry['latencies'].append(seconds)
+
+            if status == 503:
+                self.rejected += 1
+
+    # Counts and 50th/95th/99th percentile latencies (in milliseconds) of each endpoint
+    def snapshot(self) -> dict:
+        with self._lock:
+            endpoints = {}
+
+            for endpoint, entry in self.endpoints.items():
+                latencies = sorted(entry['latencies'])
+                statuses = entry['statuses']
+
+                endpoints[endpoint] = {
+                    'requests': sum(statuses.values()),
+                    'errors': sum(count for status, count in statuses.items() if status >= 400),
+                    'statuses': {str(status): count for status, count in sorted(statuses.items())},
+                    'bytes_in': entry['bytes_in'],
+                    'bytes_out': entry['bytes_out'],
+                    'latency_ms': {name: round(percentile(latencies, fraction) * 1000, 3)
+                                   for name, fraction in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99), ('max', 1))},
+                }
+
+            return {'uptime': round(time.perf_counter() - self.start, 3), 'rejected': self.rejected,
+                    'endpoints': endpoints}
+
+
+# Renders images on a pool of worker processes. At most workers + queue_size renders are
+# admitted at once (those beyond the workers waiting their turn), any more being turned away
+# straight away rather than queued without limit. Images are spooled to temporary files so
+# neither the request threads nor the workers hold them in memory longer than rendering needs.
+class RenderService(object):
+
+    def __init__(self, workers: int = None, queue_size: int = None) -> None:
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size if queue_size is not None else self.workers * 2
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        self.spool = tempfile.mkdtemp(prefix='image_editor_server_')
+        self.metrics = Metrics()
+
+        self._slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+        self._active = 0
+        self._lock = threading.Lock()
+
+    # Whether every slot is in use
+    @property
+    def busy(self) -> bool:
+        with self._lock:
+            return self._active >= self.workers + self.queue_size
+
+    # Takes a slot for a render, False if every slot is in use
+    def admit(self) -> bool:
+        if not self._slots.acquire(blocking=False):
+            return False
+
+        with self._lock:
+            self._active += 1
+
+        return True
+
+    def release(self) -> None:
+        with self._lock:
+            self._active -= 1
+
+        self._slots.release()
+
+    # Renders a spooled image, returning the result of render_file (call after admit)
+    def render(self, input_path: str, output_path: str, steps: list, image_format: str = None) -> (str, int, int):
+        return self.executor.submit(render_file, input_path, output_path, steps, image_format).result()
+
+    # Path of a new, empty temporary file in the spool directory
+    def spool_file(self) -> str:
+        handle, path = tempfile.mkstemp(dir=self.spool)
+        os.close(handle)
+
+        return path
+
+    def status(self) -> dict:
+        with self._lock:
+            active = self._active
+
+        return dict(self.metrics.snapshot(), workers=self.workers, queue_size=self.queue_size, active=active,
+                    queued=max(0, active - self.workers))
+
+    def close(self) -> None:
+        self.executor.shutdown(cancel_futures=True)
+        shutil.rmtree(self.spool, ignore_errors=True)
+
+
+# Handles a request on its own thread. Endpoints:
+#   POST /render?recipe=rotate,crop=0:0:400:300&format=png  - the image as the body, the result
+#       streamed back (the recipe is as batch.py's, the format the image's own if not given)
+#   GET /operations  - the names of the operations available
+#   GET /metrics     - requests served, latencies and how busy the workers are, as JSON
+class RequestHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'ImageEditor'
+    timeout = CONNECTION_TIMEOUT
+
+    def do_GET(self) -> None:
+        self._handle({'/metrics': self._metrics, '/operations': self._operations})
+
+    def do_POST(self) -> None:
+        self._handle({'/render': self._render})
+
+    # Runs the endpoint's function, answering an error with its status (500 if unexpected), and
+    # records the request however it ends
+    def _handle(self, routes: dict) -> None:
+        start = time.perf_counter()
+        url = urlsplit(self.path)
+        self.received = self.sent = 0
+        self.status = None
+
+        try:
+            route = routes.get(url.path)
+            if route is None:
+                raise RequestError(404, f'Not found: {url.path}')
+
+            route({name: values[-1] for name, values in parse_qs(url.query).items()})
+        except RequestError as error:
+            self._send_error(error.status, str(error))
+        except Exception as error:
+            self.log_error('%s failed: %r', self.path, error)
+            self._send_error(500, f'The request failed: {error}')
+        finally:
+            self.server.service.metrics.record(f'{self.command} {url.path if url.path in routes else "other"}',
+                                               self.status or 500, time.perf_counter() - start, self.received,
+                                               self.sent)
+
+    def send_response(self, code: int, message: str = None) -> None:
+        self.status = code
+        super().send_response(code, message)
+
+    def _metrics(self, query: dict) -> None:
+        self._send_json(200, self.server.service.status())
+
+    def _operations(self, query: dict) -> None:
+        self._send_json(200, {'operations': list(operations.OPERATIONS)})
+
+    def _render(self, query: dict) -> None:
+        service = self.server.service
+
+        try:
+            steps = parse_recipe(query['recipe']) if query.get('recipe') else []
+            image_format = encoder.format_for(f"result.{query['format']}") if query.get('format') else None
+        except ValueError as error:
+            raise RequestError(400, str(error))
+
+        # Turned away before the image is read when saturated, so time isn't spent receiving it
+        if service.busy:
+            raise RequestError(503, 'The service is busy, try again shortly')
+
+        input_path, output_path = service.spool_file(), service.spool_file()
+
+        try:
+            with open(input_path, 'wb') as file:
+                self.received = self._read_body(file)
+
+            # A slot is only taken once the image has been received, so slow uploads can't hold them all
+            if not service.admit():
+                raise RequestError(503, 'The service is busy, try again shortly')
+
+            try:
+                image_format, width, height = service.render(input_path, output_path, steps, image_format)
+            except Image.DecompressionBombError as error:
+                raise RequestError(413, str(error))
+            except Image.UnidentifiedImageError:
+                raise RequestError(415, 'The body is not an image that can be opened')
+            except (OSError, ValueError, TypeError, SyntaxError) as error:
+                raise RequestError(400, f"The image couldn't be rendered: {error}")
+            finally:
+                service.release()
+
+            self.send_response(200)
+            self.send_header('Content-Type', Image.MIME.get(image_format, 'application/octet-stream'))
+            self.send_header('X-Image-Size', f'{width}x{height}')
+            self._stream(output_path)
+        finally:
+            for path in (input_path, output_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    # Copies the body to a file a chunk at a time (whether sent with a length or chunked)
+    def _read_body(self, file) -> int:
+        self.deadline = time.monotonic() + UPLOAD_TIMEOUT
+
+        if 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+            received = 0
+
+            while True:
+                size = _parse_size(self.rfile.readline(CHUNK_SIZE).split(b';')[0].strip(), 16)
+                if size == 0:
+                    break
+
+                received = self._copy(file, size, received)
+                self.rfile.readline(CHUNK_SIZE)
+
+            # Trailers (if any) end with an empty line
+            while self.rfile.readline(CHUNK_SIZE).strip():
+                pass
+
+            return received
+
+        length = self.headers.get('Content-Length')
+        if length is None:
+            raise RequestError(411, 'The image must be sent with a Content-Length or chunked')
+
+        return self._copy(file, _parse_size(length.strip(), 10), 0)
+
+    def _copy(self, file, size: int, received: int) -> int:
+        if received + size > MAX_BODY:
+            raise RequestError(413, f'Images larger than {MAX_BODY // (1024 * 1024)} MB are not accepted')
+
+        while size > 0:
+            if time.monotonic() > self.deadline:
+                raise RequestError(408, f'The image took longer than {UPLOAD_TIMEOUT} seconds to send')
+
+            data = self.rfile.read(min(size, CHUNK_SIZE))
+            if not data:
+                raise RequestError(400, 'The connection closed before the image was received')
+
+            file.write(data)
+            size -= len(data)
+            received += len(data)
+
+        return received
+
+    # Sends a file as the body a chunk at a time, so results of any size are never held in memory
+    def _stream(self, path: str) -> None:
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        with open(path, 'rb') as file:
+            while True:
+                data = file.read(CHUNK_SIZE)
+                if not data:
+                    break
+
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+                self.sent += len(data)
+
+        self.wfile.write(b'0\r\n\r\n')
+
+    def _send_json(self, status: int, content: dict) -> None:
+        body = json.dumps(content, indent=2).encode()
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.sent += len(body)
+
+    # Answers with the error as JSON. Errors answering a POST close the connection, as its body
+    # may not have been read (such as when busy). Once a response has begun the connection is
+    # only closed, as nothing else can be sent.
+    def _send_error(self, status: int, message: str) -> None:
+        if self.command == 'POST' or self.status is not None:
+            self.close_connection = True
+
+        if self.status is not None:
+            return
+
+        body = json.dumps({'error': message}).encode()
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if status == 503:
+            self.send_header('Retry-After', '1')
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+        self.sent += len(body)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+def _parse_size(text, base: int) -> int:
+    """
+    Parses the length of a body (or of one of its chunks).
+    :param text: (str) The Content-Length, or (bytes) the size of a chunk in hexadecimal.
+    :param base: (int) 10 for a length, 16 for a chunk size.
+    :return: (int) The number of bytes.
+    """
+    try:
+        size = int(text, base)
+    except ValueError:
+        raise RequestError(400, f'Invalid length: {text!r}')
+
+    if size < 0:
+        raise RequestError(400, f'Invalid length: {text!r}')
+
+    return size
+
+
+def serve(address: str = '8000', workers: int = None, queue_size: int = None) -> None:
+    """
+    Serves the editor's operations over HTTP until interrupted (Ctrl+C).
+    :param address: (str) Port to listen on, or host:port (the host defaulting to 127.0.0.1, so
+    only this machine can connect). Port 0 picks a free port.
+    :param workers: (int) Number of worker processes (defaults to the number of CPUs).
+    :param queue_size: (int) Renders waiting for a worker before others are turned away
+    (defaults to twice the workers).
+    """
+    host, _, port = address.rpartition(':')
+    service = RenderService(workers, queue_size)
+
+    server = ThreadingHTTPServer((host or '127.0.0.1', int(port)), RequestHandler)
+    server.service = service
+
+    print(f'Serving on http://{server.server_address[0]}:{server.server_address[1]} '
+          f'with {service.workers} worker(s), {service.queue_size} queued at most (Ctrl+C to stop)', flush=True)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
@@ -0,0 +1,117 @@
+from collections import OrderedDict
+
+import cache
+from document import Document, is_decoded
+from files import file_stamp
+
+
+# The documents open in the editor (one per tab) and the images of recently closed files, held
+# within a single memory budget. Whenever the budget is exceeded the images of closed files are
+# dropped, oldest first, then the documents not displayed are released (see Document.release)
+# from the least recently displayed. Every document keeps its preview, so switching back to one
+# is instant, and re-opening a recently closed file needs nothing decoding.
+class Session(object):
+
+    def __init__(self, memory_budget: int = 1024 * 1024 * 1024, recent_files: int = 8) -> None:
+        self.memory_budget = memory_budget
+        self.recent_files = recent_files
+
+        # Documents in tab order and the one displayed
+        self.documents = []
+        self.active = None
+
+        # Documents from the least to the most recently displayed
+        self._recent = []
+
+        # Master and base images of closed files by path, with the version of the file they
+        # were decoded from, least recently closed first
+        self.decoded = OrderedDict()
+
+        # Documents released and closed files dropped to stay within the budget
+        self.releases = 0
+        self.evictions = 0
+
+    # Bytes held by the open documents and the images of closed files
+    @property
+    def nbytes(self) -> int:
+        return sum(document.nbytes for document in self.documents) + \
+            sum(_nbytes(master, base) for _, master, base in self.decoded.values())
+
+    # The open document of the given image or project file (None if it isn't open)
+    def find(self, path: str) -> Document:
+        return next((document for document in self.documents
+                     if path == (document.project_path or document.file_path)), None)
+
+    # Adds a document as a new tab, displayed from now on
+    def add(self, document: Document) -> None:
+        self.documents.append(document)
+        self.activate(document)
+
+    # Records the document as the one displayed, releasing others if over the budget
+    def activate(self, document: Document) -> None:
+        self.active = document
+
+        if document in self._recent:
+            self._recent.remove(document)
+        self._recent.append(document)
+
+        self.enforce_budget()
+
+    # Closes a document, keeping the images of its file for when it is re-opened, and returns
+    # the document to display in its place (the most recently displayed, None if none are open)
+    def close(self, document: Document) -> Document:
+        self.documents.remove(document)
+        self._recent.remove(document)
+        document.close()
+
+        # Only images opened from their own file are kept (not those of projects)
+        path = document.file_path
+        if document.project_path is None and document.file_unchanged:
+            self.decoded.pop(path, None)
+            self.decoded[path] = (file_stamp(path), document.master, document.base)
+
+            while len(self.decoded) > self.recent_files:
+                self.decoded.popitem(last=False)
+
+        self.active = self._recent[-1] if self._recent else None
+        self.enforce_budget()
+
+        return self.active
+
+    # Takes the master and base images kept from a closed file, (None, None) if there aren't
+    # any or the file has changed since
+    def take(self, path: str) -> tuple:
+        stamp, master, base = self.decoded.pop(path, (None, None, None))
+
+        if stamp is None or stamp != file_stamp(path):
+            return None, None
+
+        return master, base
+
+    # Drops the images of closed files then releases the documents not displayed, least
+    # recently used first, until the memory held is within the budget
+    def enforce_budget(self) -> None:
+        nbytes = self.nbytes
+
+        while nbytes > self.memory_budget and self.decoded:
+            _, (_, master, base) = self.decoded.popitem(last=False)
+            nbytes -= _nbytes(master, base)
+            self.evictions += 1
+
+        for document in self._recent:
+            if nbytes <= self.memory_budget:
+                break
+
+            if document is not self.active:
+                freed = document.release()
+
+                if freed:
+                    nbytes -= freed
+                    self.releases += 1
+
+
+def _nbytes(master, base) -> int:
+    if master is base:
+        return cache.image_nbytes(base)
+
+    return cache.image_nbytes(base) + (cache.image_nbytes(master) if is_decoded(master) else 0)
@@ -0,0 +1,109 @@
+from PIL import Image
+
+from annotations import Stroke
+from display import Display
+
+
+def smooth(points: list, iterations: int = 2) -> list:
+    """
+    Smooths a polyline by repeatedly cutting its corners (Chaikin's algorithm), keeping the
+    first and last points in place.
+    :param points: (list) x, y of each point of the line.
+    :param iterations: (int) Number of times the corners are cut.
+    :return: (list) x, y of each point of the smoothed line.
+    """
+    for _ in range(iterations):
+        if len(points) < 3:
+            break
+
+        smoothed = [points[0]]
+        for (x, y), (x2, y2) in zip(points, points[1:]):
+            smoothed += [(0.75 * x + 0.25 * x2, 0.75 * y + 0.25 * y2),
+                         (0.25 * x + 0.75 * x2, 0.25 * y + 0.75 * y2)]
+        smoothed.append(points[-1])
+        points = smoothed
+
+    return points
+
+
+# Collects pen motion into strokes. The stroke being drawn is shown as a single canvas line
+# which is updated as the cursor moves; once finished it is recorded against the document and
+# rasterized into the stroke layer, a transparent image over the canvas image. However much
+# is drawn the canvas only ever holds the layer and (while drawing) the live line.
+class StrokeEngine(object):
+
+    # Motion closer than this (canvas pixels) to the last recorded point is skipped
+    MIN_SPACING = 2
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+        # Canvas coordinates of the stroke being drawn and the line item showing it
+        self.points = []
+        self.live_item = None
+
+        # Transparent image strokes are rasterized into, and its display on the canvas
+        self.layer = None
+        self.display = Display(app.canvas)
+
+    # Replaces the layer with an empty one (called whenever the image is set), only the region
+    # strokes were drawn in being uploaded
+    def create_layer(self, size: (int, int)) -> None:
+        self.layer = Image.new('RGBA', size, (0, 0, 0, 0))
+        self.display.show(self.layer)
+
+    # Draws a finished stroke into the layer (refresh displays the change)
+    def rasterize(self, stroke: Stroke, scale: float) -> None:
+        stroke.render(self.layer, scale)
+
+    # Uploads the given region of the layer to its canvas image (by default the region strokes
+    # have been drawn in)
+    def refresh(self, box: tuple = None) -> None:
+        box = box or self.layer.getbbox()
+
+        if box is not None:
+            self.display.update(box)
+
+    # Adds a point to the stroke being drawn, starting one if needed
+    def add_point(self, x: int, y: int) -> None:
+        canvas = self.app.canvas
+
+        if self.live_item is None:
+            self.points = [(x, y)]
+            self.live_item = canvas.create_line(x, y, x, y, width=self.app.pen_width.get() * 2,
+                                                fill=self.app.drawing_colour, capstyle='round',
+                                                joinstyle='round', smooth=True)
+            return
+
+        last_x, last_y = self.points[-1]
+        if abs(x - last_x) < self.MIN_SPACING and abs(y - last_y) < self.MIN_SPACING:
+            return
+
+        self.points.append((x, y))
+        canvas.coords(self.live_item, *[value for point in self.points for value in point])
+
+    # Ends the stroke being drawn, recording it against the document and moving it into the
+    # layer. Without a document (drawing on nothing) the live line is left on the canvas.
+    def finish(self) -> None:
+        if self.live_item is None:
+            return
+
+        document = self.app.document
+
+        if document is not None and self.layer is not None:
+            scale = document.scale
+            points = smooth([(x / scale, y / scale) for x, y in self.points])
+            stroke = Stroke(self.app.drawing_colour, self.app.pen_width.get() / scale, points)
+
+            document.add_annotation(stroke)
+            self.rasterize(stroke, scale)
+
+            # Only the region around the stroke is uploaded
+            margin = self.app.pen_width.get() + 2
+            xs, ys = [x for x, _ in self.points], [y for _, y in self.points]
+            self.refresh((int(min(xs)) - margin, int(min(ys)) - margin, int(max(xs)) + margin + 1,
+                          int(max(ys)) + margin + 1))
+            self.app.canvas.delete(self.live_item)
+
+        self.live_item = None
+        self.points = []
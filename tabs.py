@@ -0,0 +1,37 @@
+import os
+from tkinter import Frame, Radiobutton, IntVar
+
+import events
+
+
+# Row of tabs along the top of the window, one per open document (see session.py), the tab of
+# the displayed document being selected. Selecting a tab switches to its document.
+class TabBar(object):
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+        self.frame = Frame(app.root)
+        self.frame.place(x=0, y=0, relwidth=1, height=app.TAB_BAR_HEIGHT)
+
+        self.selected = IntVar(value=-1)
+        self.buttons = []
+
+    # Re-creates the tabs from the session's documents (called whenever one is opened, closed
+    # or switched to)
+    def update(self) -> None:
+        for button in self.buttons:
+            button.destroy()
+
+        documents = self.app.session.documents
+        self.buttons = []
+
+        for index, document in enumerate(documents):
+            title = os.path.basename(document.project_path or document.file_path)
+            button = Radiobutton(self.frame, text=title, indicatoron=False, variable=self.selected, value=index, padx=8,
+                                 command=lambda document=document: events.switch_document(self.app, document))
+            button.pack(side='left', fill='y')
+            self.buttons.append(button)
+
+        self.selected.set(documents.index(self.app.document) if self.app.document in documents else -1)
+        self.frame.lift()
@@ -0,0 +1,377 @@
+import hashlib
+import os
+import queue
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from tkinter import Toplevel, Canvas, Frame, Label
+from tkinter import ttk
+
+from PIL import Image, ImageTk
+
+# Longest side of the thumbnails in pixels
+THUMBNAIL_SIZE = 160
+
+# Directory thumbnails are kept in between runs
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser('~'), '.image_editor', 'thumbnails')
+
+
+def make_thumbnail(path: str, size: int = THUMBNAIL_SIZE) -> Image:
+    """
+    Decodes a reduced copy of an image. JPEGs are decoded at the smallest scale their codec
+    supports that is no smaller than the thumbnail (decoding only a fraction of the data), other
+    formats being reduced by whole factors before the final resample.
+    :param path: (str) Path of the image.
+    :param size: (int) Longest side of the thumbnail.
+    :return: (PIL.Image) The thumbnail, in RGB or RGBA.
+    """
+    with Image.open(path) as image:
+        image.draft(None, (size, size))
+        image.thumbnail((size, size), reducing_gap=2.0)
+
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+
+        image.load()
+
+    return image
+
+
+# Thumbnails of image files, generated once and written to a directory where they persist
+# between runs (as small JPEGs, or PNGs for those with transparency), the oldest being removed
+# when over a byte budget. Each is keyed by the file's path, modification time and size, so a
+# changed file gets a new thumbnail. The most recently used are also kept in memory. Shared
+# between threads.
+class ThumbnailCache(object):
+
+    def __init__(self, directory: str = DEFAULT_DIRECTORY, size: int = THUMBNAIL_SIZE,
+                 disk_budget: int = 256 * 1024 * 1024, memory_entries: int = 512) -> None:
+        self.directory = directory
+        self.size = size
+        self.disk_budget = disk_budget
+        self.memory_entries = memory_entries
+
+        self.entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Thumbnails found in memory, found on disk and generated
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        # Files on disk (their names by key), oldest first, with their total size
+        self._files = OrderedDict()
+        self._disk_bytes = 0
+
+        os.makedirs(directory, exist_ok=True)
+        paths = [entry for entry in os.scandir(directory) if entry.name.endswith(('.jpg', '.png'))]
+
+        for entry in sorted(paths, key=lambda entry: entry.stat().st_mtime):
+            self._files[entry.name[:-4]] = (entry.name, entry.stat().st_size)
+            self._disk_bytes += entry.stat().st_size
+
+    # Identifies the thumbnail of a file as it is now
+    def key(self, path: str) -> str:
+        stat = os.stat(path)
+        description = f'{os.path.abspath(path)} {stat.st_mtime_ns} {stat.st_size} {self.size}'
+
+        return hashlib.blake2b(description.encode(), digest_size=16).hexdigest()
+
+    # Returns the thumbnail of a file if it has been generated, otherwise None
+    def find(self, path: str):
+        key = self.key(path)
+
+        with self._lock:
+            image = self.entries.get(key)
+
+            if image is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return image
+
+            name = self._files.get(key, (None,))[0]
+
+        if name is None:
+            return None
+
+        image = self._read(key, name)
+
+        if image is not None:
+            self.disk_hits += 1
+            self._store(key, image)
+
+        return image
+
+    # Returns the thumbnail of a file, generating it (and writing it to disk) if needed
+    def get(self, path: str):
+        image = self.find(path)
+
+        if image is None:
+            key = self.key(path)
+            image = make_thumbnail(path, self.size)
+            self.misses += 1
+            self._store(key, image)
+            self._write(key, image)
+
+        return image
+
+    def _store(self, key: str, image) -> None:
+        with self._lock:
+            self.entries[key] = image
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.memory_entries:
+                self.entries.popitem(last=False)
+
+    # Writes a thumbnail to disk then removes the oldest while over the disk budget
+    def _write(self, key: str, image) -> None:
+        name = key + ('.png' if image.mode == 'RGBA' else '.jpg')
+        handle, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+
+        try:
+            with os.fdopen(handle, 'wb') as file:
+                image.save(file, 'PNG' if image.mode == 'RGBA' else 'JPEG', quality=85)
+
+            os.replace(temp_path, os.path.join(self.directory, name))
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+
+        with self._lock:
+            size = os.path.getsize(os.path.join(self.directory, name))
+            self._disk_bytes -= self._files.pop(key, (None, 0))[1]
+            self._files[key] = (name, size)
+            self._disk_bytes += size
+
+            removed = []
+            while self._disk_bytes > self.disk_budget and len(self._files) > 1:
+                _, (old_name, old_size) = self._files.popitem(last=False)
+                self._disk_bytes -= old_size
+                removed.append(old_name)
+
+        for old_name in removed:
+            try:
+                os.remove(os.path.join(self.directory, old_name))
+            except OSError:
+                pass
+
+    # Reads a thumbnail from disk, None if it can't be read (such as when removed meanwhile)
+    def _read(self, key: str, name: str):
+        path = os.path.join(self.directory, name)
+
+        try:
+            with Image.open(path) as image:
+                image.load()
+
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self._disk_bytes -= self._files.pop(key, (None, 0))[1]
+            return None
+
+        with self._lock:
+            if key in self._files:
+                self._files.move_to_end(key)
+
+        return image
+
+
+# Window showing the images of a folder as a scrolling grid of thumbnails. Only the cells in
+# sight (and a row either side) are placed on the canvas, so a folder of thousands of images
+# costs no more to show than a screenful. Thumbnails not yet cached are generated on a pool of
+# threads, those scrolled out of sight before their turn being cancelled, and are handed back to
+# the main thread by polling. Clicking a thumbnail opens the image.
+class ThumbnailBrowser(object):
+
+    # Size of each cell (the thumbnail with its file name beneath, spaced from its neighbours)
+    CELL_WIDTH = THUMBNAIL_SIZE + 20
+    CELL_HEIGHT = THUMBNAIL_SIZE + 36
+
+    # Extra rows placed above and below those in sight so small scrolls are already drawn
+    MARGIN = 1
+
+    # Milliseconds between checks for generated thumbnails
+    POLL_INTERVAL = 50
+
+    def __init__(self, app, paths: list, thumbnail_cache: ThumbnailCache, title: str = 'Browse',
+                 on_open=None, workers: int = 4) -> None:
+        self.app = app
+        self.paths = paths
+        self.thumbnail_cache = thumbnail_cache
+        self.on_open = on_open
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image_editor_thumbnail')
+
+        # Canvas items and photo images of the cells placed by index, thumbnails being generated
+        # by index and those generated waiting to be shown
+        self.items = {}
+        self.photos = {}
+        self.pending = {}
+        self.done = queue.Queue()
+        self.columns = 1
+        self._redraw_id = None
+        self._poll_id = None
+
+        self.window = Toplevel(app.root)
+        self.window.title(f'{title} ({len(paths)} images)')
+        self.window.geometry('960x640')
+
+        frame = Frame(self.window)
+        frame.pack(fill='both', expand=True)
+
+        self.canvas = Canvas(frame, background='grey20', highlightthickness=0)
+        scrollbar = ttk.Scrollbar(frame, orient='vertical', command=self.scroll)
+        self.canvas.configure(yscrollcommand=scrollbar.set)
+
+        scrollbar.pack(side='right', fill='y')
+        self.canvas.pack(side='left', fill='both', expand=True)
+
+        if not paths:
+            Label(self.canvas, text='No images found.', bg='grey20', fg='white').place(relx=0.5, rely=0.5,
+                                                                                        anchor='center')
+
+        self.canvas.bind('<Configure>', lambda event: self.layout())
+        self.canvas.bind('<MouseWheel>', lambda event: self.scroll('scroll', -1 if event.delta > 0 else 1, 'units'))
+        self.canvas.bind('<Button-4>', lambda event: self.scroll('scroll', -1, 'units'))
+        self.canvas.bind('<Button-5>', lambda event: self.scroll('scroll', 1, 'units'))
+        self.canvas.bind('<Button-1>', self.click)
+        self.window.protocol('WM_DELETE_WINDOW', self.close)
+
+    # Scrolls the canvas (as the scrollbar does), drawing the cells brought into sight
+    def scroll(self, *args) -> None:
+        self.canvas.yview(*args)
+        self.schedule_redraw()
+
+    # Fits as many columns as the width allows, the scroll region covering every row
+    def layout(self) -> None:
+        columns = max(1, self.canvas.winfo_width() // self.CELL_WIDTH)
+        rows = -(-len(self.paths) // columns)
+
+        self.canvas.configure(scrollregion=(0, 0, columns * self.CELL_WIDTH, rows * self.CELL_HEIGHT),
+                              yscrollincrement=self.CELL_HEIGHT // 4)
+
+        if columns != self.columns:
+            self.columns = columns
+            self._clear_items()
+
+        self.schedule_redraw()
+
+    # Redraws once pending events (further scrolling or resizing) have been handled
+    def schedule_redraw(self) -> None:
+        if self._redraw_id is None:
+            self._redraw_id = self.window.after_idle(self.redraw)
+
+    # Places the cells in sight, removing those that are not and cancelling their thumbnails
+    def redraw(self) -> None:
+        self._redraw_id = None
+
+        top = self.canvas.canvasy(0)
+        first = max(0, int(top // self.CELL_HEIGHT) - self.MARGIN)
+        last = int((top + self.canvas.winfo_height()) // self.CELL_HEIGHT) + self.MARGIN
+        visible = set(range(first * self.columns, min((last + 1) * self.columns, len(self.paths))))
+
+        for index in list(self.items):
+            if index not in visible:
+                for item in self.items.pop(index):
+                    self.canvas.delete(item)
+                self.photos.pop(index, None)
+
+        for index in list(self.pending):
+            if index not in visible and self.pending[index].cancel():
+                del self.pending[index]
+
+        for index in sorted(visible - set(self.items)):
+            self._place(index)
+
+    # Places a cell, with its thumbnail if already generated, otherwise generating it
+    def _place(self, index: int) -> None:
+        row, column = divmod(index, self.columns)
+        x = column * self.CELL_WIDTH + self.CELL_WIDTH // 2
+        y = row * self.CELL_HEIGHT + 10 + THUMBNAIL_SIZE // 2
+        name = os.path.basename(self.paths[index])
+
+        frame = self.canvas.create_rectangle(x - THUMBNAIL_SIZE // 2, y - THUMBNAIL_SIZE // 2, x + THUMBNAIL_SIZE // 2,
+                                             y + THUMBNAIL_SIZE // 2, outline='grey35')
+        label = self.canvas.create_text(x, y + THUMBNAIL_SIZE // 2 + 12, fill='white', width=self.CELL_WIDTH - 8,
+                                        text=name if len(name) <= 24 else name[:21] + '...')
+        self.items[index] = [frame, label]
+
+        try:
+            thumbnail = self.thumbnail_cache.find(self.paths[index])
+        except OSError:
+            return
+
+        if thumbnail is not None:
+            self._show(index, thumbnail)
+        elif index not in self.pending:
+            self.pending[index] = self.pool.submit(self._generate, index)
+            self._schedule_poll()
+
+    # Run on a worker thread, the result being picked up by poll. Whatever goes wrong (such as a
+    # decompression bomb) the index is handed back, so the cell isn't waited on forever.
+    def _generate(self, index: int) -> None:
+        try:
+            thumbnail = self.thumbnail_cache.get(self.paths[index])
+        except Exception:
+            thumbnail = None
+
+        self.done.put((index, thumbnail))
+
+    def _show(self, index: int, thumbnail) -> None:
+        row, column = divmod(index, self.columns)
+        x = column * self.CELL_WIDTH + self.CELL_WIDTH // 2
+        y = row * self.CELL_HEIGHT + 10 + THUMBNAIL_SIZE // 2
+
+        self.photos[index] = ImageTk.PhotoImage(thumbnail)
+        self.items[index].append(self.canvas.create_image(x, y, image=self.photos[index]))
+
+    def _schedule_poll(self) -> None:
+        if self._poll_id is None:
+            self._poll_id = self.window.after(self.POLL_INTERVAL, self.poll)
+
+    # Shows the thumbnails generated since the last poll (if their cells are still in sight)
+    def poll(self) -> None:
+        self._poll_id = None
+
+        while not self.done.empty():
+            index, thumbnail = self.done.get()
+            self.pending.pop(index, None)
+
+            if thumbnail is not None and index in self.items and index not in self.photos:
+                self._show(index, thumbnail)
+
+        if self.pending:
+            self._schedule_poll()
+
+    # Index of the image under a point of the window, None if there isn't one
+    def index_at(self, x: int, y: int) -> int:
+        column = int(self.canvas.canvasx(x) // self.CELL_WIDTH)
+        index = int(self.canvas.canvasy(y) // self.CELL_HEIGHT) * self.columns + column
+
+        if column >= self.columns or not 0 <= index < len(self.paths):
+            return None
+
+        return index
+
+    def click(self, event) -> None:
+        index = self.index_at(event.x, event.y)
+
+        if index is not None and self.on_open is not None:
+            self.on_open(self.paths[index])
+
+    def _clear_items(self) -> None:
+        self.canvas.delete('all')
+        self.items.clear()
+        self.photos.clear()
+
+    def close(self) -> None:
+        for callback_id in (self._redraw_id, self._poll_id):
+            if callback_id is not None:
+                self.window.after_cancel(callback_id)
+
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.window.destroy()
+
+        if getattr(self.app, 'browser', None) is self:
+            self.app.browser = None
@@ -0,0 +1,409 @@
+import math
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+from contextlib import ExitStack
+
+from PIL import Image
+
+import encoder
+from pipeline import Geometry, Pipeline
+
+# Pixels beyond each side of a tile needed by the convolution filters (half their kernel size)
+HALO = {'blur': 2, 'sharpen': 1, 'emboss': 1}
+
+# Extensions of the formats that can be read lazily and written as a stream
+NETPBM_EXTENSIONS = ('.pgm', '.ppm', '.pam', '.pnm')
+STREAMED_EXTENSIONS = NETPBM_EXTENSIONS + ('.png',)
+
+
+# An image held in memory (or opened with PIL, which decodes the whole image on first read)
+class ImageSource(object):
+
+    def __init__(self, image) -> None:
+        # Tiles are produced in the modes the sinks support
+        if image.mode not in ('L', 'RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+        self.image = image
+        self.size = image.size
+        self.mode = image.mode
+
+    def read(self, box: tuple):
+        return self.image.crop(box)
+
+    def close(self) -> None:
+        pass
+
+
+# A binary PGM/PPM/PAM file memory-mapped so only the rows of each tile read are paged in
+class NetpbmSource(object):
+
+    def __init__(self, path: str) -> None:
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.size, self.mode, self._offset = _read_netpbm_header(self._map)
+        self._bands = len(self.mode)
+
+    def read(self, box: tuple):
+        x, y, x2, y2 = box
+        row_length = self.size[0] * self._bands
+        start, end = x * self._bands, x2 * self._bands
+
+        rows = [self._map[self._offset + row * row_length + start:self._offset + row * row_length + end]
+                for row in range(y, y2)]
+
+        return Image.frombytes(self.mode, (x2 - x, y2 - y), b''.join(rows))
+
+    def close(self) -> None:
+        self._map.close()
+        self._file.close()
+
+
+def _read_netpbm_header(data) -> ((int, int), str, int):
+    """
+    Parses the header of a binary PGM (P5), PPM (P6) or PAM (P7) file with 8 bit samples.
+    :param data: (mmap) The file contents.
+    :return: Tuple((int, int), str, int) width and height, PIL mode and offset of the pixel data.
+    """
+    magic = bytes(data[:2])
+
+    if magic == b'P7':
+        end = data.find(b'ENDHDR\n')
+        fields = dict(line.split(None, 1) for line in bytes(data[3:end]).decode('ascii').splitlines()
+                      if line and not line.startswith('#'))
+        depth, maxval = int(fields['DEPTH']), int(fields['MAXVAL'])
+        if maxval != 255 or depth not in (1, 3, 4):
+            raise ValueError('Only 8 bit greyscale, RGB or RGBA PAM files are supported.')
+
+        size = (int(fields['WIDTH']), int(fields['HEIGHT']))
+        return size, {1: 'L', 3: 'RGB', 4: 'RGBA'}[depth], end + len(b'ENDHDR\n')
+
+    if magic not in (b'P5', b'P6'):
+        raise ValueError('Only binary PGM, PPM and PAM files are supported.')
+
+    # Width, height and maxval follow the magic number separated by whitespace (or comments)
+    values, position = [], 2
+    while len(values) < 3:
+        while data[position:position + 1].isspace():
+            position += 1
+        if data[position:position + 1] == b'#':
+            position = data.find(b'\n', position) + 1
+            continue
+
+        start = position
+        while not data[position:position + 1].isspace():
+            position += 1
+        values.append(int(data[start:position]))
+
+    if values[2] != 255:
+        raise ValueError('Only 8 bit PGM and PPM files are supported.')
+
+    return (values[0], values[1]), 'L' if magic == b'P5' else 'RGB', position + 1
+
+
+# Collects tiles into an image in memory
+class ImageSink(object):
+
+    def __init__(self, size: (int, int), mode: str) -> None:
+        self.size = size
+        self.mode = mode
+        self.image = Image.new(mode, size)
+
+    def write(self, box: tuple, tile) -> None:
+        self.image.paste(tile, box[:2])
+
+    def close(self) -> None:
+        pass
+
+    # Nothing has been written, so there is nothing to remove
+    def abort(self) -> None:
+        pass
+
+
+# Base for sinks writing a file as a stream of rows. Tiles must be written a row of tiles at a
+# time (left to right, top to bottom) so only one band of rows is ever held in memory. Atomic
+# sinks write a temporary file that replaces the path once closed (see encoder.atomic_write),
+# so nothing is left at the path when writing stops part way (see abort).
+class _BandSink(object):
+
+    def __init__(self, path: str, size: (int, int), mode: str, atomic: bool = False) -> None:
+        self.size = size
+        self.mode = mode
+        self._writing = ExitStack()
+        self._file = self._writing.enter_context(encoder.atomic_write(path) if atomic else open(path, 'wb'))
+        self._band = None
+        self._band_top = 0
+
+    def write(self, box: tuple, tile) -> None:
+        x, y, x2, y2 = box
+
+        if self._band is None:
+            self._band = Image.new(self.mode, (self.size[0], y2 - y))
+            self._band_top = y
+
+        self._band.paste(tile, (x, y - self._band_top))
+
+        # The band is complete once its right-most tile has been written
+        if x2 == self.size[0]:
+            self._write_rows(self._band.tobytes())
+            self._band = None
+
+    def _write_rows(self, data: bytes) -> None:
+        self._file.write(data)
+
+    def close(self) -> None:
+        self._writing.close()
+
+    # Closes the file unfinished (removing it when atomic)
+    def abort(self) -> None:
+        error = RuntimeError('Writing stopped')
+        self._writing.__exit__(type(error), error, None)
+
+
+# Streams a binary PGM (greyscale), PPM (RGB) or PAM (RGBA) file
+class NetpbmSink(_BandSink):
+
+    def __init__(self, path: str, size: (int, int), mode: str, atomic: bool = False) -> None:
+        super().__init__(path, size, mode, atomic)
+        width, height = size
+
+        if mode == 'RGBA':
+            header = f'P7\nWIDTH {width}\nHEIGHT {height}\nDEPTH 4\nMAXVAL 255\nTUPLTYPE RGB_ALPHA\nENDHDR\n'
+        else:
+            header = f"{'P5' if mode == 'L' else 'P6'}\n{width} {height}\n255\n"
+
+        self._file.write(header.encode('ascii'))
+
+
+# Streams a PNG file, compressing rows as they arrive
+class PngSink(_BandSink):
+
+    # Bytes of compressed data written per IDAT chunk
+    CHUNK_SIZE = 1 << 16
+
+    def __init__(self, path: str, size: (int, int), mode: str, compress_level: int = 6,
+                 atomic: bool = False) -> None:
+        super().__init__(path, size, mode, atomic)
+        self._compressor = zlib.compressobj(compress_level)
+        self._pending = b''
+        self._row_length = size[0] * len(mode)
+
+        colour_type = {'L': 0, 'RGB': 2, 'RGBA': 6}[mode]
+        self._file.write(b'\x89PNG\r\n\x1a\n')
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', size[0], size[1], 8, colour_type, 0, 0, 0))
+
+    def _chunk(self, kind: bytes, data: bytes) -> None:
+        self._file.write(struct.pack('>I', len(data)) + kind + data)
+        self._file.write(struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+    def _write_rows(self, data: bytes) -> None:
+        # Each row is prefixed with its filter type (0, none)
+        for start in range(0, len(data), self._row_length):
+            self._pending += self._compressor.compress(b'\x00' + data[start:start + self._row_length])
+
+        if len(self._pending) >= self.CHUNK_SIZE:
+            self._chunk(b'IDAT', self._pending)
+            self._pending = b''
+
+    def close(self) -> None:
+        self._chunk(b'IDAT', self._pending + self._compressor.flush())
+        self._chunk(b'IEND', b'')
+        super().close()
+
+
+def open_source(path: str):
+    """
+    Opens an image for tiled processing, memory-mapping formats that allow it.
+    :param path: (str) Path of the image.
+    :return: (NetpbmSource or ImageSource) The opened source.
+    """
+    if path.lower().endswith(NETPBM_EXTENSIONS):
+        return NetpbmSource(path)
+
+    return ImageSource(Image.open(path))
+
+
+def open_sink(path: str, size: (int, int), mode: str):
+    """
+    Opens a sink writing to the given path, streamed for PNG and Netpbm files (other formats
+    are collected in memory and saved when closed, converted where the format needs it, see
+    encoder.encode). Either way the file is written atomically.
+    :param path: (str) Path the image is written to.
+    :param size: Tuple(int, int) width and height of the image.
+    :param mode: (str) Mode of the image.
+    :return: The opened sink.
+    """
+    extension = os.path.splitext(path)[1].lower()
+
+    if extension in NETPBM_EXTENSIONS:
+        return NetpbmSink(path, size, mode, atomic=True)
+    if extension == '.png':
+        return PngSink(path, size, mode, atomic=True)
+
+    sink = ImageSink(size, mode)
+    sink.close = lambda: encoder.encode(sink.image, path)
+
+    return sink
+
+
+def _output_mode(stage, mode: str) -> str:
+    """
+    Gets the mode of a stage's output without processing the image (filters such as grayscale
+    change it).
+    :param stage: (Geometry or Filter) The pipeline stage.
+    :param mode: (str) Mode of the stage's input.
+    :return: (str) Mode of the stage's output.
+    """
+    if isinstance(stage, Geometry):
+        return mode
+
+    return stage.render(Image.new(mode, (1, 1))).mode
+
+
+def _halo(stage) -> int:
+    """
+    Gets the distance around a tile a filter reads from.
+    :param stage: (Filter) The filter stage.
+    :return: (int) The distance in pixels.
+    """
+    if stage.name == 'gaussian_blur':
+        # PIL approximates the Gaussian with three box blurs spanning a little over 3 radii
+        return math.ceil(stage.args[0] * 3) + 2
+    if stage.name == 'convolve':
+        return stage.args[0] // 2
+
+    return HALO.get(stage.name, 0)
+
+
+def _filter_tile(source, stage, box: tuple):
+    """
+    Filters a single tile, reading enough of the source around it (the halo) for the filter's
+    kernel so the tile matches the same part of the whole image filtered.
+    :param source: The source being processed.
+    :param stage: (Filter) The filter stage.
+    :param box: (tuple) The tile within the output.
+    :return: (PIL.Image) The filtered tile.
+    """
+    halo = _halo(stage)
+    x, y, x2, y2 = box
+    region = (max(x - halo, 0), max(y - halo, 0),
+              min(x2 + halo, source.size[0]), min(y2 + halo, source.size[1]))
+
+    tile = stage.render(source.read(region))
+
+    return tile.crop((x - region[0], y - region[1], x2 - region[0], y2 - region[1]))
+
+
+def _geometry_tile(source, stage, box: tuple):
+    """
+    Resamples a single tile from the part of the source it maps to, reading a margin around
+    it for the resampling filter's support, then orients it.
+    :param source: The source being processed.
+    :param stage: (Geometry) The geometry stage.
+    :param box: (tuple) The tile within the output.
+    :return: (PIL.Image) The resampled tile.
+    """
+    (x, y, x2, y2), size = stage.source_region(box)
+
+    # Bicubic support is 2 pixels, widened by the reduction factor when shrinking
+    margin = math.ceil(2 * max(1, (x2 - x) / max(size[0], 1), (y2 - y) / max(size[1], 1))) + 1
+    region = (max(math.floor(x) - margin, 0), max(math.floor(y) - margin, 0),
+              min(math.ceil(x2) + margin, source.size[0]), min(math.ceil(y2) + margin, source.size[1]))
+
+    tile = source.read(region).resize(size, box=(x - region[0], y - region[1], x2 - region[0], y2 - region[1]))
+
+    return tile if stage.transpose is None else tile.transpose(stage.transpose)
+
+
+def process_stage(source, sink, stage, tile_size: int = 512, progress=None) -> None:
+    """
+    Applies a pipeline stage to the source a tile at a time, writing each tile to the sink
+    (a row of tiles at a time, top to bottom) so memory use depends on the tile size rather
+    than the image size.
+    :param source: The source being processed (see open_source).
+    :param sink: The sink the output is written to (see open_sink).
+    :param stage: (Geometry or Filter) The pipeline stage to apply.
+    :param tile_size: (int) Width and height of each tile.
+    :param progress: (function) Called with the fraction of tiles completed.
+    """
+    width, height = sink.size
+    boxes = [(x, y, min(x + tile_size, width), min(y + tile_size, height))
+             for y in range(0, height, tile_size)
+             for x in range(0, width, tile_size)]
+
+    for index, box in enumerate(boxes):
+        if isinstance(stage, Geometry):
+            tile = _geometry_tile(source, stage, box)
+        else:
+            tile = _filter_tile(source, stage, box)
+
+        sink.write(box, tile)
+
+        if progress is not None:
+            progress((index + 1) / len(boxes))
+
+
+def run(input_path: str, output_path: str, steps: list, tile_size: int = 512,
+        temp_dir: str = None, progress=None) -> (int, int):
+    """
+    Applies operations to an image file tile by tile. Geometry operations are fused as in the
+    pipeline, each stage being streamed to a temporary (memory-mapped) file read by the next.
+    :param input_path: (str) Path of the image.
+    :param output_path: (str) Path the result is written to.
+    :param steps: (list) (name, args) of each operation in order.
+    :param tile_size: (int) Width and height of each tile.
+    :param temp_dir: (str) Directory for the intermediate files (the system's if not given).
+    :param progress: (function) Called with the fraction of the work completed.
+    :return: Tuple(int, int) width and height of the result.
+    """
+    source = open_source(input_path)
+    pipeline = Pipeline(source.size)
+    for name, args in steps:
+        pipeline.append(name, *args)
+
+    stages = pipeline.stages()
+    size = source.size
+    temp_paths = []
+    sink = None
+
+    try:
+        # A copy is made when there is nothing to apply
+        if not stages:
+            stages = [Geometry(source.size)]
+
+        for index, stage in enumerate(stages):
+            size = stage.size if isinstance(stage, Geometry) else size
+            mode = _output_mode(stage, source.mode)
+
+            if index == len(stages) - 1:
+                sink = open_sink(output_path, size, mode)
+            else:
+                handle, path = tempfile.mkstemp(suffix='.pam', dir=temp_dir)
+                os.close(handle)
+                temp_paths.append(path)
+                sink = NetpbmSink(path, size, mode)
+
+            stage_progress = None
+            if progress is not None:
+                stage_progress = lambda fraction, index=index: progress((index + fraction) / len(stages))
+
+            process_stage(source, sink, stage, tile_size, stage_progress)
+            sink.close()
+            sink = None
+            source.close()
+
+            # The stage's output is the next stage's source
+            source = NetpbmSource(temp_paths[-1]) if index < len(stages) - 1 else None
+    finally:
+        # A stage that failed leaves its output unfinished, none of it being kept
+        if sink is not None:
+            sink.abort()
+        if source is not None:
+            source.close()
+        for path in temp_paths:
+            os.remove(path)
+
+    return size
@@ -0,0 +1,265 @@
+import math
+from collections import OrderedDict
+from tkinter import Toplevel, Canvas
+
+from PIL import Image, ImageTk
+
+
+# Copies of an image at successively halved resolutions (a mipmap pyramid), level 0 being the
+# image itself. Any zoom is drawn from the level at most twice its size, so zoomed out views
+# never resample more pixels than they show.
+class Pyramid(object):
+
+    # Levels stop once the image fits within this many pixels on its longest side
+    MIN_SIZE = 256
+
+    def __init__(self, image, progress=None) -> None:
+        if image.mode not in ('RGB', 'RGBA', 'L'):
+            image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+        self.levels = [image]
+
+        count = max(1, math.ceil(math.log2(max(image.size) / self.MIN_SIZE)) + 1)
+        while max(image.size) > self.MIN_SIZE:
+            if progress is not None:
+                progress(len(self.levels) / count)
+
+            image = image.reduce(2)
+            self.levels.append(image)
+
+    @property
+    def size(self) -> (int, int):
+        return self.levels[0].size
+
+    # Index of the level to draw the given zoom (display pixels per image pixel) from
+    def level_for(self, zoom: float) -> int:
+        if zoom >= 1:
+            return 0
+
+        return min(int(math.log2(1 / zoom)), len(self.levels) - 1)
+
+
+# Least recently used store of rendered tiles, bounded by the number of tiles held
+class TileCache(object):
+
+    def __init__(self, capacity: int = 512) -> None:
+        self.capacity = capacity
+        self.tiles = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    # Returns the tile stored under the key (marking it as recently used), otherwise None
+    def get(self, key):
+        tile = self.tiles.get(key)
+
+        if tile is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.tiles.move_to_end(key)
+
+        return tile
+
+    # Stores a tile, returning the keys of any tiles evicted to make room for it
+    def put(self, key, tile) -> list:
+        self.tiles[key] = tile
+        self.tiles.move_to_end(key)
+
+        evicted = []
+        while len(self.tiles) > self.capacity:
+            evicted.append(self.tiles.popitem(last=False)[0])
+
+        return evicted
+
+    def clear(self) -> None:
+        self.tiles.clear()
+
+
+# Window showing the document at any zoom, panned by dragging with the left mouse button and
+# zoomed around the cursor with the mouse wheel (double-click fits the whole image). The view is
+# made of fixed size tiles, only those in sight being placed on the canvas; each is rendered
+# once from the nearest pyramid level and kept in the tile cache, so panning reuses tiles
+# already drawn and returning to a zoom level costs nothing.
+class Viewport(object):
+
+    # Size of the tiles in display pixels
+    TILE_SIZE = 256
+
+    # Each wheel step zooms by this factor, the maximum being 16 display pixels per image pixel
+    ZOOM_STEP = 2 ** 0.25
+    MAX_ZOOM = 16
+
+    # Extra tiles rendered around the visible ones so small pans are already drawn
+    MARGIN = 1
+
+    def __init__(self, app, pyramid: Pyramid, title: str = 'Zoom view') -> None:
+        self.app = app
+        self.pyramid = pyramid
+        self.cache = TileCache()
+
+        self.window = Toplevel(app.root)
+        self.window.title(title)
+        self.window.geometry('900x650')
+
+        self.canvas = Canvas(self.window, background='grey20', highlightthickness=0)
+        self.canvas.pack(fill='both', expand=True)
+
+        # Zoom as a whole number of steps from 1:1 (so tiles are cached per step), canvas
+        # items of the tiles placed and the pending redraw callback
+        self.zoom_index = 0
+        self.items = {}
+        self._redraw_id = None
+
+        self.canvas.bind('<ButtonPress-1>', lambda event: self.canvas.scan_mark(event.x, event.y))
+        self.canvas.bind('<B1-Motion>', self.pan)
+        self.canvas.bind('<Double-Button-1>', lambda event: self.fit())
+        self.canvas.bind('<MouseWheel>', lambda event: self.zoom_by(1 if event.delta > 0 else -1, event.x, event.y))
+        self.canvas.bind('<Button-4>', lambda event: self.zoom_by(1, event.x, event.y))
+        self.canvas.bind('<Button-5>', lambda event: self.zoom_by(-1, event.x, event.y))
+        self.canvas.bind('<Configure>', lambda event: self.schedule_redraw())
+        self.window.protocol('WM_DELETE_WINDOW', self.close)
+
+        self.window.update_idletasks()
+        self.fit()
+
+    # Display pixels per image pixel
+    @property
+    def zoom(self) -> float:
+        return self.ZOOM_STEP ** self.zoom_index
+
+    # Displays a new image (such as the document after further edits) keeping the zoom
+    def show(self, pyramid: Pyramid) -> None:
+        self.pyramid = pyramid
+        self.cache.clear()
+        self._clear_items()
+        self._set_scroll_region()
+        self.schedule_redraw()
+        self.window.lift()
+
+    # Zooms so the whole image fits the window
+    def fit(self) -> None:
+        width, height = self.pyramid.size
+        fit = min(max(self.canvas.winfo_width(), 1) / width, max(self.canvas.winfo_height(), 1) / height, 1)
+
+        self._set_zoom(math.floor(math.log(fit, self.ZOOM_STEP)))
+        self.canvas.xview_moveto(0)
+        self.canvas.yview_moveto(0)
+
+    # Zooms in (steps > 0) or out by a number of steps, keeping the image point under the
+    # cursor in place
+    def zoom_by(self, steps: int, x: int, y: int) -> None:
+        width, height = self.pyramid.size
+        minimum = math.floor(math.log(min(self.TILE_SIZE / max(width, height), 1), self.ZOOM_STEP))
+        maximum = round(math.log(self.MAX_ZOOM, self.ZOOM_STEP))
+        index = min(max(self.zoom_index + steps, minimum), maximum)
+
+        if index == self.zoom_index:
+            return
+
+        image_x = self.canvas.canvasx(x) / self.zoom
+        image_y = self.canvas.canvasy(y) / self.zoom
+
+        self._set_zoom(index)
+
+        left, top, right, bottom = self._scroll_region
+        self.canvas.xview_moveto((image_x * self.zoom - x - left) / (right - left))
+        self.canvas.yview_moveto((image_y * self.zoom - y - top) / (bottom - top))
+
+    def pan(self, event) -> None:
+        self.canvas.scan_dragto(event.x, event.y, gain=1)
+        self.schedule_redraw()
+
+    def _set_zoom(self, index: int) -> None:
+        self.zoom_index = index
+        self._clear_items()
+        self._set_scroll_region()
+        self.schedule_redraw()
+
+    # Scrolling is limited to the zoomed image, which is centred when smaller than the window
+    def _set_scroll_region(self) -> None:
+        width, height = self._zoomed_size()
+        canvas_width, canvas_height = self.canvas.winfo_width(), self.canvas.winfo_height()
+
+        left = min(0, (width - canvas_width) / 2)
+        top = min(0, (height - canvas_height) / 2)
+        self._scroll_region = (left, top, left + max(width, canvas_width), top + max(height, canvas_height))
+
+        self.canvas.config(scrollregion=self._scroll_region)
+
+    def _zoomed_size(self) -> (int, int):
+        width, height = self.pyramid.size
+
+        return max(1, round(width * self.zoom)), max(1, round(height * self.zoom))
+
+    # Redraws once pending events (further motion or wheel steps) have been handled
+    def schedule_redraw(self) -> None:
+        if self._redraw_id is None:
+            self._redraw_id = self.window.after_idle(self.redraw)
+
+    # Places the tiles in sight (and the margin around them), removing those that are not
+    def redraw(self) -> None:
+        self._redraw_id = None
+        self._set_scroll_region()
+
+        width, height = self._zoomed_size()
+        columns = math.ceil(width / self.TILE_SIZE)
+        rows = math.ceil(height / self.TILE_SIZE)
+
+        left = int(self.canvas.canvasx(0) // self.TILE_SIZE) - self.MARGIN
+        top = int(self.canvas.canvasy(0) // self.TILE_SIZE) - self.MARGIN
+        right = int(self.canvas.canvasx(self.canvas.winfo_width()) // self.TILE_SIZE) + self.MARGIN
+        bottom = int(self.canvas.canvasy(self.canvas.winfo_height()) // self.TILE_SIZE) + self.MARGIN
+
+        visible = {(column, row)
+                   for column in range(max(left, 0), min(right, columns - 1) + 1)
+                   for row in range(max(top, 0), min(bottom, rows - 1) + 1)}
+
+        for position in [position for position in self.items if position not in visible]:
+            self.canvas.delete(self.items.pop(position))
+
+        for column, row in visible:
+            key = (self.zoom_index, column, row)
+            tile = self.cache.get(key)
+
+            if tile is None:
+                tile = ImageTk.PhotoImage(self._render_tile(column, row))
+
+                # A tile's photo image is released once evicted so its item is removed too
+                for zoom_index, *position in self.cache.put(key, tile):
+                    if zoom_index == self.zoom_index and tuple(position) in self.items:
+                        self.canvas.delete(self.items.pop(tuple(position)))
+
+            if (column, row) not in self.items:
+                self.items[(column, row)] = self.canvas.create_image(
+                    column * self.TILE_SIZE, row * self.TILE_SIZE, image=tile, anchor='nw')
+
+    # Renders a tile from the pyramid level nearest (and no smaller than) the zoom
+    def _render_tile(self, column: int, row: int):
+        zoom = self.zoom
+        level = self.pyramid.level_for(zoom)
+        image = self.pyramid.levels[level]
+
+        # Display pixels per pixel of the level (between 0.5 and 1 unless zoomed in past 1:1)
+        scale = zoom * 2 ** level
+        width, height = self._zoomed_size()
+
+        x, y = column * self.TILE_SIZE, row * self.TILE_SIZE
+        x2, y2 = min(x + self.TILE_SIZE, width), min(y + self.TILE_SIZE, height)
+        box = (x / scale, y / scale, min(x2 / scale, image.width), min(y2 / scale, image.height))
+
+        # Pixels are shown as blocks when zoomed in so detail can be inspected
+        resample = Image.Resampling.NEAREST if scale > 1 else Image.Resampling.BILINEAR
+
+        return image.resize((x2 - x, y2 - y), resample, box)
+
+    def _clear_items(self) -> None:
+        self.canvas.delete('all')
+        self.items.clear()
+
+    def close(self) -> None:
+        self.cache.clear()
+        self.window.destroy()
+
+        if self.app.viewport is self:
+            self.app.viewport = None
@@ -1,9 +1,16 @@
-from tkinter import Menu, Canvas, Event, Tk, IntVar
+from tkinter import Menu, Canvas, Event, Tk, IntVar, BooleanVar, StringVar
+import encoder
 import events
 from crop import Crop
+from display import Display
 from draw_line import Line
 from draw_oval import Oval
 from draw_square import Square
+from cache import ResultCache
+from jobs import JobExecutor
+from session import Session
+from stroke import StrokeEngine
+from tabs import TabBar
 
 
 class Window(object):
@@ -12,6 +19,21 @@ class Window(object):
         # Store for the current image and its file path
         self.opened_file_path = None
         self.opened_image = None
+        # Full resolution document the displayed image (opened_image) is a proxy of
+        self.document = None
+        # Zoom view of the document (see viewport.py) while open
+        self.viewport = None
+        # Results of operations shared by every document opened, so re-applying an operation
+        # (such as switching back and forth between filters with undo) isn't computed again
+        self.result_cache = ResultCache()
+        # Documents open in tabs, the displayed one being the document above
+        self.session = Session()
+        # Window searching the photo library index (see library.py) while open
+        self.library = None
+        # Thumbnail browser (see thumbnails.py) while open, and the thumbnails kept on disk
+        # (created when first browsing)
+        self.browser = None
+        self.thumbnail_cache = None
 
         # Used to track mouse positions when needed
         self.mouse = {"x": 0, "y": 0}
@@ -20,16 +42,20 @@ class Window(object):
 
         # State variables
         self.drawing_state = False
-        self.animation_state = None
         self.drawing_colour = "red"
         self.line_colour = "black"
 
         # Index of the 'State' item on the menu bar
-        self.STATE_MENU_ITEM_INDEX = 7
+        self.STATE_MENU_ITEM_INDEX = 8
+
+        # Height of the row of tabs above the canvas
+        self.TAB_BAR_HEIGHT = 26
 
         # Allows tracking or resizing events
         self.current_width = 1300
         self.current_height = 721
+        # Pending callback moving the canvas after the window is resized
+        self.resize_frame = None
 
         # Window initialisation
         self.root = Tk()
@@ -41,6 +67,20 @@ class Window(object):
         self.line_width = IntVar(value=2)
         self.available_pen_widths = ["1", "2", "3", "5", "10", "15"]
 
+        # Settings images are saved with in each format (see encoder.py)
+        self.save_options = {
+            'PNG': {'compress_level': IntVar(value=encoder.OPTIONS['PNG']['compress_level']),
+                    'strategy': StringVar(value=encoder.OPTIONS['PNG']['strategy'])},
+            'JPEG': {'quality': IntVar(value=encoder.OPTIONS['JPEG']['quality']),
+                     'progressive': BooleanVar(value=encoder.OPTIONS['JPEG']['progressive']),
+                     'optimize': BooleanVar(value=encoder.OPTIONS['JPEG']['optimize'])},
+            'WEBP': {'lossless': BooleanVar(value=encoder.OPTIONS['WEBP']['lossless']),
+                     'quality': IntVar(value=encoder.OPTIONS['WEBP']['quality'])},
+        }
+        self.available_qualities = [50, 60, 70, 75, 80, 85, 90, 95, 100]
+        # Whether the frames of animations and multi-page files are rendered on a process pool
+        self.parallel_frames = BooleanVar(value=False)
+
         # Menu Toolbar
         self.menu_bar = Menu(self.root)
         self.root.config(menu=self.menu_bar)
@@ -50,13 +90,62 @@ class Window(object):
         self.file_menu = Menu(self.menu_bar, tearoff=0)
         self.menu_bar.add_cascade(label='File', menu=self.file_menu)
         self.file_menu.add_command(label='Open', command=lambda: events.open_picture(self))
+        self.file_menu.add_command(label='Browse folder...', command=lambda: events.browse_folder(self))
         self.file_menu.add_command(label='Save', command=lambda: events.save_picture(self)
                                    if self.opened_image else events.no_image_error())
         self.file_menu.add_command(label='Save as...', command=lambda: events.save_picture_as(self)
                                    if self.opened_image else events.no_image_error())
+        self.save_options_menu = Menu(self.file_menu, tearoff=0)
+        self.file_menu.add_cascade(label='Save options', menu=self.save_options_menu)
+        self.png_level_menu = Menu(self.save_options_menu, tearoff=0)
+        self.save_options_menu.add_cascade(label='PNG compression level', menu=self.png_level_menu)
+
+        for level in range(10):
+            self.png_level_menu.add_radiobutton(label=f"{level}{' (fastest)' if level == 0 else ''}"
+                                                      f"{' (smallest)' if level == 9 else ''}",
+                                                variable=self.save_options['PNG']['compress_level'], value=level)
+
+        self.png_strategy_menu = Menu(self.save_options_menu, tearoff=0)
+        self.save_options_menu.add_cascade(label='PNG compression strategy', menu=self.png_strategy_menu)
+
+        for strategy in encoder.PNG_STRATEGIES:
+            self.png_strategy_menu.add_radiobutton(label=strategy.capitalize(),
+                                                   variable=self.save_options['PNG']['strategy'], value=strategy)
+
+        self.save_options_menu.add_separator()
+        self.jpeg_quality_menu = Menu(self.save_options_menu, tearoff=0)
+        self.save_options_menu.add_cascade(label='JPEG quality', menu=self.jpeg_quality_menu)
+        self.save_options_menu.add_checkbutton(label='JPEG progressive',
+                                               variable=self.save_options['JPEG']['progressive'])
+        self.save_options_menu.add_checkbutton(label='JPEG optimized', variable=self.save_options['JPEG']['optimize'])
+        self.save_options_menu.add_separator()
+        self.webp_quality_menu = Menu(self.save_options_menu, tearoff=0)
+        self.save_options_menu.add_cascade(label='WebP quality', menu=self.webp_quality_menu)
+        self.save_options_menu.add_checkbutton(label='WebP lossless', variable=self.save_options['WEBP']['lossless'])
+        self.save_options_menu.add_separator()
+        self.save_options_menu.add_checkbutton(label='Render frames in parallel', variable=self.parallel_frames)
+
+        for quality in self.available_qualities:
+            self.jpeg_quality_menu.add_radiobutton(label=str(quality), variable=self.save_options['JPEG']['quality'],
+                                                   value=quality)
+            self.webp_quality_menu.add_radiobutton(label=str(quality), variable=self.save_options['WEBP']['quality'],
+                                                   value=quality)
+
+        self.file_menu.add_command(label='Save project...', command=lambda: events.save_project(self)
+                                   if self.document else events.no_image_error())
+        self.file_menu.add_command(label='Close', accelerator='Ctrl+W', command=lambda: events.close_picture(self)
+                                   if self.document else events.no_image_error())
         self.file_menu.add_separator()
         self.file_menu.add_command(label='Exit', command=exit)
 
+        # Menu variables for undo/redo
+        self.edit_menu = Menu(self.menu_bar, tearoff=0)
+        self.menu_bar.add_cascade(label='Edit', menu=self.edit_menu)
+        self.edit_menu.add_command(label='Undo', accelerator='Ctrl+Z', command=lambda: events.undo(self)
+                                   if self.opened_image else events.no_image_error())
+        self.edit_menu.add_command(label='Redo', accelerator='Ctrl+Y', command=lambda: events.redo(self)
+                                   if self.opened_image else events.no_image_error())
+
         # Menu variables for operations
         self.operation_menu = Menu(self.menu_bar, tearoff=0)
         self.menu_bar.add_cascade(label='Operation', menu=self.operation_menu)
@@ -69,6 +158,9 @@ class Window(object):
         self.operation_menu.add_separator()
         self.operation_menu.add_command(label='Crop', command=lambda: Crop(self))
         self.operation_menu.add_command(label='Resize', command=lambda: events.resize_image(self))
+        self.operation_menu.add_separator()
+        self.operation_menu.add_command(label='Zoom view', command=lambda: events.open_viewport(self)
+                                        if self.opened_image else events.no_image_error())
 
         # Menu variables for filters
         self.filter_menu = Menu(self.menu_bar, tearoff=0)
@@ -81,6 +173,22 @@ class Window(object):
                                      if self.opened_image else events.no_image_error())
         self.filter_menu.add_command(label='Emboss', command=lambda: events.filter_emboss(self)
                                      if self.opened_image else events.no_image_error())
+        self.filter_menu.add_separator()
+        self.filter_menu.add_command(label='Brightness...', command=lambda: events.filter_brightness(self)
+                                     if self.opened_image else events.no_image_error())
+        self.filter_menu.add_command(label='Contrast...', command=lambda: events.filter_contrast(self)
+                                     if self.opened_image else events.no_image_error())
+        self.filter_menu.add_command(label='Gamma...', command=lambda: events.filter_gamma(self)
+                                     if self.opened_image else events.no_image_error())
+        self.filter_menu.add_command(label='Levels...', command=lambda: events.filter_levels(self)
+                                     if self.opened_image else events.no_image_error())
+        self.filter_menu.add_command(label='Curves...', command=lambda: events.filter_curves(self)
+                                     if self.opened_image else events.no_image_error())
+        self.filter_menu.add_separator()
+        self.filter_menu.add_command(label='Gaussian blur...', command=lambda: events.filter_gaussian_blur(self)
+                                     if self.opened_image else events.no_image_error())
+        self.filter_menu.add_command(label='Custom kernel...', command=lambda: events.filter_kernel(self)
+                                     if self.opened_image else events.no_image_error())
 
         # Menu variables for inserting
         self.insert_menu = Menu(self.menu_bar, tearoff=0)
@@ -88,8 +196,10 @@ class Window(object):
         self.insert_menu.add_command(label='Line', command=lambda: Line(self))
         self.insert_menu.add_command(label='Square', command=lambda: Square(self))
         self.insert_menu.add_command(label='Oval', command=lambda: Oval(self))
-        self.insert_menu.add_command(label='Image', command=lambda: events.start_image_insert(self))
-        self.insert_menu.add_command(label='Footer', command=lambda: events.insert_footer(self))
+        self.insert_menu.add_command(label='Image', command=lambda: events.start_image_insert(self)
+                                     if self.document else events.no_image_error())
+        self.insert_menu.add_command(label='Footer', command=lambda: events.insert_footer(self)
+                                     if self.document else events.no_image_error())
         self.insert_menu.add_separator()
         self.insert_menu.add_command(label='Line colour:  ▉', command=lambda: events.set_colour(self, True),
                                      foreground=self.line_colour)
@@ -108,6 +218,10 @@ class Window(object):
                                    if self.opened_image else events.no_image_error())
         self.exif_menu.add_command(label='Remove', command=lambda: events.remove_exif_data(self)
                                    if self.opened_image else events.no_image_error())
+        self.exif_menu.add_command(label='Remove from folder...', command=lambda: events.remove_folder_exif_data(self))
+        self.exif_menu.add_separator()
+        self.exif_menu.add_command(label='Index folder...', command=lambda: events.index_folder(self))
+        self.exif_menu.add_command(label='Search library...', command=lambda: events.open_library(self))
 
         # Menu variables for drawing
         self.draw_menu = Menu(self.menu_bar, tearoff=0)
@@ -125,7 +239,7 @@ class Window(object):
                                                 value=int(self.available_pen_widths[index]))
 
         # Unhandled bug - removing drawing causes error if image not set, left to allow drawing on nothing
-        self.draw_menu.add_command(label='Remove drawing', command=lambda: events.set_image(self, self.opened_image))
+        self.draw_menu.add_command(label='Remove drawing', command=lambda: events.remove_drawing(self))
 
         # Display of current action/state (None, Drawing, Cropping)
         self.menu_bar.add_command(label='State: None', state='disabled')
@@ -134,9 +248,30 @@ class Window(object):
         self.canvas = Canvas(self.root, width=1300, height=721, highlightthickness=0)
         self.canvas.pack(pady=10)
 
+        # Shows the image on the canvas, uploading only what changes
+        self.display = Display(self.canvas)
+
+        # Tabs of the open documents
+        self.tabs = TabBar(self)
+
+        # Collects pen motion into strokes drawn into a single layer over the image
+        self.stroke_engine = StrokeEngine(self)
+
+        # Runs full resolution renders, saves etc. in the background (Escape cancels the renders)
+        self.jobs = JobExecutor(self)
+        self.root.bind('<Escape>', lambda event: self.jobs.cancel('render', 'zoom'))
+
         # Re-size event binding allows centering of the canvas/image as window changes
         self.root.bind('<Configure>', lambda event: events.window_resize(event, self))
 
+        # Undo/redo keyboard shortcuts
+        self.root.bind('<Control-z>', lambda event: events.edit_shortcut(event, self, events.undo))
+        self.root.bind('<Control-y>', lambda event: events.edit_shortcut(event, self, events.redo))
+
+        # Tab shortcuts
+        self.root.bind('<Control-w>', lambda event: events.edit_shortcut(event, self, events.close_picture))
+        self.root.bind('<Control-Tab>', lambda event: events.edit_shortcut(event, self, events.next_document))
+
     # stores the current mouse position
     def update_mouse(self, event: Event) -> None:
         self.mouse["x"] = event.x